@@ -1,6 +1,16 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_delete, post_save
 
 
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        from api.catalog import (
+            invalidate_deleted_product, invalidate_saved_product
+        )
+
+        product_model = self.get_model('Product')
+        post_save.connect(invalidate_saved_product, sender=product_model)
+        post_delete.connect(invalidate_deleted_product, sender=product_model)
@@ -0,0 +1,140 @@
+import hashlib
+import time
+from urllib.parse import urlencode
+
+from api import conditional
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from rest_framework import status
+from rest_framework.response import Response
+
+
+DEFAULT_PRODUCT_CACHE_SETTINGS = {
+    'CACHE_ALIAS': 'default',
+    'TTL': 300,
+}
+
+NAMES_VERSION_KEY = 'api:catalog:names:version'
+HITS_KEY = 'api:catalog:hits'
+MISSES_KEY = 'api:catalog:misses'
+
+
+def get_product_cache_settings():
+    return {
+        **DEFAULT_PRODUCT_CACHE_SETTINGS,
+        **getattr(settings, 'PRODUCT_CACHE', {})
+    }
+
+
+def get_cache():
+    return caches[get_product_cache_settings()['CACHE_ALIAS']]
+
+
+def _get_version(cache, key):
+    # Versions start from the clock, so an evicted version never goes back
+    # to a value whose entries may still be cached.
+    version = cache.get(key)
+    if version is None:
+        version = time.time_ns()
+        if not cache.add(key, version, None):
+            version = cache.get(key, version)
+    return version
+
+
+def _bump_version(cache, key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Missing versions are created fresh by the next read.
+        pass
+
+
+def _count(cache, key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, None):
+            cache.incr(key)
+
+
+def names_version():
+    # Bumped when product names change and when products are created or
+    # deleted one by one, for the search index.
+    return _get_version(get_cache(), NAMES_VERSION_KEY)
+
+
+def _hash(*parts):
+    value = ':'.join(str(part) for part in parts)
+    return hashlib.md5(value.encode()).hexdigest()
+
+
+# Responses are keyed by the ETag of the rows they render, read from the
+# database, so a process never serves an entry built from older rows even
+# when the cache isn't shared.
+def list_key(request, etag):
+    return f'api:catalog:list:{_hash(request.build_absolute_uri(), etag)}'
+
+
+def product_key(request, pk, etag):
+    # Filters apply to retrieve too, so the query string is part of the key.
+    query = urlencode(sorted(request.query_params.lists()), doseq=True)
+    return f'api:catalog:product:{pk}:{_hash(query, etag)}'
+
+
+def cached_response(request, key, build):
+    """
+    Serves the data and ETag cached under `key`, or stores the ones of the
+    successful response returned by `build`.
+    """
+    config = get_product_cache_settings()
+    if not config['TTL']:
+        return build()
+
+    cache = get_cache()
+    entry = cache.get(key)
+    if entry is not None:
+        _count(cache, HITS_KEY)
+        data, etag = entry
+        if conditional.is_not_modified(request, etag):
+            return conditional.not_modified_response(etag)
+        return Response(data, headers={'ETag': etag} if etag else None)
+
+    _count(cache, MISSES_KEY)
+    response = build()
+    if response.status_code == status.HTTP_200_OK:
+        cache.set(key, (response.data, response.get('ETag')), config['TTL'])
+    return response
+
+
+def get_stats():
+    cache = get_cache()
+    hits = cache.get(HITS_KEY, 0)
+    misses = cache.get(MISSES_KEY, 0)
+    requests = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': hits / requests if requests else None,
+    }
+
+
+def _invalidate_names():
+    _bump_version(get_cache(), NAMES_VERSION_KEY)
+
+
+def invalidate_names():
+    # Invalidated right away and once more on commit, so an index built
+    # by readers that saw the previous rows meanwhile is dropped as well.
+    _invalidate_names()
+    transaction.on_commit(_invalidate_names)
+
+
+def invalidate_saved_product(sender, instance, created, **kwargs):
+    # Stock and reservation changes keep the search index.
+    if created or getattr(instance, '_loaded_name', None) != instance.name:
+        invalidate_names()
+
+
+def invalidate_deleted_product(sender, instance, **kwargs):
+    invalidate_names()
@@ -0,0 +1,97 @@
+import hashlib
+
+from api import enums
+from api.utils import CustomValidationError
+from django.utils.http import parse_etags, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+
+def make_etag(*parts):
+    value = ':'.join(str(part) for part in parts)
+    return quote_etag(hashlib.md5(value.encode()).hexdigest())
+
+
+def _strip_weak(etag):
+    return etag[2:] if etag.startswith('W/') else etag
+
+
+def is_not_modified(request, etag):
+    header = request.META.get('HTTP_IF_NONE_MATCH')
+    if not header or etag is None:
+        return False
+
+    etags = parse_etags(header)
+    return '*' in etags or etag in [_strip_weak(value) for value in etags]
+
+
+def check_precondition(request, etag):
+    # If-Match uses the strong comparison, weak tags never match.
+    header = request.META.get('HTTP_IF_MATCH')
+    if not header:
+        return
+
+    etags = parse_etags(header)
+    if '*' not in etags and etag not in etags:
+        raise CustomValidationError(
+            enums.Errors.PRECONDITION_FAILED_ERROR.value,
+            status.HTTP_412_PRECONDITION_FAILED
+        )
+
+
+def not_modified_response(etag):
+    return Response(
+        status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag}
+    )
+
+
+def conditional_response(request, get_etag, build):
+    """
+    Answers 304 when If-None-Match matches `get_etag()` without calling
+    `build`, otherwise tags the response built by it.
+    """
+    etag = get_etag()
+    if is_not_modified(request, etag):
+        return not_modified_response(etag)
+
+    response = build()
+    if etag and response.status_code == status.HTTP_200_OK:
+        response['ETag'] = etag
+    return response
+
+
+class ConditionalUpdateMixin:
+    """
+    Rejects PUT/PATCH with 412 when If-Match doesn't match the current ETag
+    of the object, which is locked until the update is done, and returns
+    the new ETag. Views define `get_etag(instance)`, and override
+    `get_updated_etag(instance)` when the update touches related rows.
+    """
+    CONDITIONAL_ACTIONS = ['update', 'partial_update']
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if (
+            self.action in self.CONDITIONAL_ACTIONS and
+            'HTTP_IF_MATCH' in self.request.META
+        ):
+            queryset = queryset.select_for_update(of=('self', ))
+        return queryset
+
+    def get_object(self):
+        instance = super().get_object()
+        if self.action in self.CONDITIONAL_ACTIONS:
+            check_precondition(self.request, self.get_etag(instance))
+        return instance
+
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        self.updated_etag = self.get_updated_etag(serializer.instance)
+
+    def get_updated_etag(self, instance):
+        return self.get_etag(instance)
+
+    def update(self, request, *args, **kwargs):
+        response = super().update(request, *args, **kwargs)
+        response['ETag'] = self.updated_etag
+        return response
@@ -0,0 +1,138 @@
+import threading
+import time
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    """
+    Thread safe pool of at most `max_size` open DB-API connections. get()
+    waits up to `timeout` seconds for one to be returned when they are all
+    in use. Connections idle for more than `max_idle` seconds, or failing
+    `check`, are closed instead of reused.
+    """
+
+    def __init__(self, max_size=10, timeout=5, max_idle=300, check=None):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.check = check
+        self._condition = threading.Condition()
+        # (connection, returned_at), the last returned one at the end.
+        self._idle = []
+        self._size = 0
+        # Generation each checked out connection was handed out in, by id.
+        # close_all() starts a new one, older connections are closed when
+        # they are returned.
+        self._generation = 0
+        self._in_use = {}
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def idle(self):
+        return len(self._idle)
+
+    def get(self, connect):
+        deadline = time.monotonic() + self.timeout
+        while True:
+            connection, returned_at = self._checkout(deadline)
+            if connection is None:
+                connection = self._open(connect)
+            elif time.monotonic() - returned_at > self.max_idle or (
+                self.check is not None and not self.check(connection)
+            ):
+                self._discard(connection)
+                continue
+            with self._condition:
+                self._in_use[id(connection)] = self._generation
+            return connection
+
+    def put(self, connection, reset=None):
+        # `reset` returns False when the connection can't be reused.
+        with self._condition:
+            generation = self._in_use.pop(id(connection), self._generation)
+        if generation != self._generation or (
+            reset is not None and not reset(connection)
+        ):
+            self._discard(connection)
+            return
+        with self._condition:
+            self._idle.append((connection, time.monotonic()))
+            self._condition.notify()
+
+    def close_all(self):
+        # Closes the idle connections, the ones in use are closed when
+        # they are returned.
+        with self._condition:
+            idle = self._idle
+            self._idle = []
+            self._size -= len(idle)
+            self._generation += 1
+            self._condition.notify_all()
+        for connection, _ in idle:
+            self._close(connection)
+
+    def _checkout(self, deadline):
+        with self._condition:
+            while True:
+                if self._idle:
+                    return self._idle.pop()
+                if self._size < self.max_size:
+                    # The slot is taken before connecting, outside the lock.
+                    self._size += 1
+                    return None, None
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolTimeout(
+                        f"No connection was returned to the pool in "
+                        f"{self.timeout} seconds."
+                    )
+                self._condition.wait(remaining)
+
+    def _open(self, connect):
+        try:
+            return connect()
+        except Exception:
+            self._release_slot()
+            raise
+
+    def _discard(self, connection):
+        self._close(connection)
+        self._release_slot()
+
+    def _release_slot(self):
+        with self._condition:
+            self._size -= 1
+            self._condition.notify()
+
+    def _close(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(key, build):
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = _pools[key] = build()
+    return pool
+
+
+def close_all():
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        pool.close_all()
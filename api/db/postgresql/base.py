@@ -0,0 +1,131 @@
+from api.db import pool as pools
+from django.db.backends.postgresql import base, creation
+from psycopg2 import extensions
+
+
+DEFAULT_POOL_SETTINGS = {
+    'MAX_SIZE': 0,
+    'TIMEOUT': 5,
+    'MAX_IDLE': 300,
+}
+
+
+def _ping(connection):
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        connection.rollback()
+    except base.Database.Error:
+        return False
+    return True
+
+
+def _reset(connection):
+    # Pooled connections go back without an open transaction.
+    if connection.closed:
+        return False
+    try:
+        if (
+            connection.info.transaction_status !=
+            extensions.TRANSACTION_STATUS_IDLE
+        ):
+            connection.rollback()
+        return (
+            connection.info.transaction_status ==
+            extensions.TRANSACTION_STATUS_IDLE
+        )
+    except base.Database.Error:
+        return False
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+    def _destroy_test_db(self, test_database_name, verbosity):
+        # Pooled connections would keep the test database in use.
+        pools.close_all()
+        super()._destroy_test_db(test_database_name, verbosity)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    PostgreSQL backend adding CONN_HEALTH_CHECKS, as found in later Django
+    versions, and an in-process pool shared by the threads of the process
+    when POOL['MAX_SIZE'] is set. Closed connections are returned to the
+    pool instead of closing them, so use it with CONN_MAX_AGE = 0.
+    """
+    creation_class = DatabaseCreation
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.health_check_done = False
+        self.pool = None
+
+    @property
+    def health_check_enabled(self):
+        return self.settings_dict.get('CONN_HEALTH_CHECKS', False)
+
+    def get_pool_settings(self):
+        return {
+            **DEFAULT_POOL_SETTINGS,
+            **(self.settings_dict.get('POOL') or {})
+        }
+
+    def get_new_connection(self, conn_params):
+        config = self.get_pool_settings()
+        if not config['MAX_SIZE']:
+            self.pool = None
+            return super().get_new_connection(conn_params)
+
+        # One pool per database and credentials, test databases included.
+        self.pool = pools.get_pool(
+            repr(sorted(conn_params.items())),
+            lambda: pools.ConnectionPool(
+                max_size=config['MAX_SIZE'], timeout=config['TIMEOUT'],
+                max_idle=config['MAX_IDLE'],
+                check=_ping if self.health_check_enabled else None
+            )
+        )
+        connection = self.pool.get(
+            lambda: super(DatabaseWrapper, self).get_new_connection(
+                conn_params
+            )
+        )
+        self.isolation_level = self.settings_dict['OPTIONS'].get(
+            'isolation_level', connection.isolation_level
+        )
+        return connection
+
+    def _close(self):
+        if self.pool is None or self.connection is None:
+            return super()._close()
+        with self.wrap_database_errors:
+            self.pool.put(self.connection, reset=_reset)
+
+    def connect(self):
+        # Fresh connections aren't checked, not even by set_autocommit().
+        self.health_check_done = True
+        super().connect()
+
+    def _cursor(self, name=None):
+        self.close_if_health_check_failed()
+        return super()._cursor(name)
+
+    def set_autocommit(self, *args, **kwargs):
+        # Transactions of ATOMIC_REQUESTS start here, before any cursor.
+        self.close_if_health_check_failed()
+        return super().set_autocommit(*args, **kwargs)
+
+    def close_if_health_check_failed(self):
+        # Persistent connections are checked once per request, before their
+        # first use, as long as no transaction is open on them.
+        if (
+            self.connection is None or self.health_check_done or
+            not self.health_check_enabled or self.in_atomic_block
+        ):
+            return
+        self.health_check_done = True
+        if not self.is_usable():
+            self.close()
+
+    def close_if_unusable_or_obsolete(self):
+        super().close_if_unusable_or_obsolete()
+        self.health_check_done = False
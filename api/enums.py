@@ -2,13 +2,24 @@ from enum import Enum
 
 
 class Errors(Enum):
+    BULK_ORDER_FORMAT_ERROR = "A list of orders is expected."
+    BULK_ORDER_SIZE_ERROR = "At most {} orders can be created at once."
     DUPLICATED_PRODUCT_ERROR = "A product is duplicated on the same Order."
+    IDEMPOTENCY_KEY_REUSED_ERROR = "This Idempotency-Key was already used with a different request."
     INTEGRITY_PRODUCT_ERROR = "Problems saving the Product due integrity."
+    INVALID_BOOLEAN_ERROR = "{} must be true or false."
+    INVALID_EXPAND_ERROR = "Unknown values for expand: {}."
+    INVALID_FIELDS_ERROR = "Unknown fields: {}."
+    INVALID_NUMBER_ERROR = "{} must be a number."
     MISSING_ORDER_ERROR = "No Order was found for the given id."
+    MISSING_PRODUCT_ERROR = 'Invalid pk "{pk_value}" - object does not exist.'
+    PRODUCT_PK_TYPE_ERROR = "Incorrect type. Expected pk value, received {data_type}."
     GREATER_EQUAL_ZERO_ERROR = "Value must be greater or equal than zero."
     GREATER_ZERO_ERROR = "Value must be greater or equal than zero."
     NOT_EDITABLE_ORDER_ERROR = "Order cant be modified at this point."
+    PRECONDITION_FAILED_ERROR = "The resource was modified, fetch it again before updating it."
     PRODUCT_NOT_AVAILABLE_ERROR = "The requested product is not available."
     PROTECTED_PRODUCT_ERROR = "You can't delete this Product because it have some references."
     STOCK_AVAILABILITY_ERROR = "This order cant be supplied due stock availability."
     ORDER_ALREADY_CANCELLED = "Already cancelled."
+    ORDER_CANCEL_STOCK_AVAILABILITY_ERROR = "This order cant be cancelled due stock availability."
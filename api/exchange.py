@@ -0,0 +1,202 @@
+import json
+import logging
+import threading
+import time
+
+from api.utils import get_http_session
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.utils.module_loading import import_string
+from rest_framework import status
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EXCHANGE_RATE_SETTINGS = {
+    'PROVIDER': 'api.exchange.DolarSiExchangeRateProvider',
+    'OPTIONS': {},
+    'TTL': 300,
+    'STALE_TTL': 3600,
+    'CACHE_ALIAS': None,
+    'SNAPSHOT_MAX_AGE': 300,
+}
+
+
+class ExchangeRateError(Exception):
+    pass
+
+
+class BaseExchangeRateProvider:
+    def get_rate(self):
+        raise NotImplementedError
+
+
+class DolarSiExchangeRateProvider(BaseExchangeRateProvider):
+    URL = "https://www.dolarsi.com/api/api.php?type=valoresprincipales"
+    RATE_NAME = 'Dolar Blue'
+
+    def __init__(self, timeout=10):
+        self.timeout = timeout
+
+    def get_rate(self):
+        response = get_http_session().get(
+            url=self.URL,
+            timeout=self.timeout
+        )
+
+        if response.status_code != status.HTTP_200_OK:
+            raise ExchangeRateError("We can't get exchange rate from service.")
+
+        data = json.loads(response.content)
+        for d in data:
+            if not ('casa' in d and d['casa']):
+                raise ExchangeRateError("Wrong format on exchange response.")
+            if not ('nombre' in d['casa'] and 'compra' in d['casa']):
+                raise ExchangeRateError("Wrong format on exchange response.")
+            if d['casa']['nombre'] == self.RATE_NAME:
+                return float(d['casa']['compra'].replace(',', '.'))
+        raise ExchangeRateError("Expected change not found.")
+
+
+class StubExchangeRateProvider(BaseExchangeRateProvider):
+    def __init__(self, rate=1):
+        self.rate = rate
+
+    def get_rate(self):
+        return float(self.rate)
+
+
+class CachedExchangeRateProvider(BaseExchangeRateProvider):
+    """
+    Wraps a provider with a TTL cache. Values older than `ttl` but younger
+    than `ttl + stale_ttl` are served while a single background refresh runs.
+    """
+    CACHE_KEY = 'api:exchange_rate'
+    LOCK_KEY = 'api:exchange_rate:lock'
+
+    def __init__(self, provider, ttl=300, stale_ttl=3600, cache_alias=None):
+        self.provider = provider
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.cache = caches[cache_alias] if cache_alias else None
+        self._entry = None
+        self._fetch_lock = threading.Lock()
+        self._refresh_thread = None
+
+    def get_rate(self):
+        entry = self._get_entry()
+        if entry:
+            rate, fetched_at = entry
+            age = time.time() - fetched_at
+            if age < self.ttl:
+                return rate
+            if age < self.ttl + self.stale_ttl:
+                self._refresh_in_background()
+                return rate
+        return self._refresh()
+
+    def _get_entry(self):
+        entry = self._entry
+        if self.cache is None:
+            return entry
+
+        shared = self.cache.get(self.CACHE_KEY)
+        if shared and (entry is None or shared[1] > entry[1]):
+            self._entry = entry = tuple(shared)
+        return entry
+
+    def _set_entry(self, rate):
+        self._entry = (rate, time.time())
+        if self.cache is not None:
+            self.cache.set(
+                self.CACHE_KEY, self._entry, self.ttl + self.stale_ttl
+            )
+
+    def _is_fresh(self, entry):
+        return entry and time.time() - entry[1] < self.ttl
+
+    def _refresh(self):
+        # Concurrent callers wait here and reuse the value fetched by the
+        # first one instead of hitting the upstream service again.
+        with self._fetch_lock:
+            entry = self._get_entry()
+            if self._is_fresh(entry):
+                return entry[0]
+
+            rate = self.provider.get_rate()
+            self._set_entry(rate)
+            return rate
+
+    def _refresh_in_background(self):
+        if not self._fetch_lock.acquire(blocking=False):
+            return
+
+        if self.cache is not None and not self.cache.add(
+            self.LOCK_KEY, True, self.provider_timeout
+        ):
+            self._fetch_lock.release()
+            return
+
+        self._refresh_thread = threading.Thread(
+            target=self._background_refresh, daemon=True
+        )
+        self._refresh_thread.start()
+
+    def _background_refresh(self):
+        try:
+            self._set_entry(self.provider.get_rate())
+        except Exception:
+            logger.exception("Background exchange rate refresh failed.")
+        finally:
+            if self.cache is not None:
+                self.cache.delete(self.LOCK_KEY)
+            self._fetch_lock.release()
+
+    @property
+    def provider_timeout(self):
+        return getattr(self.provider, 'timeout', None) or self.ttl
+
+
+def get_exchange_rate_settings():
+    return {
+        **DEFAULT_EXCHANGE_RATE_SETTINGS,
+        **getattr(settings, 'EXCHANGE_RATE', {})
+    }
+
+
+def build_exchange_rate_provider(cached=True):
+    config = get_exchange_rate_settings()
+    provider_class = import_string(config['PROVIDER'])
+    provider = provider_class(**config['OPTIONS'])
+    if not (cached and config['TTL']):
+        return provider
+
+    return CachedExchangeRateProvider(
+        provider,
+        ttl=config['TTL'],
+        stale_ttl=config['STALE_TTL'],
+        cache_alias=config['CACHE_ALIAS']
+    )
+
+
+_provider = None
+_provider_lock = threading.Lock()
+
+
+def get_exchange_rate_provider():
+    global _provider
+    if _provider is None:
+        with _provider_lock:
+            if _provider is None:
+                _provider = build_exchange_rate_provider()
+    return _provider
+
+
+def reset_exchange_rate_provider(**kwargs):
+    global _provider
+    if kwargs.get('setting', 'EXCHANGE_RATE') == 'EXCHANGE_RATE':
+        _provider = None
+
+
+setting_changed.connect(reset_exchange_rate_provider)
@@ -0,0 +1,110 @@
+import csv
+import json
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+
+
+ORDER_EXPORT_COLUMNS = [
+    ('order_id', 'id'),
+    ('status', 'status'),
+    ('movement_type', 'movement_type'),
+    ('created_at', 'created_at'),
+    ('exchange_rate', 'exchange_rate'),
+    ('detail_id', 'orderdetail__id'),
+    ('product_id', 'orderdetail__product_id'),
+    ('product_name', 'orderdetail__product__name'),
+    ('quantity', 'orderdetail__quantity'),
+    ('price', 'orderdetail__product__price'),
+]
+
+PRODUCT_EXPORT_COLUMNS = [
+    ('id', 'id'),
+    ('name', 'name'),
+    ('price', 'price'),
+    ('stock', 'stock'),
+    ('available', 'available'),
+    ('created_at', 'created_at'),
+    ('updated_at', 'updated_at'),
+]
+
+
+def _encode_value(value):
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
+
+
+class _Echo:
+    def write(self, value):
+        return value
+
+
+class NDJSONRowEncoder:
+    content_type = 'application/x-ndjson'
+    extension = 'ndjson'
+
+    def __init__(self, names):
+        self.names = names
+
+    def header(self):
+        return ''
+
+    def encode(self, row):
+        return json.dumps(
+            dict(zip(self.names, map(_encode_value, row))),
+            separators=(',', ':')
+        ) + '\n'
+
+
+class CSVRowEncoder:
+    content_type = 'text/csv'
+    extension = 'csv'
+
+    def __init__(self, names):
+        self.names = names
+        self.writer = csv.writer(_Echo())
+
+    def header(self):
+        return self.writer.writerow(self.names)
+
+    def encode(self, row):
+        return self.writer.writerow([_encode_value(value) for value in row])
+
+
+EXPORT_ENCODERS = {
+    'ndjson': NDJSONRowEncoder,
+    'csv': CSVRowEncoder,
+}
+
+
+def _stream_rows(queryset, encoder, chunk_size):
+    header = encoder.header()
+    if header:
+        yield header
+
+    # Rows are joined per chunk so each write carries a reasonable payload.
+    lines = []
+    for row in queryset.iterator(chunk_size=chunk_size):
+        lines.append(encoder.encode(row))
+        if len(lines) >= chunk_size:
+            yield ''.join(lines)
+            lines = []
+    if lines:
+        yield ''.join(lines)
+
+
+def export_response(queryset, columns, name, output='ndjson'):
+    encoder_class = EXPORT_ENCODERS.get(output, NDJSONRowEncoder)
+    encoder = encoder_class([column for column, _ in columns])
+    chunk_size = getattr(settings, 'EXPORT_CHUNK_SIZE', 2000)
+    rows = queryset.values_list(*[lookup for _, lookup in columns])
+
+    response = StreamingHttpResponse(
+        _stream_rows(rows, encoder, chunk_size),
+        content_type=encoder.content_type
+    )
+    response['Content-Disposition'] = (
+        f'attachment; filename="{name}.{encoder.extension}"'
+    )
+    return response
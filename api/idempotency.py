@@ -0,0 +1,109 @@
+import functools
+import hashlib
+import json
+from datetime import timedelta
+
+from api import enums
+from api.models import IdempotencyKey
+from api.utils import http_error_response
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+
+HEADER = 'HTTP_IDEMPOTENCY_KEY'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+STORED_HEADERS = ['Location']
+
+
+def _hash(value):
+    return hashlib.sha256(value.encode()).hexdigest()
+
+
+def _get_key(request, key):
+    # Keys are scoped to the user and the endpoint they were sent to.
+    return _hash(
+        f'{request.user.pk}:{request.method}:{request.path}:{key}'
+    )
+
+
+def _get_fingerprint(request):
+    return _hash(
+        request.GET.urlencode() +
+        json.dumps(request.data, sort_keys=True, default=str)
+    )
+
+
+def _claim(key, fingerprint):
+    """
+    Inserts the key, or returns the row stored for it. A concurrent insert
+    of the same key waits on the unique index until the first request
+    commits, and then gets its stored response.
+    """
+    expires_at = timezone.now() + timedelta(
+        seconds=getattr(settings, 'IDEMPOTENCY_KEY_TTL', 86400)
+    )
+    try:
+        with transaction.atomic():
+            return IdempotencyKey.objects.create(
+                key=key, fingerprint=fingerprint, expires_at=expires_at
+            ), True
+    except IntegrityError:
+        pass
+
+    stored = IdempotencyKey.objects.select_for_update().get(key=key)
+    if stored.expires_at <= timezone.now():
+        stored.fingerprint = fingerprint
+        stored.expires_at = expires_at
+        stored.response_status = None
+        stored.response_body = None
+        stored.response_headers = {}
+        stored.save()
+        return stored, True
+    return stored, False
+
+
+def _replay(stored):
+    response = Response(
+        stored.response_body, status=stored.response_status,
+        headers=stored.response_headers
+    )
+    response[REPLAYED_HEADER] = 'true'
+    return response
+
+
+def idempotent(view_method):
+    """
+    Honours the Idempotency-Key header: the first response sent for a key
+    is stored with the changes it made, and repeats get it replayed.
+    """
+    @functools.wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.META.get(HEADER)
+        if not key:
+            return view_method(self, request, *args, **kwargs)
+
+        fingerprint = _get_fingerprint(request)
+        with transaction.atomic():
+            stored, claimed = _claim(_get_key(request, key), fingerprint)
+            if not claimed:
+                if stored.fingerprint != fingerprint:
+                    return http_error_response(
+                        enums.Errors.IDEMPOTENCY_KEY_REUSED_ERROR.value,
+                        status.HTTP_422_UNPROCESSABLE_ENTITY
+                    )
+                return _replay(stored)
+
+            response = view_method(self, request, *args, **kwargs)
+            stored.response_status = response.status_code
+            stored.response_body = response.data
+            stored.response_headers = {
+                header: response[header]
+                for header in STORED_HEADERS if response.has_header(header)
+            }
+            stored.save()
+        return response
+
+    return wrapper
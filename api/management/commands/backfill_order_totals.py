@@ -0,0 +1,74 @@
+from bisect import bisect_right
+
+from api.models import ExchangeRate, Order
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+
+class Command(BaseCommand):
+    help = (
+        "Stamps exchange rate and totals on processed or cancelled orders "
+        "that were never stamped."
+    )
+
+    STAMPED_FIELDS = ['exchange_rate', 'processed_total', 'processed_usd_total']
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--rate', type=float, default=None,
+            help="Use this rate instead of the stored snapshots."
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        snapshots = list(
+            ExchangeRate.objects.order_by('created_at').values_list(
+                'created_at', 'rate'
+            )
+        )
+        if options['rate'] is None and not snapshots:
+            raise CommandError(
+                "No exchange rate snapshots stored, run "
+                "refresh_exchange_rates or pass --rate."
+            )
+
+        snapshot_dates = [created_at for created_at, _ in snapshots]
+        queryset = Order.objects.filter(
+            processed_total__isnull=True
+        ).exclude(
+            status=Order.OrderStatus.DRAFT.value
+        ).with_total().order_by('id')
+
+        last_id = 0
+        stamped = 0
+        while True:
+            batch = list(queryset.filter(id__gt=last_id)[:batch_size])
+            if not batch:
+                break
+
+            for order in batch:
+                rate = options['rate']
+                if rate is None:
+                    # Rate in force when the order last changed, or the
+                    # oldest one we know for orders older than any snapshot.
+                    index = bisect_right(snapshot_dates, order.updated_at)
+                    rate = snapshots[max(index - 1, 0)][1]
+                order.stamp_totals(rate=rate, total=order.details_total)
+
+            # Stamped totals change how the orders are rendered, their
+            # ETags follow updated_at.
+            updated_at = timezone.now()
+            for order in batch:
+                order.updated_at = updated_at
+            with transaction.atomic():
+                Order.objects.bulk_update(
+                    batch, self.STAMPED_FIELDS + ['updated_at']
+                )
+
+            stamped += len(batch)
+            last_id = batch[-1].id
+            self.stdout.write(f"Stamped {stamped} orders.")
+
+        self.stdout.write(self.style.SUCCESS(f"Done, {stamped} orders stamped."))
@@ -0,0 +1,85 @@
+import copy
+import threading
+import time
+
+from api.db import pool as pools
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.utils import load_backend
+
+
+MODES = {
+    'new connection per request': {'CONN_MAX_AGE': 0, 'POOL_SIZE': 0},
+    'persistent connections': {'CONN_MAX_AGE': 600, 'POOL_SIZE': 0},
+    'pooled connections': {'CONN_MAX_AGE': 0, 'POOL_SIZE': None},
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares request throughput opening a connection per request, "
+        "with persistent connections and with the api.db.postgresql pool. "
+        "Each request runs the request_started/finished connection handling "
+        "around a single query."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--threads', type=int, default=4)
+        parser.add_argument(
+            '--pool-size', type=int, default=None,
+            help="Defaults to --threads."
+        )
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        per_thread = max(options['requests'] // options['threads'], 1)
+        requests = per_thread * options['threads']
+        for label, mode in MODES.items():
+            settings_dict = copy.deepcopy(
+                connections.settings[options['database']]
+            )
+            settings_dict['ENGINE'] = 'api.db.postgresql'
+            settings_dict['CONN_MAX_AGE'] = mode['CONN_MAX_AGE']
+            settings_dict['POOL'] = {
+                **(settings_dict.get('POOL') or {}),
+                'MAX_SIZE': (
+                    mode['POOL_SIZE'] if mode['POOL_SIZE'] is not None
+                    else options['pool_size'] or options['threads']
+                ),
+            }
+            elapsed = self._run(settings_dict, options['threads'], per_thread)
+            self.stdout.write(
+                f"{label}: {requests / elapsed:.1f} req/s, "
+                f"{elapsed * 1000 / requests:.2f} ms per request"
+            )
+        pools.close_all()
+
+    def _run(self, settings_dict, thread_count, per_thread):
+        backend = load_backend(settings_dict['ENGINE'])
+
+        def worker():
+            connection = backend.DatabaseWrapper(
+                settings_dict, alias='benchmark'
+            )
+            try:
+                for _ in range(per_thread):
+                    # What request_started and request_finished do.
+                    connection.close_if_unusable_or_obsolete()
+                    with connection.cursor() as cursor:
+                        cursor.execute('SELECT 1')
+                        cursor.fetchone()
+                    connection.close_if_unusable_or_obsolete()
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=worker)
+            for _ in range(thread_count)
+        ]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - started
@@ -0,0 +1,239 @@
+import json
+import random
+import statistics
+import time
+
+from api.models import Order, Product
+from api.serializers import OrderBulkSerializer
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+
+BENCHMARK_USER_EMAIL = 'benchmark@example.com'
+
+
+class Command(BaseCommand):
+    help = (
+        "Times the order lifecycle endpoints over seeded products and "
+        "orders, with the exchange rate stubbed, and compares latency and "
+        "query counts with a baseline. Everything is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=1000)
+        parser.add_argument('--orders', type=int, default=200)
+        parser.add_argument('--lines', type=int, default=5)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--output', help="Write the results to this JSON file."
+        )
+        parser.add_argument(
+            '--baseline', help="Compare the results with this JSON file."
+        )
+        parser.add_argument(
+            '--tolerance', type=float, default=0.5,
+            help="Allowed median latency increase over the baseline."
+        )
+
+    def handle(self, *args, **options):
+        if options['orders'] < 2 * options['repeat'] + 1:
+            raise CommandError("--orders must be at least 2 * --repeat + 1.")
+        if options['products'] < options['lines'] + options['repeat']:
+            raise CommandError(
+                "--products must be at least --lines + --repeat."
+            )
+
+        overrides = {
+            'ALLOWED_HOSTS': [*settings.ALLOWED_HOSTS, 'testserver'],
+            'EXCHANGE_RATE': {
+                **getattr(settings, 'EXCHANGE_RATE', {}),
+                'PROVIDER': 'api.exchange.StubExchangeRateProvider',
+                'OPTIONS': {},
+            },
+        }
+        with override_settings(**overrides), transaction.atomic():
+            self.generator = random.Random(options['seed'])
+            self.client = APIClient()
+            self.client.force_authenticate(self._get_user())
+            self._seed(options)
+            results = self._run(options)
+            transaction.set_rollback(True)
+
+        report = {
+            'settings': {
+                name: options[name]
+                for name in ['products', 'orders', 'lines', 'repeat']
+            },
+            'results': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2, sort_keys=True)
+        if options['baseline']:
+            self._compare(report, options)
+
+    def _get_user(self):
+        user, _ = get_user_model().objects.get_or_create(
+            email=BENCHMARK_USER_EMAIL,
+            defaults={'staff': True, 'admin': True}
+        )
+        return user
+
+    def _seed(self, options):
+        products = Product.objects.bulk_create([
+            Product(
+                name=f'Benchmark product {index}',
+                price=round(self.generator.uniform(1, 1000), 2),
+                stock=options['orders'] * options['lines'] * 10,
+                available=True
+            ) for index in range(options['products'])
+        ])
+        self.product_ids = [product.id for product in products]
+
+        self.order_ids = []
+        items = [self._order_item(options) for _ in range(options['orders'])]
+        for start in range(0, len(items), options['batch_size']):
+            results = OrderBulkSerializer.bulk_create(
+                items[start:start + options['batch_size']]
+            )
+            self.order_ids.extend(result['id'] for result in results)
+
+    def _order_item(self, options):
+        return {
+            'movement_type': Order.MovementStatus.EGRESS.value,
+            'details': [
+                {
+                    'product': product_id,
+                    'quantity': self.generator.randint(1, 5)
+                } for product_id in self.generator.sample(
+                    self.product_ids, options['lines']
+                )
+            ],
+        }
+
+    def _run(self, options):
+        repeat = options['repeat']
+        process_ids = self.order_ids[:repeat]
+        cancel_ids = self.order_ids[repeat:2 * repeat]
+        order_id = self.order_ids[-1]
+        used_product_ids = set(Order.objects.get(
+            id=order_id
+        ).orderdetail_set.values_list('product', flat=True))
+        free_product_ids = [
+            product_id for product_id in self.product_ids
+            if product_id not in used_product_ids
+        ]
+
+        cases = [
+            ('product list', lambda _: self.client.get(
+                reverse('api:product-list')
+            )),
+            ('product list uncached', lambda _: self._uncached(
+                lambda: self.client.get(reverse('api:product-list'))
+            )),
+            ('order list', lambda _: self.client.get(
+                reverse('api:order-list')
+            )),
+            ('order retrieve', lambda _: self.client.get(
+                reverse('api:order-detail', args=[order_id])
+            )),
+            ('order create', lambda _: self.client.post(
+                reverse('api:order-list'), self._order_item(options),
+                format='json'
+            )),
+            ('order bulk create', lambda _: self.client.post(
+                reverse('api:order-bulk'),
+                [self._order_item(options) for _ in range(
+                    options['batch_size']
+                )],
+                format='json'
+            )),
+            ('detail add', lambda index: self.client.post(
+                reverse('api:order-detail-list', args=[order_id]),
+                {'product': free_product_ids[index], 'quantity': 1},
+                format='json'
+            )),
+            ('order process', lambda index: self.client.post(
+                reverse('api:order-process', args=[process_ids[index]])
+            )),
+            ('order cancel', lambda index: self.client.post(
+                reverse('api:order-cancel', args=[cancel_ids[index]])
+            )),
+        ]
+        results = {}
+        for label, send in cases:
+            results[label] = self._measure(label, send, repeat)
+            self.stdout.write(
+                f"{label}: median {results[label]['median_ms']:.2f} ms, "
+                f"p95 {results[label]['p95_ms']:.2f} ms, "
+                f"{results[label]['throughput']:.1f} req/s, "
+                f"{results[label]['queries']} queries"
+            )
+        return results
+
+    def _uncached(self, send):
+        with override_settings(PRODUCT_CACHE={'TTL': 0}):
+            return send()
+
+    def _measure(self, label, send, repeat):
+        timings = []
+        queries = []
+        for index in range(repeat):
+            with CaptureQueriesContext(connection) as context:
+                started = time.perf_counter()
+                response = send(index)
+                timings.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                raise CommandError(
+                    f"{label} answered {response.status_code}: "
+                    f"{response.content[:200]}"
+                )
+            queries.append(len(context))
+
+        timings.sort()
+        return {
+            'median_ms': statistics.median(timings) * 1000,
+            'p95_ms': timings[int(0.95 * (len(timings) - 1))] * 1000,
+            'max_ms': timings[-1] * 1000,
+            'throughput': len(timings) / sum(timings),
+            'queries': max(queries),
+        }
+
+    def _compare(self, report, options):
+        with open(options['baseline']) as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline.get('settings') != report['settings']:
+            self.stdout.write(self.style.WARNING(
+                "Baseline was recorded with other settings: "
+                f"{baseline.get('settings')}."
+            ))
+
+        regressions = []
+        for label, result in report['results'].items():
+            expected = baseline.get('results', {}).get(label)
+            if expected is None:
+                continue
+            if result['queries'] > expected['queries']:
+                regressions.append(
+                    f"{label}: {result['queries']} queries, baseline "
+                    f"{expected['queries']}"
+                )
+            limit = expected['median_ms'] * (1 + options['tolerance'])
+            if result['median_ms'] > limit:
+                regressions.append(
+                    f"{label}: median {result['median_ms']:.2f} ms, baseline "
+                    f"{expected['median_ms']:.2f} ms"
+                )
+
+        if regressions:
+            raise CommandError(
+                "Regressions against the baseline:\n" + '\n'.join(regressions)
+            )
+        self.stdout.write(self.style.SUCCESS("No regressions."))
@@ -0,0 +1,86 @@
+import random
+import statistics
+import time
+
+from api import catalog
+from api.management.words import WORDS
+from api.models import Product, StockMovement
+from api.search import search_products
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+
+class Command(BaseCommand):
+    help = (
+        "Times product search and filters over a synthetic catalog, creating "
+        "products until --products rows exist. Everything is rolled back "
+        "unless --keep is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=1000000)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--page-size', type=int, default=100)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--keep', action='store_true',
+            help="Commit the synthetic products instead of rolling back."
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self._fill_catalog(options)
+            self._measure(options)
+            transaction.set_rollback(not options['keep'])
+        # Drops the search index built from the rolled back rows.
+        catalog.invalidate_names()
+
+    def _measure(self, options):
+        cases = [
+            ('search prefix', lambda q: search_products(q, 'wre')),
+            ('search words', lambda q: search_products(q, 'steel pump')),
+            ('search substring', lambda q: search_products(q, 'rench')),
+            ('price range', lambda q: q.filter(
+                available=True, price__gte=100, price__lte=120
+            )),
+            ('in stock', lambda q: q.filter(available=True).in_stock()),
+        ]
+        for label, build in cases:
+            timings = []
+            for _ in range(options['repeat']):
+                queryset = build(Product.objects.all()).order_by('id')
+                started = time.perf_counter()
+                list(queryset.values_list('id', flat=True)[
+                    :options['page_size']
+                ])
+                timings.append((time.perf_counter() - started) * 1000)
+            self.stdout.write(
+                f"{label}: median {statistics.median(timings):.2f} ms, "
+                f"max {max(timings):.2f} ms"
+            )
+
+    def _fill_catalog(self, options):
+        missing = options['products'] - Product.objects.count()
+        generator = random.Random(options['seed'])
+        while missing > 0:
+            size = min(missing, options['batch_size'])
+            products = Product.objects.bulk_create([
+                Product(
+                    name=' '.join(generator.sample(WORDS, 3)),
+                    price=round(generator.uniform(1, 1000), 2),
+                    stock=generator.randint(0, 50),
+                    available=generator.random() < 0.8
+                ) for _ in range(size)
+            ])
+            # Opening balances, so reconcile_stock agrees with kept rows.
+            StockMovement.objects.bulk_create([
+                StockMovement(product=product, quantity=product.stock)
+                for product in products if product.stock
+            ])
+            missing -= size
+            self.stdout.write(f"{missing} products left to create.")
+        if connection.vendor == 'postgresql':
+            # Fresh statistics, so the plans are the ones of a real catalog.
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE api_product')
@@ -0,0 +1,65 @@
+import statistics
+import time
+
+from api.models import Order, Product
+from api.representations import ORJSONRenderer, get_plan, orjson
+from api.serializers import OrderSerializer, ProductReadOnlySerializer
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+
+
+class Command(BaseCommand):
+    help = (
+        "Times the DRF serializers of the product and order lists against "
+        "their compiled field plans, over rows already in the database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        product_plan = get_plan(ProductReadOnlySerializer)
+        products = list(Product.objects.order_by('id')[:rows])
+        product_rows = list(
+            Product.objects.order_by('id').values(
+                *product_plan.columns
+            )[:rows]
+        )
+        order_plan = get_plan(OrderSerializer)
+        orders = list(Order.objects.with_details().order_by('id')[:rows])
+        data = order_plan.represent_instances(orders)
+
+        cases = [
+            ('products serializer', lambda: ProductReadOnlySerializer(
+                products, many=True
+            ).data),
+            ('products plan', lambda: product_plan.represent_rows(
+                product_rows
+            )),
+            ('orders serializer', lambda: OrderSerializer(
+                orders, many=True
+            ).data),
+            ('orders plan', lambda: order_plan.represent_instances(orders)),
+            ('orders JSONRenderer', lambda: JSONRenderer().render(data)),
+        ]
+        if orjson is not None:
+            cases.append(
+                ('orders ORJSONRenderer', lambda: ORJSONRenderer().render(data))
+            )
+
+        self.stdout.write(
+            f"{len(products)} products, {len(orders)} orders with "
+            f"{sum(len(order['details']) for order in data)} details."
+        )
+        for label, build in cases:
+            timings = []
+            for _ in range(options['repeat']):
+                started = time.perf_counter()
+                build()
+                timings.append((time.perf_counter() - started) * 1000)
+            self.stdout.write(
+                f"{label}: median {statistics.median(timings):.2f} ms, "
+                f"max {max(timings):.2f} ms"
+            )
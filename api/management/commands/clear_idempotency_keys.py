@@ -0,0 +1,32 @@
+from api.models import IdempotencyKey
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+
+class Command(BaseCommand):
+    help = "Deletes expired idempotency keys in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        deleted = 0
+        while True:
+            key_ids = list(
+                IdempotencyKey.objects.filter(
+                    expires_at__lte=now
+                ).order_by('expires_at').values_list('id', flat=True)[
+                    :options['batch_size']
+                ]
+            )
+            if not key_ids:
+                break
+
+            with transaction.atomic():
+                deleted += IdempotencyKey.objects.filter(
+                    id__in=key_ids, expires_at__lte=now
+                ).delete()[0]
+
+        self.stdout.write(f"Deleted {deleted} expired idempotency keys.")
@@ -0,0 +1,44 @@
+import time
+
+from api.models import StockReservation
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+
+class Command(BaseCommand):
+    help = "Gives back the stock held by expired reservations."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--interval', type=int, default=0,
+            help="Keep running and sweep again every N seconds."
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            released = self._sweep(options['batch_size'])
+            self.stdout.write(f"Released {released} expired reservations.")
+
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
+
+    def _sweep(self, batch_size):
+        queryset = StockReservation.objects.expired()
+        released = 0
+        while True:
+            with transaction.atomic():
+                # Reservations being processed right now are skipped, they
+                # are converted by their order instead.
+                reservation_ids = list(
+                    queryset.select_for_update(skip_locked=True).order_by(
+                        'id'
+                    ).values_list('id', flat=True)[:batch_size]
+                )
+                if not reservation_ids:
+                    break
+                released += StockReservation.objects.filter(
+                    id__in=reservation_ids
+                ).release()
+        return released
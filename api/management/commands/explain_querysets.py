@@ -0,0 +1,101 @@
+import re
+
+from api.models import Order, OrderDetail, Product
+from api.views import OrderDetailViewSet, OrderViewSet, ProductViewSet
+from django.conf import settings
+from django.core.exceptions import EmptyResultSet
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+
+# PostgreSQL and SQLite spellings of a full table scan.
+SEQUENTIAL_SCAN = re.compile(r'Seq Scan on (\w+)|\bSCAN (?:TABLE )?(\w+)$')
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs EXPLAIN on the querysets behind the API endpoints and flags "
+        "sequential scans."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--analyze', action='store_true',
+            help="Execute the queries (EXPLAIN ANALYZE on PostgreSQL)."
+        )
+        parser.add_argument(
+            '--strict', action='store_true',
+            help="Fail when any sequential scan is found."
+        )
+
+    def handle(self, *args, **options):
+        explain_options = {'analyze': True} if options['analyze'] else {}
+        page_size = settings.REST_FRAMEWORK['PAGE_SIZE']
+
+        flagged = []
+        for label, queryset in self._get_querysets():
+            try:
+                queryset.query.get_compiler(queryset.db).as_sql()
+            except EmptyResultSet:
+                # E.g. a search matching no product in the in-memory index.
+                self.stdout.write(f"== {label}\nNo query, nothing matches.")
+                continue
+            plan = queryset[:page_size].explain(**explain_options)
+            scans = [
+                match.group(1) or match.group(2)
+                for match in map(SEQUENTIAL_SCAN.search, plan.splitlines())
+                if match
+            ]
+            self.stdout.write(f"== {label}\n{plan}")
+            if scans:
+                flagged.append(label)
+                self.stdout.write(self.style.WARNING(
+                    f"Sequential scan on {', '.join(scans)}."
+                ))
+
+        self.stdout.write(
+            f"{len(flagged)} querysets with sequential scans. Small tables "
+            "are scanned on purpose, check them again on production sized "
+            "data."
+        )
+        if flagged and options['strict']:
+            raise CommandError(f"Sequential scans in: {', '.join(flagged)}")
+
+    def _get_querysets(self):
+        order_id = Order.objects.values_list('id', flat=True).first() or 0
+        product_id = Product.objects.values_list('id', flat=True).first() or 0
+        views = [
+            ('products', ProductViewSet, {}, {}),
+            ('available products', ProductViewSet, {'available': 'true'}, {}),
+            ('products in stock', ProductViewSet, {
+                'available': 'true', 'in_stock': 'true'
+            }, {}),
+            ('products by price', ProductViewSet, {
+                'available': 'true', 'min_price': 10, 'max_price': 100
+            }, {}),
+            ('product search', ProductViewSet, {'search': 'a'}, {}),
+            ('orders', OrderViewSet, {}, {}),
+            ('orders by total', OrderViewSet, {'min_total': 100}, {}),
+            ('orders by status', OrderViewSet, {
+                'status': Order.OrderStatus.PROCESSED.value
+            }, {}),
+            ('order details', OrderDetailViewSet, {}, {'order_pk': order_id}),
+        ]
+        for label, view_class, params, kwargs in views:
+            yield label, self._get_view_queryset(view_class, params, kwargs)
+
+        yield 'processed orders by date', Order.objects.filter(
+            status=Order.OrderStatus.PROCESSED.value
+        ).order_by('-created_at')
+        yield 'details of a product', OrderDetail.objects.filter(
+            product=product_id
+        ).order_by('id')
+
+    def _get_view_queryset(self, view_class, params, kwargs):
+        view = view_class()
+        view.action = 'list'
+        view.kwargs = kwargs
+        view.request = Request(APIRequestFactory().get('/', params))
+        view.format_kwarg = None
+        return view.get_queryset()
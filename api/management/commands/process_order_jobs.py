@@ -0,0 +1,33 @@
+import time
+
+from api.processing import run_pending_jobs
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        "Processes pending order jobs in batches. Several workers can run "
+        "at once, each one skips the jobs locked by the others."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument(
+            '--interval', type=int, default=0,
+            help="Keep running and poll for new jobs every N seconds."
+        )
+
+    def handle(self, *args, **options):
+        processed = 0
+        while True:
+            count = run_pending_jobs(options['batch_size'])
+            processed += count
+            if count:
+                self.stdout.write(f"Processed {processed} jobs.")
+                continue
+
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
+
+        self.stdout.write(self.style.SUCCESS(f"Done, {processed} jobs run."))
@@ -0,0 +1,47 @@
+from api.models import Product
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        "Verifies the stock column of products against the stock movement "
+        "ledger."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        queryset = Product.objects.with_ledger_stock().order_by('id')
+
+        last_id = 0
+        checked = 0
+        mismatched = 0
+        while True:
+            batch = list(
+                queryset.filter(id__gt=last_id).values_list(
+                    'id', 'stock', 'ledger_stock'
+                )[:batch_size]
+            )
+            if not batch:
+                break
+
+            wrong = [
+                (product_id, stock, ledger_stock)
+                for product_id, stock, ledger_stock in batch
+                if stock != ledger_stock
+            ]
+            for product_id, stock, ledger_stock in wrong:
+                self.stdout.write(
+                    f"Product {product_id}: stock {stock}, "
+                    f"ledger {ledger_stock}."
+                )
+
+            checked += len(batch)
+            mismatched += len(wrong)
+            last_id = batch[-1][0]
+
+        self.stdout.write(
+            f"Checked {checked} products, found {mismatched} mismatched."
+        )
@@ -0,0 +1,35 @@
+import time
+
+from api.exchange import build_exchange_rate_provider
+from api.models import ExchangeRate
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = "Stores a snapshot of the current USD exchange rate."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval', type=int, default=0,
+            help="Keep running and store a new snapshot every N seconds."
+        )
+
+    def handle(self, *args, **options):
+        interval = options['interval']
+        provider = build_exchange_rate_provider(cached=False)
+
+        while True:
+            try:
+                snapshot = ExchangeRate.record(provider.get_rate())
+                self.stdout.write(
+                    f"Stored exchange rate {snapshot.rate} "
+                    f"at {snapshot.created_at.isoformat()}."
+                )
+            except Exception as error:
+                if not interval:
+                    raise CommandError(str(error))
+                self.stderr.write(f"Exchange rate refresh failed: {error}")
+
+            if not interval:
+                break
+            time.sleep(interval)
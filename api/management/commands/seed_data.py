@@ -0,0 +1,286 @@
+import csv
+import io
+import itertools
+import random
+import time
+from datetime import timedelta
+
+from api import catalog
+from api.management.words import WORDS
+from api.models import Order, OrderDetail, Product, StockMovement
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, models, transaction
+from django.utils import timezone
+
+
+class Command(BaseCommand):
+    help = (
+        "Inserts synthetic users, products, orders and order details in "
+        "chunks, with COPY on PostgreSQL. The same --seed always generates "
+        "the same data."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--products', type=int, default=10000)
+        parser.add_argument('--orders', type=int, default=100000)
+        parser.add_argument('--min-lines', type=int, default=1)
+        parser.add_argument('--max-lines', type=int, default=5)
+        parser.add_argument(
+            '--skew', type=float, default=1.0,
+            help="Zipf exponent of product popularity, 0 for uniform."
+        )
+        parser.add_argument('--ingress-ratio', type=float, default=0.1)
+        parser.add_argument('--processed-ratio', type=float, default=0.7)
+        parser.add_argument('--cancelled-ratio', type=float, default=0.05)
+        parser.add_argument('--exchange-rate', type=float, default=1.0)
+        parser.add_argument('--days', type=int, default=365)
+        parser.add_argument('--password', default='Password1')
+        parser.add_argument('--chunk-size', type=int, default=10000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--no-copy', action='store_true',
+            help="Use multi row INSERTs on PostgreSQL as well."
+        )
+
+    def handle(self, *args, **options):
+        if not 1 <= options['min_lines'] <= options['max_lines']:
+            raise CommandError("Expected 1 <= --min-lines <= --max-lines.")
+        if options['orders'] and options['max_lines'] > options['products']:
+            raise CommandError("--max-lines can't exceed --products.")
+        if options['processed_ratio'] + options['cancelled_ratio'] > 1:
+            raise CommandError(
+                "--processed-ratio plus --cancelled-ratio can't exceed 1."
+            )
+
+        self.use_copy = (
+            connection.vendor == 'postgresql' and not options['no_copy']
+        )
+        self.now = timezone.now()
+        started = time.perf_counter()
+
+        self._seed_users(options)
+        self._seed_products_and_orders(options)
+        # Rows were inserted with explicit ids and without signals.
+        self._reset_sequences([Product, Order])
+        catalog.invalidate_names()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded in {time.perf_counter() - started:.1f} s."
+        ))
+
+    def _seed_users(self, options):
+        user_model = get_user_model()
+        # Hashing is the slow part of create_user, every user shares one.
+        password = make_password(options['password'])
+        offset = self._next_id(user_model)
+        fields = [
+            'email', 'password', 'is_active', 'is_superuser', 'staff', 'admin'
+        ]
+        for start in range(0, options['users'], options['chunk_size']):
+            stop = min(start + options['chunk_size'], options['users'])
+            self._insert(user_model, fields, [
+                (
+                    f'seed{offset + index}@example.com', password, True,
+                    False, False, False
+                ) for index in range(start, stop)
+            ])
+        self._progress('users', options['users'])
+
+    def _seed_products_and_orders(self, options):
+        if not options['products']:
+            return
+
+        generator = random.Random(f"{options['seed']}:products")
+        first_product_id = self._next_id(Product)
+        self.first_order_id = self._next_id(Order)
+        prices = [
+            round(generator.uniform(1, 1000), 2)
+            for _ in range(options['products'])
+        ]
+        self.cum_weights = list(itertools.accumulate(
+            1 / (rank + 1) ** options['skew']
+            for rank in range(options['products'])
+        ))
+
+        # Orders are generated twice from the same seed: first to learn the
+        # stock every product needs, then to insert them after the products.
+        deltas = [0] * options['products']
+        for order, lines in self._generate_orders(options, prices):
+            if order[1] == Order.OrderStatus.PROCESSED.value:
+                sign = (
+                    1 if order[2] == Order.MovementStatus.INGRESS.value
+                    else -1
+                )
+                for product, quantity in lines:
+                    deltas[product] += sign * quantity
+
+        product_fields = [
+            'id', 'name', 'price', 'stock', 'reserved', 'available',
+            'created_at', 'updated_at'
+        ]
+        movement_fields = ['product', 'quantity', 'created_at']
+        created_at = self.now - timedelta(days=options['days'])
+        for start in range(0, options['products'], options['chunk_size']):
+            stop = min(start + options['chunk_size'], options['products'])
+            products = []
+            movements = []
+            for index in range(start, stop):
+                # Opening stock never lets a processed egress go negative.
+                opening = generator.randint(0, 1000) + max(-deltas[index], 0)
+                product_id = first_product_id + index
+                products.append((
+                    product_id, ' '.join(generator.sample(WORDS, 3)),
+                    prices[index], opening + deltas[index], 0,
+                    generator.random() < 0.9, created_at, created_at
+                ))
+                if opening:
+                    movements.append((product_id, opening, created_at))
+            with transaction.atomic():
+                self._insert(Product, product_fields, products)
+                self._insert(StockMovement, movement_fields, movements)
+        self._progress('products', options['products'])
+
+        self._insert_orders(options, prices, first_product_id)
+
+    def _generate_orders(self, options, prices):
+        """
+        Yields every order as a row of the Order fields used by
+        _insert_orders, along with its (product index, quantity) lines.
+        """
+        generator = random.Random(f"{options['seed']}:orders")
+        population = range(options['products'])
+        span = timedelta(days=options['days'])
+        for index in range(options['orders']):
+            size = generator.randint(
+                options['min_lines'], options['max_lines']
+            )
+            products = set()
+            while len(products) < size:
+                products.update(generator.choices(
+                    population, cum_weights=self.cum_weights,
+                    k=size - len(products)
+                ))
+            lines = [
+                (product, generator.randint(1, 10))
+                for product in sorted(products)
+            ]
+
+            draw = generator.random()
+            if draw < options['processed_ratio']:
+                status = Order.OrderStatus.PROCESSED.value
+            elif draw < (
+                options['processed_ratio'] + options['cancelled_ratio']
+            ):
+                status = Order.OrderStatus.CANCELLED.value
+            else:
+                status = Order.OrderStatus.DRAFT.value
+            movement_type = (
+                Order.MovementStatus.INGRESS.value
+                if generator.random() < options['ingress_ratio']
+                else Order.MovementStatus.EGRESS.value
+            )
+
+            total = sum(
+                quantity * prices[product] for product, quantity in lines
+            )
+            processed = status == Order.OrderStatus.PROCESSED.value
+            rate = options['exchange_rate']
+            created_at = self.now - span * (1 - index / options['orders'])
+            yield (
+                self.first_order_id + index, status, movement_type, created_at,
+                len(lines), sum(quantity for _, quantity in lines), total,
+                rate if processed else None, total if processed else None,
+                total / rate if processed else None
+            ), lines
+
+    def _insert_orders(self, options, prices, first_product_id):
+        order_fields = [
+            'id', 'status', 'movement_type', 'created_at', 'line_count',
+            'total_units', 'total_amount', 'exchange_rate', 'processed_total',
+            'processed_usd_total', 'updated_at'
+        ]
+        detail_fields = [
+            'order', 'product', 'quantity', 'created_at', 'updated_at'
+        ]
+        movement_fields = ['order', 'product', 'quantity', 'created_at']
+
+        orders = self._generate_orders(options, prices)
+        inserted = 0
+        while True:
+            chunk = list(itertools.islice(orders, options['chunk_size']))
+            if not chunk:
+                break
+
+            order_rows = []
+            details = []
+            movements = []
+            for order, lines in chunk:
+                order_id, status, movement_type, created_at = order[:4]
+                order_rows.append((*order, created_at))
+                sign = (
+                    1 if movement_type == Order.MovementStatus.INGRESS.value
+                    else -1
+                )
+                for product, quantity in lines:
+                    product_id = first_product_id + product
+                    details.append((
+                        order_id, product_id, quantity, created_at, created_at
+                    ))
+                    if status == Order.OrderStatus.PROCESSED.value:
+                        movements.append((
+                            order_id, product_id, sign * quantity, created_at
+                        ))
+            with transaction.atomic():
+                self._insert(Order, order_fields, order_rows)
+                self._insert(OrderDetail, detail_fields, details)
+                self._insert(StockMovement, movement_fields, movements)
+            inserted += len(chunk)
+            self._progress('orders', inserted)
+
+    def _next_id(self, model):
+        last_id = model.objects.aggregate(value=models.Max('id'))['value']
+        return (last_id or 0) + 1
+
+    def _insert(self, model, fields, rows):
+        if not rows:
+            return
+
+        table = connection.ops.quote_name(model._meta.db_table)
+        columns = ', '.join(
+            connection.ops.quote_name(model._meta.get_field(name).column)
+            for name in fields
+        )
+        with connection.cursor() as cursor:
+            if self.use_copy:
+                buffer = io.StringIO()
+                csv.writer(buffer).writerows(rows)
+                buffer.seek(0)
+                cursor.copy_expert(
+                    f'COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv)',
+                    buffer
+                )
+                return
+
+            placeholders = ', '.join(['%s'] * len(fields))
+            cursor.executemany(
+                f'INSERT INTO {table} ({columns}) VALUES ({placeholders})',
+                [[self._adapt(value) for value in row] for row in rows]
+            )
+
+    def _adapt(self, value):
+        if hasattr(value, 'tzinfo'):
+            return connection.ops.adapt_datetimefield_value(value)
+        return value
+
+    def _reset_sequences(self, model_list):
+        statements = connection.ops.sequence_reset_sql(no_style(), model_list)
+        with connection.cursor() as cursor:
+            for statement in statements:
+                cursor.execute(statement)
+
+    def _progress(self, label, count):
+        self.stdout.write(f"{count} {label} inserted.")
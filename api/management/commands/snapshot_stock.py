@@ -0,0 +1,62 @@
+import time
+
+from api.models import Product, StockSnapshot
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F
+
+
+class Command(BaseCommand):
+    help = (
+        "Stores a stock snapshot for every product with ledger movements "
+        "since its last snapshot."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--interval', type=int, default=0,
+            help="Keep running and take new snapshots every N seconds."
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            created = self._take_snapshots(options['batch_size'])
+            self.stdout.write(f"Stored {created} stock snapshots.")
+
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
+
+    def _take_snapshots(self, batch_size):
+        last_id = 0
+        created = 0
+        while True:
+            with transaction.atomic():
+                # Locked in id order like the stock engine, so no movement
+                # of the batch can be in flight while the ledger is read.
+                product_ids = list(
+                    Product.objects.select_for_update().filter(
+                        id__gt=last_id
+                    ).order_by('id').values_list('id', flat=True)[:batch_size]
+                )
+                if not product_ids:
+                    break
+
+                snapshots = [
+                    StockSnapshot(
+                        product_id=product_id, stock=stock,
+                        movement_id=movement_id
+                    )
+                    for product_id, stock, movement_id in
+                    Product.objects.filter(
+                        id__in=product_ids
+                    ).with_ledger_stock().filter(
+                        last_movement_id__gt=F('snapshot_movement_id')
+                    ).values_list('id', 'ledger_stock', 'last_movement_id')
+                ]
+                StockSnapshot.objects.bulk_create(snapshots)
+
+            created += len(snapshots)
+            last_id = product_ids[-1]
+        return created
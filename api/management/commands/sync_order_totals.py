@@ -0,0 +1,60 @@
+from api.models import Order
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+
+class Command(BaseCommand):
+    help = (
+        "Verifies the line_count, total_units and total_amount columns of "
+        "orders against their details, repairing them with --repair."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--repair', action='store_true',
+            help="Recompute the columns of every mismatched order."
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        queryset = Order.objects.with_line_aggregates().order_by('id')
+
+        last_id = 0
+        checked = 0
+        mismatched = 0
+        while True:
+            batch = list(queryset.filter(id__gt=last_id)[:batch_size])
+            if not batch:
+                break
+
+            wrong_ids = [
+                order.id for order in batch if not self._is_consistent(order)
+            ]
+            if wrong_ids:
+                self.stdout.write(
+                    f"Mismatched orders: {', '.join(map(str, wrong_ids))}"
+                )
+                if options['repair']:
+                    with transaction.atomic():
+                        Order.objects.filter(
+                            id__in=wrong_ids
+                        ).refresh_aggregates()
+
+            checked += len(batch)
+            mismatched += len(wrong_ids)
+            last_id = batch[-1].id
+
+        action = "repaired" if options['repair'] else "found"
+        self.stdout.write(
+            f"Checked {checked} orders, {action} {mismatched} mismatched."
+        )
+
+    def _is_consistent(self, order):
+        return (
+            order.line_count == order.details_line_count and
+            order.total_units == order.details_total_units and
+            abs(order.total_amount - order.details_total) <= 1e-6 * max(
+                1, abs(order.details_total)
+            )
+        )
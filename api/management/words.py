@@ -0,0 +1,6 @@
+# Words product names of the synthetic catalogs are made of.
+WORDS = [
+    'alpha', 'bolt', 'cable', 'drill', 'engine', 'filter', 'gear', 'hammer',
+    'joint', 'kettle', 'lamp', 'motor', 'nozzle', 'oven', 'pump', 'router',
+    'saw', 'tank', 'valve', 'wrench', 'pro', 'mini', 'max', 'steel', 'plus',
+]
@@ -0,0 +1,245 @@
+import contextvars
+import hmac
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+
+
+# Prometheus default buckets, in seconds.
+DURATION_BUCKETS = [
+    0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0,
+    7.5, 10.0
+]
+QUERY_COUNT_BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500]
+
+HISTOGRAMS = {
+    'http_request_duration_seconds': (
+        "Wall time spent per request.", DURATION_BUCKETS
+    ),
+    'db_query_duration_seconds': (
+        "Time spent in database queries per request.", DURATION_BUCKETS
+    ),
+    'db_queries_per_request': (
+        "Database queries run per request.", QUERY_COUNT_BUCKETS
+    ),
+    'serializer_duration_seconds': (
+        "Time spent in serializers per request.", DURATION_BUCKETS
+    ),
+    'outbound_http_duration_seconds': (
+        "Time spent in outbound HTTP calls per request.", DURATION_BUCKETS
+    ),
+}
+
+
+class RequestTimings:
+    def __init__(self):
+        self.db_queries = 0
+        self.durations = {'db': 0.0, 'serializer': 0.0, 'http': 0.0}
+
+
+_timings = contextvars.ContextVar('api_request_timings', default=None)
+
+
+@contextmanager
+def timer(name):
+    # Adds the time spent in the block to the current request, if any.
+    timings = _timings.get()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timings is not None:
+            timings.durations[name] += time.perf_counter() - started
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+
+class Registry:
+    """
+    Histograms per metric and route, kept in the memory of each process.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+
+    def observe(self, metric, labels, value):
+        key = (metric, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(
+                    HISTOGRAMS[metric][1]
+                )
+            histogram.observe(value)
+
+    def clear(self):
+        with self._lock:
+            self._histograms = {}
+
+    def render(self):
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            lines = []
+            for metric, (description, _) in HISTOGRAMS.items():
+                lines.append(f'# HELP {metric} {description}')
+                lines.append(f'# TYPE {metric} histogram')
+                for (name, labels), histogram in histograms:
+                    if name != metric:
+                        continue
+                    lines.extend(self._render_histogram(
+                        metric, labels, histogram
+                    ))
+        return '\n'.join(lines) + '\n'
+
+    def _render_histogram(self, metric, labels, histogram):
+        label_text = ','.join(
+            f'{name}="{_escape(value)}"' for name, value in labels
+        )
+        separator = ',' if label_text else ''
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            yield (
+                f'{metric}_bucket{{{label_text}{separator}le="{bound}"}} '
+                f'{count}'
+            )
+        yield (
+            f'{metric}_bucket{{{label_text}{separator}le="+Inf"}} '
+            f'{histogram.count}'
+        )
+        yield f'{metric}_sum{{{label_text}}} {histogram.sum}'
+        yield f'{metric}_count{{{label_text}}} {histogram.count}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+
+registry = Registry()
+
+
+class MetricsMiddleware:
+    """
+    Records wall, database, serializer and outbound HTTP time of every
+    request, answered as a Server-Timing header and kept per route name for
+    the /metrics endpoint.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timings = RequestTimings()
+        token = _timings.set(timings)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(
+                        connection.execute_wrapper(self._time_query)
+                    )
+                response = self.get_response(request)
+        finally:
+            _timings.reset(token)
+        total = time.perf_counter() - started
+
+        self._record(request, timings, total)
+        if getattr(settings, 'METRICS_SERVER_TIMING', True):
+            response['Server-Timing'] = self._server_timing(timings, total)
+        return response
+
+    def _time_query(self, execute, sql, params, many, context):
+        timings = _timings.get()
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            if timings is not None:
+                timings.db_queries += 1
+                timings.durations['db'] += time.perf_counter() - started
+
+    def _record(self, request, timings, total):
+        match = getattr(request, 'resolver_match', None)
+        labels = {
+            'route': match.view_name if match else 'unmatched',
+            'method': request.method,
+        }
+        registry.observe('http_request_duration_seconds', labels, total)
+        registry.observe(
+            'db_query_duration_seconds', labels, timings.durations['db']
+        )
+        registry.observe('db_queries_per_request', labels, timings.db_queries)
+        registry.observe(
+            'serializer_duration_seconds', labels,
+            timings.durations['serializer']
+        )
+        registry.observe(
+            'outbound_http_duration_seconds', labels,
+            timings.durations['http']
+        )
+
+    def _server_timing(self, timings, total):
+        return ', '.join([
+            f'total;dur={total * 1000:.2f}',
+            f'db;dur={timings.durations["db"] * 1000:.2f};'
+            f'desc="{timings.db_queries} queries"',
+            f'serializer;dur={timings.durations["serializer"] * 1000:.2f}',
+            f'http;dur={timings.durations["http"] * 1000:.2f}',
+        ])
+
+
+class TimedSerializerMixin:
+    """
+    View mixin adding the time spent by the serializers it builds to the
+    `serializer` timing of the request.
+    """
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        for method in ['is_valid', 'to_representation']:
+            setattr(serializer, method, _timed(getattr(serializer, method)))
+        return serializer
+
+
+def _timed(method):
+    def wrapper(*args, **kwargs):
+        with timer('serializer'):
+            return method(*args, **kwargs)
+    return wrapper
+
+
+def is_scrape_allowed(request):
+    # Scrapers either come from an allowed address or send the token.
+    if request.META.get('REMOTE_ADDR') in getattr(
+        settings, 'METRICS_ALLOWED_IPS', []
+    ):
+        return True
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    header = request.META.get('HTTP_AUTHORIZATION', '')
+    return bool(token) and hmac.compare_digest(
+        header.encode(), f'Bearer {token}'.encode()
+    )
+
+
+def metrics_view(request):
+    if not is_scrape_allowed(request):
+        return HttpResponseForbidden()
+    return HttpResponse(
+        registry.render(), content_type='text/plain; version=0.0.4'
+    )
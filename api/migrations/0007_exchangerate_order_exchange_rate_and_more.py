@@ -0,0 +1,41 @@
+# Generated by Django 4.0.6 on 2026-10-17 16:12
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_alter_order_movement_type'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExchangeRate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='created_at')),
+                ('rate', models.FloatField(verbose_name='rate')),
+                ('source', models.CharField(max_length=128, verbose_name='source')),
+            ],
+            options={
+                'get_latest_by': 'created_at',
+            },
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='exchange_rate',
+            field=models.FloatField(null=True, verbose_name='exchange_rate'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='processed_total',
+            field=models.FloatField(null=True, verbose_name='processed_total'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='processed_usd_total',
+            field=models.FloatField(null=True, verbose_name='processed_usd_total'),
+        ),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 4.0.6 on 2026-10-17 16:22
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def populate_order_aggregates(apps, schema_editor):
+    Order = apps.get_model('api', 'Order')
+    OrderDetail = apps.get_model('api', 'OrderDetail')
+
+    details = OrderDetail.objects.filter(
+        order=models.OuterRef('pk')
+    ).order_by().values('order')
+    Order.objects.update(
+        line_count=Coalesce(
+            models.Subquery(
+                details.annotate(value=models.Count('id')).values('value')
+            ),
+            0
+        ),
+        total_units=Coalesce(
+            models.Subquery(
+                details.annotate(value=models.Sum('quantity')).values('value')
+            ),
+            0
+        ),
+        total_amount=Coalesce(
+            models.Subquery(
+                details.annotate(
+                    value=models.Sum(
+                        models.F('quantity') * models.F('product__price'),
+                        output_field=models.FloatField()
+                    )
+                ).values('value')
+            ),
+            0.0
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_exchangerate_order_exchange_rate_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='line_count',
+            field=models.IntegerField(default=0, verbose_name='line_count'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total_amount',
+            field=models.FloatField(db_index=True, default=0, verbose_name='total_amount'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total_units',
+            field=models.IntegerField(default=0, verbose_name='total_units'),
+        ),
+        migrations.RunPython(
+            populate_order_aggregates, migrations.RunPython.noop
+        ),
+    ]
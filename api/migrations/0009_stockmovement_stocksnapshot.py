@@ -0,0 +1,60 @@
+# Generated by Django 4.0.6 on 2026-10-17 17:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def create_opening_snapshots(apps, schema_editor):
+    # Current stock becomes the starting point of the ledger.
+    Product = apps.get_model('api', 'Product')
+    StockSnapshot = apps.get_model('api', 'StockSnapshot')
+
+    StockSnapshot.objects.bulk_create(
+        (
+            StockSnapshot(product_id=product_id, stock=stock, movement_id=0)
+            for product_id, stock in Product.objects.order_by(
+                'id'
+            ).values_list('id', 'stock').iterator()
+        ),
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_order_aggregates'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='created_at')),
+                ('quantity', models.IntegerField(verbose_name='quantity')),
+                ('order', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='api.order')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.product')),
+            ],
+            options={
+                'index_together': {('product', 'id')},
+            },
+        ),
+        migrations.CreateModel(
+            name='StockSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='created_at')),
+                ('movement_id', models.BigIntegerField(verbose_name='movement_id')),
+                ('stock', models.IntegerField(verbose_name='stock')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.product')),
+            ],
+            options={
+                'index_together': {('product', 'movement_id')},
+            },
+        ),
+        migrations.RunPython(
+            create_opening_snapshots, migrations.RunPython.noop
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.0.6 on 2026-10-17 17:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_stockmovement_stocksnapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='reserved',
+            field=models.IntegerField(default=0, verbose_name='reserved'),
+        ),
+        migrations.CreateModel(
+            name='StockReservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='created_at')),
+                ('expires_at', models.DateTimeField(db_index=True, verbose_name='expires_at')),
+                ('quantity', models.IntegerField(verbose_name='quantity')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.order')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.product')),
+            ],
+            options={
+                'unique_together': {('product', 'order')},
+            },
+        ),
+    ]
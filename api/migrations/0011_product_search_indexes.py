@@ -0,0 +1,52 @@
+# Generated by Django 4.0.6 on 2026-10-17 18:20
+
+from django.db import migrations, models
+
+
+SEARCH_INDEXES = [
+    (
+        'api_product_name_search_idx',
+        "CREATE INDEX IF NOT EXISTS api_product_name_search_idx "
+        "ON api_product USING gin (to_tsvector('simple'::regconfig, \"name\"))"
+    ),
+    (
+        'api_product_name_trgm_idx',
+        "CREATE INDEX IF NOT EXISTS api_product_name_trgm_idx "
+        "ON api_product USING gin ((UPPER(\"name\"::text)) gin_trgm_ops)"
+    ),
+]
+
+
+def create_search_indexes(apps, schema_editor):
+    # Other databases search through the in-memory index of api.search.
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for _, sql in SEARCH_INDEXES:
+        schema_editor.execute(sql)
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, _ in SEARCH_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_product_reserved_stockreservation'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['available', 'price'], name='api_product_avail_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(models.F('available'), models.F('stock') - models.F('reserved'), name='api_product_avail_stock_idx'),
+        ),
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.0.6 on 2026-10-17 19:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_access_path_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('attempts', models.IntegerField(default=0, verbose_name='attempts')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='created_at')),
+                ('error', models.TextField(blank=True, default='', verbose_name='error')),
+                ('finished_at', models.DateTimeField(null=True, verbose_name='finished_at')),
+                ('status', models.CharField(choices=[('DONE', 'DONE'), ('FAILED', 'FAILED'), ('PENDING', 'PENDING')], default='PENDING', max_length=10)),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='updated_at')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.order')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='orderjob',
+            index=models.Index(condition=models.Q(('status', 'PENDING')), fields=['id'], name='api_orderjob_pending_idx'),
+        ),
+    ]
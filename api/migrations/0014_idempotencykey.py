@@ -0,0 +1,26 @@
+# Generated by Django 4.0.6 on 2026-10-17 19:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_orderjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdempotencyKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='created_at')),
+                ('expires_at', models.DateTimeField(db_index=True, verbose_name='expires_at')),
+                ('fingerprint', models.CharField(max_length=64, verbose_name='fingerprint')),
+                ('key', models.CharField(max_length=64, unique=True, verbose_name='key')),
+                ('response_body', models.JSONField(null=True, verbose_name='response_body')),
+                ('response_headers', models.JSONField(default=dict, verbose_name='response_headers')),
+                ('response_status', models.IntegerField(null=True, verbose_name='response_status')),
+            ],
+        ),
+    ]
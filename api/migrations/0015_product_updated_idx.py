@@ -0,0 +1,17 @@
+# Generated by Django 4.0.6 on 2026-10-17 21:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['updated_at'], name='api_product_updated_idx'),
+        ),
+    ]
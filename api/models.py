@@ -1,11 +1,76 @@
-from django.db import models
+from datetime import timedelta
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 from api import enums
-from api.utils import requests_retry_session
+from api.exchange import (
+    get_exchange_rate_provider, get_exchange_rate_settings
+)
 from api.validators import greater_equal_than_zero
 from rest_framework.exceptions import ValidationError
-from rest_framework import status
 
-import json
+
+def quantity_case(quantities):
+    # Per product quantity of {product_id: quantity}, for set based UPDATEs.
+    return models.Case(
+        *[
+            models.When(id=product_id, then=models.Value(quantity))
+            for product_id, quantity in quantities.items()
+        ],
+        default=models.Value(0),
+        output_field=models.IntegerField()
+    )
+
+
+class ProductQuerySet(models.QuerySet):
+    def version(self):
+        # Every change of a product touches its updated_at, deletes show up
+        # in the count.
+        return self.order_by().aggregate(
+            count=models.Count('id'), updated_at=models.Max('updated_at')
+        )
+
+    def in_stock(self):
+        # Matches the (available, stock - reserved) index.
+        return self.annotate(
+            free_stock=models.F('stock') - models.F('reserved')
+        ).filter(free_stock__gt=0)
+
+    def with_ledger_stock(self):
+        # Stock according to the ledger: latest snapshot plus every
+        # movement recorded after it.
+        snapshots = StockSnapshot.objects.filter(
+            product=models.OuterRef('pk')
+        ).order_by('-movement_id')
+        movements = StockMovement.objects.filter(
+            product=models.OuterRef('pk'),
+            id__gt=models.OuterRef('snapshot_movement_id')
+        ).order_by().values('product')
+        return self.annotate(
+            snapshot_stock=Coalesce(
+                models.Subquery(snapshots.values('stock')[:1]), 0
+            ),
+            snapshot_movement_id=Coalesce(
+                models.Subquery(snapshots.values('movement_id')[:1]), 0
+            ),
+            last_movement_id=Coalesce(
+                models.Subquery(
+                    movements.annotate(
+                        value=models.Max('id')
+                    ).values('value')
+                ),
+                models.F('snapshot_movement_id')
+            ),
+            ledger_stock=models.F('snapshot_stock') + Coalesce(
+                models.Subquery(
+                    movements.annotate(
+                        value=models.Sum('quantity')
+                    ).values('value')
+                ),
+                0
+            )
+        )
 
 
 class Product(models.Model):
@@ -14,28 +79,395 @@ class Product(models.Model):
     name = models.CharField("name", null=False, max_length=256)
     price = models.FloatField(
         "price", null=False, default=0, validators=[greater_equal_than_zero])
+    reserved = models.IntegerField("reserved", null=False, default=0)
     stock = models.IntegerField("stock", null=False, default=0)
     updated_at = models.DateTimeField("updated_at", auto_now=True)
 
+    COUNTER_FIELDS = ['reserved', 'stock']
+
+    objects = ProductQuerySet.as_manager()
+
+    class Meta:
+        # Full-text and trigram indexes on name are PostgreSQL only, they
+        # are created by migration 0011.
+        indexes = [
+            # Storefront lists only available products, ordered by id.
+            models.Index(
+                fields=['id'], condition=models.Q(available=True),
+                name='api_product_available_idx'
+            ),
+            models.Index(
+                fields=['available', 'price'],
+                name='api_product_avail_price_idx'
+            ),
+            models.Index(
+                models.F('available'),
+                models.F('stock') - models.F('reserved'),
+                name='api_product_avail_stock_idx'
+            ),
+            # Latest product change, part of the order list ETags.
+            models.Index(fields=['updated_at'], name='api_product_updated_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_name = instance.__dict__.get('name')
+        instance._loaded_price = instance.__dict__.get('price')
+        instance._loaded_stock = instance.__dict__.get('stock')
+        return instance
+
+    def save(self, *args, **kwargs):
+        price_changed = (
+            not self._state.adding and
+            getattr(self, '_loaded_price', self.price) != self.price
+        )
+        adding = self._state.adding
+        stock_change = 0
+        # Stock and reservations are maintained with F() updates, so a stale
+        # instance must never write them back. Stock set on the instance is
+        # applied as an adjustment of the difference, with its ledger row.
+        if not adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.COUNTER_FIELDS
+            ]
+            loaded_stock = getattr(self, '_loaded_stock', None)
+            if loaded_stock is not None:
+                stock_change = self.stock - loaded_stock
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if stock_change:
+                Product.objects.filter(id=self.id).update(
+                    stock=models.F('stock') + stock_change
+                )
+                StockMovement.objects.create(
+                    product=self, quantity=stock_change
+                )
+            if adding and self.stock:
+                # Opening balance, so the ledger always adds up to stock.
+                StockMovement.objects.create(
+                    product=self, quantity=self.stock
+                )
+            if price_changed:
+                # Totals of orders not stamped yet depend on current prices.
+                Order.objects.filter(
+                    orderdetail__product=self, processed_total__isnull=True
+                ).refresh_aggregates()
+        self._loaded_name = self.name
+        self._loaded_price = self.price
+        self._loaded_stock = self.stock
+
+    def sync_stock(self, stock):
+        # `stock` is already in the database, save() must not apply it again.
+        self.stock = self._loaded_stock = stock
+
     def is_valid(self):
         if not self.available:
             raise ValidationError(
                 enums.Errors.PRODUCT_NOT_AVAILABLE_ERROR.value
             )
 
-    def can_be_supplied(self, quantity):
+    @property
+    def available_stock(self):
+        return self.stock - self.reserved
+
+    def can_be_supplied(self, quantity, reserved=0):
+        # `reserved` is the part of `quantity` already held by the caller.
         self.is_valid()
-        return self.stock >= quantity
+        return self.available_stock + reserved >= quantity
 
-    def add_stock_quantity(self, quantity):
+    def add_stock_quantity(self, quantity, order=None):
         greater_equal_than_zero(quantity)
-        self.stock += quantity
-        self.save()
+        self._move_stock(quantity, order)
 
-    def substract_stock_quantity(self, quantity):
+    def substract_stock_quantity(self, quantity, order=None):
         greater_equal_than_zero(quantity)
-        self.stock -= quantity
-        self.save()
+        self._move_stock(-quantity, order)
+
+    def _move_stock(self, quantity, order):
+        updated_at = timezone.now()
+        with transaction.atomic():
+            Product.objects.filter(id=self.id).update(
+                stock=models.F('stock') + quantity, updated_at=updated_at
+            )
+            StockMovement.objects.create(
+                product=self, order=order, quantity=quantity
+            )
+        self.sync_stock(self.stock + quantity)
+        self.updated_at = updated_at
+
+
+class StockMovement(models.Model):
+    created_at = models.DateTimeField("created_at", default=timezone.now)
+    order = models.ForeignKey(
+        'Order', on_delete=models.SET_NULL, null=True
+    )
+    product = models.ForeignKey(
+        'Product', on_delete=models.CASCADE, null=False
+    )
+    quantity = models.IntegerField("quantity", null=False)
+
+    class Meta:
+        index_together = [['product', 'id']]
+
+
+class StockSnapshot(models.Model):
+    created_at = models.DateTimeField("created_at", default=timezone.now)
+    # Last StockMovement of the product included in `stock`.
+    movement_id = models.BigIntegerField("movement_id", null=False)
+    product = models.ForeignKey(
+        'Product', on_delete=models.CASCADE, null=False
+    )
+    stock = models.IntegerField("stock", null=False)
+
+    class Meta:
+        index_together = [['product', 'movement_id']]
+
+
+class StockReservationQuerySet(models.QuerySet):
+    def expired(self):
+        return self.filter(expires_at__lte=timezone.now())
+
+    def release(self):
+        # Gives the reserved quantities back to their products with a
+        # single UPDATE and drops the reservations.
+        with transaction.atomic():
+            reservations = list(
+                self.select_for_update().values_list(
+                    'id', 'product_id', 'quantity'
+                )
+            )
+            if not reservations:
+                return 0
+
+            quantities = {}
+            for _, product_id, quantity in reservations:
+                quantities[product_id] = (
+                    quantities.get(product_id, 0) + quantity
+                )
+            # Same lock order as the stock engine.
+            list(
+                Product.objects.select_for_update().filter(
+                    id__in=quantities
+                ).order_by('id').values_list('id', flat=True)
+            )
+            Product.objects.filter(id__in=quantities).update(
+                reserved=models.F('reserved') - quantity_case(quantities),
+                updated_at=timezone.now()
+            )
+            StockReservation.objects.filter(
+                id__in=[reservation[0] for reservation in reservations]
+            ).delete()
+        return len(reservations)
+
+
+class StockReservation(models.Model):
+    created_at = models.DateTimeField("created_at", auto_now_add=True)
+    expires_at = models.DateTimeField("expires_at", db_index=True)
+    order = models.ForeignKey(
+        'Order', on_delete=models.CASCADE, null=False
+    )
+    product = models.ForeignKey(
+        'Product', on_delete=models.CASCADE, null=False
+    )
+    quantity = models.IntegerField("quantity", null=False)
+
+    objects = StockReservationQuerySet.as_manager()
+
+    class Meta:
+        unique_together = [['product', 'order']]
+
+    @classmethod
+    def reserve(cls, order, details):
+        return cls.reserve_orders([(order, details)])
+
+    @classmethod
+    def reserve_orders(cls, orders):
+        """
+        Holds the quantity of every line of the DRAFT EGRESS orders in
+        `orders`, (order, details) pairs, that its product can still cover,
+        in line order. Lines that can't be covered are left unreserved and
+        validated again by `process`. The products are locked and updated
+        with a single UPDATE, however many orders there are.
+        """
+        lines = [
+            (order, detail) for order, details in orders
+            if order.status == Order.OrderStatus.DRAFT.value and
+            order.movement_type == Order.MovementStatus.EGRESS.value
+            for detail in details if detail.quantity > 0
+        ]
+        if not lines:
+            return []
+
+        expires_at = timezone.now() + timedelta(
+            seconds=getattr(settings, 'STOCK_RESERVATION_TTL', 900)
+        )
+        reservations = []
+        quantities = {}
+        with transaction.atomic():
+            # Same lock order as the stock engine.
+            available = dict(
+                Product.objects.select_for_update().filter(
+                    id__in={detail.product_id for _, detail in lines}
+                ).order_by('id').values_list(
+                    'id', models.F('stock') - models.F('reserved')
+                )
+            )
+            for order, detail in lines:
+                product_id = detail.product_id
+                if available.get(product_id, 0) < detail.quantity:
+                    continue
+                available[product_id] -= detail.quantity
+                quantities[product_id] = (
+                    quantities.get(product_id, 0) + detail.quantity
+                )
+                reservations.append(cls(
+                    order=order, product_id=product_id,
+                    quantity=detail.quantity, expires_at=expires_at
+                ))
+            if reservations:
+                Product.objects.filter(id__in=quantities).update(
+                    reserved=models.F('reserved') + quantity_case(quantities),
+                    updated_at=timezone.now()
+                )
+                cls.objects.bulk_create(reservations)
+        return reservations
+
+
+class ExchangeRate(models.Model):
+    created_at = models.DateTimeField(
+        "created_at", default=timezone.now, db_index=True
+    )
+    rate = models.FloatField("rate", null=False)
+    source = models.CharField("source", null=False, max_length=128)
+
+    class Meta:
+        get_latest_by = 'created_at'
+
+    @classmethod
+    def record(cls, rate, source=None):
+        if source is None:
+            source = get_exchange_rate_settings()['PROVIDER']
+        return cls.objects.create(rate=rate, source=source)
+
+    @classmethod
+    def get_recent(cls, max_age=None):
+        if max_age is None:
+            max_age = get_exchange_rate_settings()['SNAPSHOT_MAX_AGE']
+        since = timezone.now() - timedelta(seconds=max_age)
+        return cls.objects.filter(
+            created_at__gte=since
+        ).order_by('-created_at').first()
+
+
+class IdempotencyKey(models.Model):
+    created_at = models.DateTimeField("created_at", auto_now_add=True)
+    expires_at = models.DateTimeField("expires_at", db_index=True)
+    fingerprint = models.CharField("fingerprint", null=False, max_length=64)
+    # SHA-256 of the user, endpoint and Idempotency-Key header.
+    key = models.CharField("key", null=False, unique=True, max_length=64)
+    response_body = models.JSONField("response_body", null=True)
+    response_headers = models.JSONField(
+        "response_headers", null=False, default=dict
+    )
+    response_status = models.IntegerField("response_status", null=True)
+
+
+def order_details_prefetch():
+    return models.Prefetch(
+        'orderdetail_set',
+        queryset=OrderDetail.objects.select_related('product').order_by('id')
+    )
+
+
+class OrderQuerySet(models.QuerySet):
+    def delete(self):
+        # Reservations cascade with their orders, their quantities go back
+        # to the products first. Covers the admin bulk delete as well.
+        with transaction.atomic():
+            StockReservation.objects.filter(order__in=self).release()
+            return super().delete()
+
+    def with_details(self):
+        return self.prefetch_related(order_details_prefetch())
+
+    def with_total(self):
+        return self.annotate(
+            details_total=Coalesce(
+                models.Sum(
+                    models.F('orderdetail__quantity') *
+                    models.F('orderdetail__product__price'),
+                    output_field=models.FloatField()
+                ),
+                0.0
+            )
+        )
+
+    def with_line_aggregates(self):
+        return self.with_total().annotate(
+            details_line_count=models.Count('orderdetail'),
+            details_total_units=Coalesce(
+                models.Sum('orderdetail__quantity'), 0
+            )
+        )
+
+    def version(self, nested=True):
+        # Changes whenever any order of the queryset would be rendered
+        # differently. Detail changes touch updated_at of their order, the
+        # `nested` joins also catch changes of their products.
+        aggregates = {
+            'count': models.Count('id', distinct=nested),
+            'updated_at': models.Max('updated_at'),
+            'unstamped': models.Count(
+                'id', distinct=nested,
+                filter=models.Q(processed_total__isnull=True)
+            ),
+        }
+        if nested:
+            aggregates.update(
+                details_updated_at=models.Max('orderdetail__updated_at'),
+                products_updated_at=models.Max(
+                    'orderdetail__product__updated_at'
+                )
+            )
+        return self.order_by().aggregate(**aggregates)
+
+    def refresh_aggregates(self):
+        # Recomputes the denormalized columns from OrderDetail rows in a
+        # single UPDATE.
+        details = OrderDetail.objects.filter(
+            order=models.OuterRef('pk')
+        ).order_by().values('order')
+        return self.update(
+            line_count=Coalesce(
+                models.Subquery(
+                    details.annotate(value=models.Count('id')).values('value')
+                ),
+                0
+            ),
+            total_units=Coalesce(
+                models.Subquery(
+                    details.annotate(
+                        value=models.Sum('quantity')
+                    ).values('value')
+                ),
+                0
+            ),
+            total_amount=Coalesce(
+                models.Subquery(
+                    details.annotate(
+                        value=models.Sum(
+                            models.F('quantity') * models.F('product__price'),
+                            output_field=models.FloatField()
+                        )
+                    ).values('value')
+                ),
+                0.0
+            ),
+            updated_at=timezone.now()
+        )
 
 
 class Order(models.Model):
@@ -49,52 +481,132 @@ class Order(models.Model):
         PROCESSED = 'PROCESSED', 'PROCESSED'
 
     EDITABLE_STATUS = [OrderStatus.DRAFT]
+    AGGREGATE_FIELDS = ['line_count', 'total_units', 'total_amount']
 
     created_at = models.DateTimeField("created_at", auto_now_add=True)
     details = models.ManyToManyField(Product, through='OrderDetail')
+    exchange_rate = models.FloatField("exchange_rate", null=True)
+    line_count = models.IntegerField("line_count", null=False, default=0)
     movement_type = models.CharField(
         null=False, choices=MovementStatus.choices,
         default=MovementStatus.EGRESS,
         db_index=True, max_length=10
     )
+    processed_total = models.FloatField("processed_total", null=True)
+    processed_usd_total = models.FloatField("processed_usd_total", null=True)
     status = models.CharField(
         choices=OrderStatus.choices, default=OrderStatus.DRAFT,
         null=False, max_length=10
     )
+    total_amount = models.FloatField(
+        "total_amount", null=False, default=0, db_index=True
+    )
+    total_units = models.IntegerField("total_units", null=False, default=0)
     updated_at = models.DateTimeField("updated_at", auto_now=True)
 
+    objects = OrderQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['status', 'created_at'],
+                name='api_order_status_created_idx'
+            ),
+            models.Index(fields=['updated_at'], name='api_order_updated_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        # Aggregates are maintained with F() updates by OrderDetail, so a
+        # stale instance must never write them back.
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.AGGREGATE_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            StockReservation.objects.filter(order=self).release()
+            return super().delete(*args, **kwargs)
+
+    def add_lines(self, details):
+        for detail in details:
+            self.line_count += 1
+            self.total_units += detail.quantity
+            self.total_amount += detail.quantity * detail.product.price
+
+    @property
+    def is_stamped(self):
+        return self.processed_total is not None
+
     @property
     def total(self):
-        total = 0
-        for detail in self.orderdetail_set.all():
-            total += detail.quantity * detail.product.price
+        if self.is_stamped:
+            return self.processed_total
+
+        # Annotated by OrderQuerySet.with_total()
+        if hasattr(self, 'details_total'):
+            return self.details_total
 
-        return total
+        return self.total_amount
 
     @property
     def usd_total(self):
+        if self.is_stamped:
+            return self.processed_usd_total
+
         total = self.total
         return total / self._get_usd_exchange_rate()
 
-    def _get_usd_exchange_rate(self):
-        URL = "https://www.dolarsi.com/api/api.php?type=valoresprincipales"
-        response = requests_retry_session().get(
-            url=URL,
-            timeout=10
-        )
+    def stamp_totals(self, rate=None, total=None):
+        # Freeze totals so reads of historical orders are deterministic and
+        # never reach the exchange service.
+        if rate is None:
+            snapshot = ExchangeRate.get_recent()
+            if not snapshot:
+                snapshot = ExchangeRate.record(self._get_usd_exchange_rate())
+            rate = snapshot.rate
+
+        if total is None:
+            total = self.total
+        self.exchange_rate = rate
+        self.processed_total = total
+        self.processed_usd_total = total / rate
+
+    @staticmethod
+    def _get_usd_exchange_rate():
+        return get_exchange_rate_provider().get_rate()
 
-        if response.status_code != status.HTTP_200_OK:
-            raise Exception("We can't get exchange rate from service.")
 
-        data = json.loads(response.content)
-        for d in data:
-            if not ('casa' in d and d['casa']):
-                raise Exception("Wrong format on exchange response.")
-            if not ('nombre' in d['casa'] and 'compra' in d['casa']):
-                raise Exception("Wrong format on exchange response.")
-            if d['casa']['nombre'] == 'Dolar Blue':
-                return float(d['casa']['compra'].replace(',', '.'))
-        raise Exception("Expected change not found.")
+class OrderJob(models.Model):
+    class JobStatus(models.TextChoices):
+        DONE = 'DONE', 'DONE'
+        FAILED = 'FAILED', 'FAILED'
+        PENDING = 'PENDING', 'PENDING'
+
+    attempts = models.IntegerField("attempts", null=False, default=0)
+    created_at = models.DateTimeField("created_at", auto_now_add=True)
+    error = models.TextField("error", null=False, blank=True, default='')
+    finished_at = models.DateTimeField("finished_at", null=True)
+    order = models.ForeignKey(
+        'Order', on_delete=models.CASCADE, null=False
+    )
+    status = models.CharField(
+        choices=JobStatus.choices, default=JobStatus.PENDING,
+        null=False, max_length=10
+    )
+    updated_at = models.DateTimeField("updated_at", auto_now=True)
+
+    class Meta:
+        indexes = [
+            # Workers only ever look for pending jobs, in id order.
+            models.Index(
+                fields=['id'], condition=models.Q(status='PENDING'),
+                name='api_orderjob_pending_idx'
+            ),
+        ]
 
 
 class OrderDetail(models.Model):
@@ -110,4 +622,80 @@ class OrderDetail(models.Model):
     updated_at = models.DateTimeField("updated_at", auto_now=True)
 
     class Meta:
+        indexes = [
+            # Details of an order are always read in id order.
+            models.Index(fields=['order', 'id'], name='api_detail_order_id_idx'),
+        ]
         unique_together = [['product', 'order']]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_line = (
+            instance.__dict__.get('product_id'),
+            instance.__dict__.get('quantity')
+        )
+        return instance
+
+    def save(self, *args, **kwargs):
+        previous = None
+        if not self._state.adding:
+            previous = getattr(self, '_loaded_line', None)
+
+        current = (self.product_id, self.quantity)
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            self._update_order_aggregates(previous, current)
+            if previous != current:
+                if previous:
+                    self._release_reservation(previous)
+                StockReservation.reserve(self.order, [self])
+        self._loaded_line = current
+
+    def delete(self, *args, **kwargs):
+        line = getattr(self, '_loaded_line', (self.product_id, self.quantity))
+        with transaction.atomic():
+            self._release_reservation(line)
+            result = super().delete(*args, **kwargs)
+            self._update_order_aggregates(line, None)
+        return result
+
+    def _release_reservation(self, line):
+        StockReservation.objects.filter(
+            order_id=self.order_id, product_id=line[0]
+        ).release()
+
+    def _line_amount(self, line):
+        product_id, quantity = line
+        if product_id == self.product_id:
+            price = self.product.price
+        else:
+            price = Product.objects.values_list(
+                'price', flat=True
+            ).get(id=product_id)
+        return quantity * price
+
+    def _update_order_aggregates(self, previous, current):
+        lines = units = amount = 0
+        if previous:
+            lines -= 1
+            units -= previous[1]
+            amount -= self._line_amount(previous)
+        if current:
+            lines += 1
+            units += current[1]
+            amount += self._line_amount(current)
+
+        if previous == current:
+            return
+
+        Order.objects.filter(id=self.order_id).update(
+            line_count=models.F('line_count') + lines,
+            total_units=models.F('total_units') + units,
+            total_amount=models.F('total_amount') + amount,
+            updated_at=timezone.now()
+        )
+        if OrderDetail.order.is_cached(self):
+            self.order.line_count += lines
+            self.order.total_units += units
+            self.order.total_amount += amount
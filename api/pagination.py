@@ -0,0 +1,56 @@
+from collections import OrderedDict
+
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+from rest_framework.response import Response
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Cursor pagination over `id` (or `created_at` with `?ordering=`), so
+    pages are stable under concurrent inserts and never use OFFSET scans.
+    The total is only counted when `?count=true` is sent.
+    """
+    ordering = 'id'
+    ordering_fields = ['id', '-id', 'created_at', '-created_at']
+    ordering_query_param = 'ordering'
+    page_size_query_param = 'page_size'
+    count_query_param = 'count'
+
+    @property
+    def max_page_size(self):
+        return getattr(settings, 'API_MAX_PAGE_SIZE', 1000)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count = None
+        if self._is_count_requested(request):
+            self.count = queryset.count()
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_ordering(self, request, queryset, view):
+        ordering = request.query_params.get(self.ordering_query_param)
+        if ordering in self.ordering_fields:
+            return (ordering, )
+        return super().get_ordering(request, queryset, view)
+
+    def get_paginated_response(self, data):
+        response = OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+        ])
+        if self.count is not None:
+            response['count'] = self.count
+        response['results'] = data
+        return Response(response)
+
+    def get_paginated_response_schema(self, schema):
+        response_schema = super().get_paginated_response_schema(schema)
+        response_schema['properties']['count'] = {
+            'type': 'integer',
+            'example': 123,
+        }
+        return response_schema
+
+    def _is_count_requested(self, request):
+        value = request.query_params.get(self.count_query_param, '')
+        return value.lower() in ['1', 'true']
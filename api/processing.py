@@ -0,0 +1,97 @@
+import logging
+
+from api import enums, stock
+from api.models import Order, OrderJob
+from api.utils import CustomValidationError
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import status
+
+
+logger = logging.getLogger(__name__)
+
+
+def set_order_status(order, order_status):
+    order.status = order_status
+    if not order.is_stamped:
+        order.stamp_totals()
+    order.save()
+
+
+def _check_editable(order):
+    if order.status not in Order.EDITABLE_STATUS:
+        raise CustomValidationError(
+            enums.Errors.NOT_EDITABLE_ORDER_ERROR.value,
+            status.HTTP_400_BAD_REQUEST
+        )
+
+
+def process_order(order):
+    """
+    Applies the stock movement of a DRAFT order, locked by the caller, and
+    marks it as processed.
+    """
+    _check_editable(order)
+
+    details = order.orderdetail_set.all()
+    if order.movement_type == Order.MovementStatus.EGRESS.value:
+        stock.substract_stock(details)
+    else:
+        stock.add_stock(details)
+
+    set_order_status(order, Order.OrderStatus.PROCESSED.value)
+
+
+def enqueue_order(order):
+    # The order is locked by the caller, so it gets one pending job at most.
+    _check_editable(order)
+    job = OrderJob.objects.filter(
+        order=order, status=OrderJob.JobStatus.PENDING.value
+    ).first()
+    return job or OrderJob.objects.create(order=order)
+
+
+def run_pending_jobs(batch_size):
+    """
+    Processes up to `batch_size` pending jobs, skipping the ones locked by
+    other workers. Each job is claimed and run in its own transaction, so
+    the rows locked by an order are released as soon as it's done. Returns
+    the number of jobs run.
+    """
+    count = 0
+    while count < batch_size and _run_next_job():
+        count += 1
+    return count
+
+
+def _run_next_job():
+    with transaction.atomic():
+        job = OrderJob.objects.select_for_update(skip_locked=True).filter(
+            status=OrderJob.JobStatus.PENDING.value
+        ).order_by('id').first()
+        if job is None:
+            return False
+        _run_job(job)
+    return True
+
+
+def _run_job(job):
+    job.attempts += 1
+    try:
+        # A failed order only rolls back its own savepoint.
+        with transaction.atomic():
+            order = Order.objects.with_details().select_for_update().get(
+                id=job.order_id
+            )
+            process_order(order)
+        job.status = OrderJob.JobStatus.DONE.value
+        job.error = ''
+    except CustomValidationError as error:
+        job.status = OrderJob.JobStatus.FAILED.value
+        job.error = error.error
+    except Exception as error:
+        logger.exception("Order job %s failed.", job.id)
+        job.status = OrderJob.JobStatus.FAILED.value
+        job.error = str(error)
+    job.finished_at = timezone.now()
+    job.save()
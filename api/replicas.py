@@ -0,0 +1,169 @@
+import contextvars
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework.permissions import SAFE_METHODS
+
+
+DEFAULT_DATABASE_REPLICAS_SETTINGS = {
+    'ALIASES': [],
+    'SELECTION': 'least_loaded',
+    'STICKY_SECONDS': 5,
+    'CACHE_ALIAS': 'default',
+}
+
+STICKY_KEY = 'api:replicas:sticky:{}'
+
+# Alias the reads of the current request are routed to, if any.
+_read_alias = contextvars.ContextVar('api_read_alias', default=None)
+
+
+def get_replicas_settings():
+    return {
+        **DEFAULT_DATABASE_REPLICAS_SETTINGS,
+        **getattr(settings, 'DATABASE_REPLICAS', {})
+    }
+
+
+class ReplicaSet:
+    """
+    Picks the replica of each request, either in turns (`round_robin`) or
+    the one serving the fewest requests of this process (`least_loaded`,
+    ties taken in turns). Thread safe.
+    """
+
+    def __init__(self, aliases, selection='least_loaded'):
+        self.aliases = list(aliases)
+        self.selection = selection
+        self.in_use = {alias: 0 for alias in self.aliases}
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            count = len(self.aliases)
+            candidates = [
+                self.aliases[(self._next + offset) % count]
+                for offset in range(count)
+            ]
+            if self.selection == 'least_loaded':
+                alias = min(candidates, key=self.in_use.__getitem__)
+            else:
+                alias = candidates[0]
+            self._next = (self.aliases.index(alias) + 1) % count
+            self.in_use[alias] += 1
+            return alias
+
+    def release(self, alias):
+        with self._lock:
+            self.in_use[alias] -= 1
+
+
+_replica_set = None
+_replica_set_lock = threading.Lock()
+
+
+def get_replica_set():
+    global _replica_set
+    if _replica_set is None:
+        config = get_replicas_settings()
+        with _replica_set_lock:
+            if _replica_set is None:
+                _replica_set = ReplicaSet(
+                    config['ALIASES'], config['SELECTION']
+                )
+    return _replica_set
+
+
+def reset_replica_set(**kwargs):
+    global _replica_set
+    if kwargs.get('setting', 'DATABASE_REPLICAS') == 'DATABASE_REPLICAS':
+        _replica_set = None
+
+
+setting_changed.connect(reset_replica_set)
+
+
+def _get_cache():
+    return caches[get_replicas_settings()['CACHE_ALIAS']]
+
+
+def stick_to_primary(user):
+    # Reads of `user` go to the primary until their writes have replicated.
+    seconds = get_replicas_settings()['STICKY_SECONDS']
+    if seconds and user.is_authenticated:
+        _get_cache().set(STICKY_KEY.format(user.pk), True, seconds)
+
+
+def is_sticky(user):
+    return user.is_authenticated and bool(
+        _get_cache().get(STICKY_KEY.format(user.pk))
+    )
+
+
+class ReplicaRouter:
+    """
+    Sends the reads of requests served by a replica to it, everything else
+    goes to the default database. Replicas are copies of the default one,
+    so migrations only run on the default one.
+    """
+
+    def db_for_read(self, model, **hints):
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Rows read from a replica are rows of the default database.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in get_replicas_settings()['ALIASES']:
+            return False
+        return None
+
+
+class ReplicaReadMixin:
+    """
+    Serves the `REPLICA_ACTIONS` of GET requests from a replica, unless the
+    user wrote in the last STICKY_SECONDS. Successful writes of the view
+    start that window. Streamed responses are read after the view returns,
+    so their querysets are pinned with .using(self.read_alias).
+    """
+    REPLICA_ACTIONS = ['list', 'retrieve', 'export']
+
+    read_alias = None
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        replica_set = get_replica_set()
+        if (
+            replica_set.aliases and request.method in SAFE_METHODS and
+            self.action in self.REPLICA_ACTIONS and
+            not is_sticky(request.user)
+        ):
+            self._replica_set = replica_set
+            self.read_alias = replica_set.acquire()
+            self._read_alias_token = _read_alias.set(self.read_alias)
+
+    def dispatch(self, request, *args, **kwargs):
+        # Uncaught exceptions skip finalize_response, give the replica back
+        # here so a failed request can't leave it routed or counted.
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            if self.read_alias is not None:
+                _read_alias.reset(self._read_alias_token)
+                self._replica_set.release(self.read_alias)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        if (
+            request.method not in SAFE_METHODS and response.status_code < 400
+            and get_replica_set().aliases
+        ):
+            stick_to_primary(request.user)
+        return super().finalize_response(request, response, *args, **kwargs)
@@ -0,0 +1,213 @@
+import functools
+from operator import attrgetter, itemgetter
+
+from api import metrics
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.db import models
+from rest_framework import renderers, serializers
+from rest_framework.relations import ManyRelatedField, PKOnlyObject
+from rest_framework.response import Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# Fields whose to_representation is exactly the builtin.
+BUILTIN_CONVERTERS = {
+    serializers.BooleanField: bool,
+    serializers.CharField: str,
+    serializers.FloatField: float,
+    serializers.IntegerField: int,
+}
+
+
+def _represent_many(plan, value):
+    # Same as ListSerializer.to_representation.
+    iterable = value.all() if isinstance(value, models.Manager) else value
+    return [plan.to_representation(item) for item in iterable]
+
+
+def _represent_field(field, value):
+    # Same None handling as Serializer.to_representation.
+    check_for_none = value.pk if isinstance(value, PKOnlyObject) else value
+    return None if check_for_none is None else field.to_representation(value)
+
+
+class FieldPlan:
+    """
+    Read path of a serializer compiled once: the getter and converter of
+    each readable field, so representing a row skips the per field work of
+    Serializer.to_representation while producing the same data. Plans of
+    serializers made only of model columns also represent .values() rows.
+    """
+
+    def __init__(self, serializer):
+        self.names = []
+        self.getters = []
+        self.converters = []
+        self.columns = []
+        for field in serializer._readable_fields:
+            getter, converter, column = self._compile(serializer, field)
+            self.names.append(field.field_name)
+            self.getters.append(getter)
+            self.converters.append(converter)
+            if self.columns is not None and column is not None:
+                self.columns.append(column)
+            else:
+                self.columns = None
+
+        self.fields = list(zip(self.names, self.getters, self.converters))
+        if self.columns is not None:
+            self.row_fields = [
+                (name, itemgetter(column), converter)
+                for name, column, converter in zip(
+                    self.names, self.columns, self.converters
+                )
+            ]
+
+    def _compile(self, serializer, field):
+        """
+        Returns the getter and converter of `field`, plus its column when it
+        reads a plain model column. Converters are never called with None.
+        """
+        if len(field.source_attrs) != 1:
+            # Dotted and '*' sources keep the DRF lookups.
+            return field.get_attribute, functools.partial(
+                _represent_field, field
+            ), None
+
+        getter = attrgetter(field.source)
+        if isinstance(field, serializers.ListSerializer):
+            return getter, functools.partial(
+                _represent_many, FieldPlan(field.child)
+            ), None
+        if isinstance(field, serializers.BaseSerializer):
+            return getter, FieldPlan(field).to_representation, None
+        if getattr(field, 'serializer_class', None):
+            # Related fields rendering the object with a serializer.
+            plan = get_plan(field.serializer_class)
+            return getter, plan.to_representation, None
+        if isinstance(field, (ManyRelatedField, serializers.RelatedField)):
+            return field.get_attribute, functools.partial(
+                _represent_field, field
+            ), None
+
+        converter = BUILTIN_CONVERTERS.get(
+            type(field), field.to_representation
+        )
+        return getter, converter, self._get_column(serializer, field.source)
+
+    def _get_column(self, serializer, source):
+        meta = getattr(serializer, 'Meta', None)
+        model = getattr(meta, 'model', None)
+        if model is None:
+            return None
+        try:
+            model_field = model._meta.get_field(source)
+        except FieldDoesNotExist:
+            return None
+        if not model_field.concrete or model_field.is_relation:
+            return None
+        return source
+
+    def to_representation(self, instance):
+        data = {}
+        for name, getter, converter in self.fields:
+            value = getter(instance)
+            data[name] = None if value is None else converter(value)
+        return data
+
+    def represent_instances(self, instances):
+        return [self.to_representation(instance) for instance in instances]
+
+    def represent_rows(self, rows):
+        # Rows of queryset.values(*self.columns).
+        results = []
+        for row in rows:
+            data = {}
+            for name, getter, converter in self.row_fields:
+                value = getter(row)
+                data[name] = None if value is None else converter(value)
+            results.append(data)
+        return results
+
+
+@functools.lru_cache(maxsize=256)
+def get_plan(serializer_class, **kwargs):
+    # Keyword arguments are passed to the serializer, and must be hashable.
+    return FieldPlan(serializer_class(**kwargs))
+
+
+def is_enabled():
+    return getattr(settings, 'API_COMPILED_SERIALIZERS', True)
+
+
+class CompiledReadMixin:
+    """
+    Serves list and retrieve through the FieldPlan of the serializer class.
+    Views whose serializer only reads columns set `compiled_values = True`
+    to list straight from .values() rows, without building model instances.
+    """
+    compiled_values = False
+
+    def get_compiled_plan(self):
+        return get_plan(self.get_serializer_class())
+
+    def list(self, request, *args, **kwargs):
+        if not is_enabled():
+            return super().list(request, *args, **kwargs)
+
+        plan = self.get_compiled_plan()
+        queryset = self.filter_queryset(self.get_queryset())
+        from_rows = self.compiled_values and plan.columns is not None
+        if from_rows:
+            queryset = queryset.values(*plan.columns)
+
+        page = self.paginate_queryset(queryset)
+        items = queryset if page is None else page
+        with metrics.timer('serializer'):
+            if from_rows:
+                data = plan.represent_rows(items)
+            else:
+                data = plan.represent_instances(items)
+        if page is None:
+            return Response(data)
+        return self.get_paginated_response(data)
+
+    def retrieve(self, request, *args, **kwargs):
+        if not is_enabled():
+            return super().retrieve(request, *args, **kwargs)
+
+        plan = self.get_compiled_plan()
+        instance = self.get_object()
+        with metrics.timer('serializer'):
+            data = plan.to_representation(instance)
+        return Response(data)
+
+
+class ORJSONRenderer(renderers.JSONRenderer):
+    """
+    JSONRenderer writing compact responses with orjson when it's installed.
+    Floats in exponent notation are written as 1e16 instead of 1e+16, and
+    NaN as null; everything else is byte for byte the JSONRenderer output.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        indent = self.get_indent(accepted_media_type, renderer_context or {})
+        if (
+            orjson is None or data is None or indent is not None or
+            not self.compact or self.ensure_ascii
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        ret = orjson.dumps(
+            data, default=self.encoder_class().default,
+            option=orjson.OPT_PASSTHROUGH_DATETIME
+        )
+        # Escaped by JSONRenderer so the output stays a JavaScript subset.
+        return ret.replace(
+            '\u2028'.encode(), b'\\u2028'
+        ).replace('\u2029'.encode(), b'\\u2029')
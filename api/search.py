@@ -0,0 +1,110 @@
+import re
+import threading
+from bisect import bisect_left
+
+from api import catalog
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchVectorField
+from django.db import connection, models
+
+
+TOKEN_PATTERN = re.compile(r'\w+')
+
+
+def tokenize(value):
+    return TOKEN_PATTERN.findall(value.lower())
+
+
+class NameSearchVector(models.Func):
+    # Same expression as the api_product_name_search_idx GIN index.
+    function = 'to_tsvector'
+    template = "%(function)s('simple'::regconfig, %(expressions)s)"
+    output_field = SearchVectorField()
+
+
+class InvertedIndex:
+    """
+    Prefix index of product name tokens, for databases without full-text
+    search. Tokens are kept sorted so every prefix is a contiguous range.
+    """
+
+    def __init__(self, rows):
+        postings = {}
+        for product_id, name in rows:
+            for token in tokenize(name):
+                postings.setdefault(token, set()).add(product_id)
+        self.tokens = sorted(postings)
+        self.postings = [postings[token] for token in self.tokens]
+
+    def search(self, query):
+        result = None
+        for term in tokenize(query):
+            ids = set()
+            index = bisect_left(self.tokens, term)
+            while (
+                index < len(self.tokens) and
+                self.tokens[index].startswith(term)
+            ):
+                ids |= self.postings[index]
+                index += 1
+            result = ids if result is None else result & ids
+            if not result:
+                break
+        return result or set()
+
+
+_index = None
+_index_key = None
+_index_lock = threading.Lock()
+
+
+def get_inverted_index(model):
+    # Rebuilt when names change or products are added or removed, stock
+    # and reservation changes keep it. Bulk inserts send no signals, they
+    # show up in the last id.
+    global _index, _index_key
+    key = (
+        catalog.names_version(),
+        model.objects.aggregate(value=models.Max('id'))['value']
+    )
+    with _index_lock:
+        if _index_key != key:
+            _index = InvertedIndex(
+                model.objects.values_list('id', 'name').iterator()
+            )
+            _index_key = key
+        return _index
+
+
+def _word_prefix_filter(terms):
+    return models.Q(*[
+        models.Q(name__iregex=r'(^|\W)' + re.escape(term)) for term in terms
+    ])
+
+
+def search_products(queryset, query):
+    """
+    Filters `queryset` to the products whose name has a word starting with
+    every word of `query`. On PostgreSQL names containing `query` match too.
+    """
+    terms = tokenize(query)
+    if not terms:
+        return queryset
+
+    if connection.vendor == 'postgresql':
+        return queryset.annotate(
+            name_vector=NameSearchVector('name')
+        ).filter(
+            models.Q(name_vector=SearchQuery(
+                ' & '.join(f'{term}:*' for term in terms),
+                config='simple', search_type='raw'
+            )) |
+            models.Q(name__icontains=query.strip())
+        )
+
+    ids = get_inverted_index(queryset.model).search(query)
+    if len(ids) > getattr(settings, 'PRODUCT_SEARCH_MAX_IDS', 1000):
+        # Too many matches for an IN list, but then a scan in page order
+        # finds a page of them right away.
+        return queryset.filter(_word_prefix_filter(terms))
+    return queryset.filter(id__in=ids)
@@ -1,7 +1,9 @@
+from django.db.models import prefetch_related_objects
 from django.db.utils import IntegrityError
 from api import enums
 from api.models import (
-    Order, OrderDetail, Product
+    Order, OrderDetail, OrderJob, Product, StockReservation,
+    order_details_prefetch
 )
 from api.utils import CustomValidationError
 from api.validators import greater_than_zero
@@ -19,7 +21,7 @@ class ProductSerializer(serializers.ModelSerializer):
     class Meta:
         fields = '__all__'
         model = Product
-        read_only_fields = ['created_at', 'updated_at', 'stock']
+        read_only_fields = ['created_at', 'updated_at', 'reserved', 'stock']
 
 
 class ProductReadOnlySerializer(serializers.ModelSerializer):
@@ -27,20 +29,57 @@ class ProductReadOnlySerializer(serializers.ModelSerializer):
         fields = '__all__'
         model = Product
         read_only_fields = [
-            'available', 'created_at', 'name', 'price', 'stock', 'updated_at'
+            'available', 'created_at', 'name', 'price', 'reserved', 'stock',
+            'updated_at'
         ]
 
 
 class ProductRelatedField(serializers.RelatedField):
+    # Also used by representations.FieldPlan to nest products.
+    serializer_class = ProductSerializer
+    default_error_messages = {
+        'does_not_exist': enums.Errors.MISSING_PRODUCT_ERROR.value,
+        'incorrect_type': enums.Errors.PRODUCT_PK_TYPE_ERROR.value,
+    }
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.prefetched = None
+
+    def prefetch(self, values):
+        # Resolves every id of a list with a single query, used by
+        # OrderDetailListSerializer before validating each item.
+        pks = []
+        for value in values:
+            try:
+                pks.append(self._to_pk(value))
+            except (TypeError, ValueError):
+                continue
+        self.prefetched = self.get_queryset().in_bulk(pks)
+
     def to_representation(self, value):
-        return ProductSerializer(value).data
+        return self.serializer_class(value).data
 
     def to_internal_value(self, data):
-        obj = Product.objects.get(id=data)
+        try:
+            pk = self._to_pk(data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+
+        if self.prefetched is not None:
+            obj = self.prefetched.get(pk)
+        else:
+            obj = self.get_queryset().filter(id=pk).first()
+
         if not obj:
-            raise serializers.ValidationError('Object does not exist.')
+            self.fail('does_not_exist', pk_value=data)
         return obj
 
+    def _to_pk(self, value):
+        if isinstance(value, bool):
+            raise TypeError()
+        return int(str(value))
+
 
 class OrderStatusSerializer(serializers.ModelSerializer):
     class Meta:
@@ -49,12 +88,42 @@ class OrderStatusSerializer(serializers.ModelSerializer):
         read_only_fields = ['status']
 
 
+class OrderJobSerializer(serializers.ModelSerializer):
+    url = serializers.HyperlinkedIdentityField(view_name='api:order-job-detail')
+
+    class Meta:
+        fields = [
+            'id', 'url', 'order', 'status', 'error', 'attempts', 'created_at',
+            'finished_at'
+        ]
+        model = OrderJob
+        read_only_fields = fields
+
+
+class OrderDetailListSerializer(serializers.ListSerializer):
+    def to_internal_value(self, data):
+        if isinstance(data, list):
+            self.child.fields['product'].prefetch(
+                item.get('product') for item in data if isinstance(item, dict)
+            )
+        return super().to_internal_value(data)
+
+
 class OrderDetailSerializer(serializers.ModelSerializer):
     quantity = serializers.IntegerField(required=True)
     product = ProductRelatedField(
         queryset=Product.objects.all(), read_only=False
     )
 
+    def __init__(self, *args, **kwargs):
+        # With expand_product=False products are rendered as their ids.
+        expand_product = kwargs.pop('expand_product', True)
+        super().__init__(*args, **kwargs)
+        if not expand_product:
+            self.fields['product'] = serializers.PrimaryKeyRelatedField(
+                read_only=True
+            )
+
     def validate_quantity(self, value):
         greater_than_zero(value)
         return value
@@ -112,32 +181,155 @@ class OrderDetailSerializer(serializers.ModelSerializer):
     class Meta:
         depth = 1
         exclude = ['order']
+        list_serializer_class = OrderDetailListSerializer
         model = OrderDetail
         read_only_fields = ['created_at', 'updated_at']
 
 
 class OrderSerializer(serializers.ModelSerializer):
+    EXPANDABLE_FIELDS = ['details', 'details.product']
+
     details = OrderDetailSerializer(source="orderdetail_set", many=True)
     total = serializers.FloatField(required=False, read_only=True)
     usd_total = serializers.FloatField(required=False, read_only=True)
 
+    def __init__(self, *args, **kwargs):
+        """
+        `fields` limits the fields rendered, and `expand` the relations
+        rendered as objects out of EXPANDABLE_FIELDS; the others are
+        rendered as ids. Both default to everything.
+        """
+        fields = kwargs.pop('fields', None)
+        expand = kwargs.pop('expand', None)
+        super().__init__(*args, **kwargs)
+
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+        if expand is None or 'details' not in self.fields:
+            return
+        if 'details' not in expand:
+            self.fields['details'] = serializers.PrimaryKeyRelatedField(
+                source='orderdetail_set', many=True, read_only=True
+            )
+        elif 'details.product' not in expand:
+            self.fields['details'] = OrderDetailSerializer(
+                source='orderdetail_set', many=True, read_only=True,
+                expand_product=False
+            )
+
     def create(self, validated_data):
         details = validated_data.pop('orderdetail_set')
-        order = Order.objects.create(**validated_data)
-        for detail in details:
-            self._create_order_detail(order, detail)
+        order = Order(**validated_data)
+        order_details = [
+            self._build_order_detail(order, detail) for detail in details
+        ]
+        # Aggregates are known upfront, so details are inserted in bulk.
+        order.add_lines(order_details)
+        order.save()
+        OrderDetail.objects.bulk_create(order_details)
+        StockReservation.reserve(order, order_details)
+        prefetch_related_objects([order], order_details_prefetch())
         return order
 
-    def _create_order_detail(self, instance, data):
+    def _build_order_detail(self, instance, data):
         product = data.pop('product')
-        return OrderDetail.objects.create(
-            order=instance, product=product, **data
-        )
+        return OrderDetail(order=instance, product=product, **data)
 
     class Meta:
         depth = 1
         fields = '__all__'
         model = Order
         read_only_fields = [
-            'created_at', 'updated_at', 'total', 'usd_total', 'status'
+            'created_at', 'updated_at', 'total', 'usd_total', 'status',
+            'exchange_rate', 'processed_total', 'processed_usd_total',
+            'line_count', 'total_units', 'total_amount'
         ]
+
+
+class OrderBulkDetailSerializer(serializers.Serializer):
+    product = serializers.IntegerField(required=True)
+    quantity = serializers.IntegerField(required=True)
+
+    def validate_quantity(self, value):
+        greater_than_zero(value)
+        return value
+
+
+class OrderBulkSerializer(serializers.Serializer):
+    details = OrderBulkDetailSerializer(many=True, required=True)
+    movement_type = serializers.ChoiceField(
+        choices=Order.MovementStatus.choices,
+        default=Order.MovementStatus.EGRESS.value
+    )
+
+    def validate_details(self, value):
+        products = [detail['product'] for detail in value]
+        if len(products) != len(set(products)):
+            raise serializers.ValidationError(
+                enums.Errors.DUPLICATED_PRODUCT_ERROR.value
+            )
+        return value
+
+    @classmethod
+    def bulk_create(cls, items):
+        """
+        Creates every valid order of `items` with one product lookup and
+        two bulk inserts, returning a result per item in input order.
+        """
+        results = [None] * len(items)
+        valid_items = []
+        for index, item in enumerate(items):
+            serializer = cls(data=item)
+            if serializer.is_valid():
+                valid_items.append((index, serializer.validated_data))
+            else:
+                results[index] = cls._error_result(index, serializer.errors)
+
+        product_ids = {
+            detail['product']
+            for _, item in valid_items for detail in item['details']
+        }
+        products = Product.objects.in_bulk(product_ids)
+
+        orders = []
+        for index, item in valid_items:
+            missing = [
+                detail['product'] for detail in item['details']
+                if detail['product'] not in products
+            ]
+            if missing:
+                results[index] = cls._error_result(index, {
+                    'details': [
+                        enums.Errors.MISSING_PRODUCT_ERROR.value.format(
+                            pk_value=product_id
+                        ) for product_id in missing
+                    ]
+                })
+                continue
+            order = Order(movement_type=item['movement_type'])
+            order_details = [
+                OrderDetail(
+                    order=order, product=products[detail['product']],
+                    quantity=detail['quantity']
+                ) for detail in item['details']
+            ]
+            order.add_lines(order_details)
+            orders.append((index, order, order_details))
+
+        Order.objects.bulk_create([order for _, order, _ in orders])
+        OrderDetail.objects.bulk_create([
+            detail for _, _, order_details in orders
+            for detail in order_details
+        ])
+        StockReservation.reserve_orders([
+            (order, order_details) for _, order, order_details in orders
+        ])
+
+        for index, order, _ in orders:
+            results[index] = {'index': index, 'ok': True, 'id': order.id}
+        return results
+
+    @staticmethod
+    def _error_result(index, errors):
+        return {'index': index, 'ok': False, 'errors': errors}
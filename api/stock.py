@@ -0,0 +1,120 @@
+from api import enums
+from api.models import (
+    Product, StockMovement, StockReservation, quantity_case
+)
+from api.utils import CustomValidationError
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from rest_framework import status
+
+
+def _group_quantities(lines):
+    quantities = {}
+    for line in lines:
+        quantities[line.product_id] = (
+            quantities.get(line.product_id, 0) + line.quantity
+        )
+    return quantities
+
+
+def _lock_reservations(details):
+    # Locked before the products, the same order the sweeper uses.
+    order_ids = {detail.order_id for detail in details}
+    if not order_ids:
+        return []
+    return list(
+        StockReservation.objects.select_for_update().filter(
+            order_id__in=order_ids
+        ).order_by('id')
+    )
+
+
+def _lock_products(product_ids):
+    # Rows are always locked in id order so two orders sharing products
+    # can't deadlock each other.
+    return {
+        product.id: product
+        for product in Product.objects.select_for_update().filter(
+            id__in=product_ids
+        ).order_by('id')
+    }
+
+
+def _update_stock(products, quantities, sign, released):
+    # A single UPDATE for every line of the order, converting its
+    # reservations at the same time.
+    updated_at = timezone.now()
+    changes = {'updated_at': updated_at}
+    if quantities:
+        changes['stock'] = F('stock') + quantity_case({
+            product_id: sign * quantity
+            for product_id, quantity in quantities.items()
+        })
+    if released:
+        changes['reserved'] = F('reserved') - quantity_case(released)
+    Product.objects.filter(id__in=products).update(**changes)
+
+    for product_id, product in products.items():
+        product.sync_stock(
+            product.stock + sign * quantities.get(product_id, 0)
+        )
+        product.reserved -= released.get(product_id, 0)
+        product.updated_at = updated_at
+
+
+def _record_movements(details, sign):
+    # Ledger rows are written in the same transaction as the stock update.
+    StockMovement.objects.bulk_create([
+        StockMovement(
+            order_id=detail.order_id, product_id=detail.product_id,
+            quantity=sign * detail.quantity
+        ) for detail in details
+    ])
+
+
+def _sync_details(details, products):
+    # Keep already loaded products in line with the locked rows.
+    for detail in details:
+        product = products[detail.product_id]
+        detail.product.sync_stock(product.stock)
+        detail.product.reserved = product.reserved
+        detail.product.updated_at = product.updated_at
+
+
+def _move_stock(details, sign, error=None):
+    quantities = _group_quantities(details)
+
+    with transaction.atomic():
+        reservations = _lock_reservations(details)
+        released = _group_quantities(reservations)
+        if not quantities and not released:
+            return
+
+        products = _lock_products(set(quantities) | set(released))
+        if error:
+            # Validate every line before touching any row.
+            for product_id, quantity in sorted(quantities.items()):
+                if not products[product_id].can_be_supplied(
+                    quantity, released.get(product_id, 0)
+                ):
+                    raise CustomValidationError(
+                        error, status.HTTP_400_BAD_REQUEST
+                    )
+        _update_stock(products, quantities, sign, released)
+        _record_movements(details, sign)
+        if reservations:
+            StockReservation.objects.filter(
+                id__in=[reservation.id for reservation in reservations]
+            ).delete()
+    _sync_details(details, products)
+
+
+def add_stock(details):
+    _move_stock(details, 1)
+
+
+def substract_stock(
+    details, error=enums.Errors.STOCK_AVAILABILITY_ERROR.value
+):
+    _move_stock(details, -1, error)
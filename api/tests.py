@@ -1,18 +1,86 @@
+from datetime import timedelta
+from io import StringIO
 from itertools import product
+import csv
 import json
+import os
+import tempfile
+import threading
+import time
+from unittest import skipUnless
 
 from coreapi import Object
-from api import enums
-from api.models import Order, OrderDetail, Product
+from api import (
+    enums, metrics, processing, replicas, representations, search
+)
+from api.db.pool import ConnectionPool, PoolTimeout
+from api.exchange import (
+    CachedExchangeRateProvider, StubExchangeRateProvider,
+    get_exchange_rate_provider
+)
+from api.models import (
+    ExchangeRate, IdempotencyKey, Order, OrderDetail, OrderJob, Product,
+    StockMovement, StockReservation, StockSnapshot
+)
+from api.serializers import OrderSerializer, ProductReadOnlySerializer
+from api.utils import (
+    CircuitBreaker, CircuitOpenError, TimedHTTPAdapter, get_http_session
+)
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import (
+    SimpleTestCase, TestCase, TransactionTestCase, override_settings,
+    skipUnlessDBFeature
+)
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
-from mock import patch
+from django.utils import timezone
+from mock import Mock, patch
+import requests
 from rest_framework import status
+from rest_framework.renderers import JSONRenderer
 from rest_framework.test import APIClient
 from rest_framework_simplejwt.tokens import RefreshToken
 
 
+class AuthenticatedAPITestCase(TestCase):
+    """
+    Requests are sent by `self.user`, a superuser when `superuser` is set,
+    with an empty cache and Order._get_usd_exchange_rate stubbed to
+    `exchange_rate` (mocked as `self.get_rate`, None keeps the provider).
+    """
+    exchange_rate = 1
+    superuser = False
+
+    def setUp(self):
+        caches['default'].clear()
+        if self.exchange_rate is not None:
+            patcher = patch(
+                'api.models.Order._get_usd_exchange_rate',
+                return_value=self.exchange_rate
+            )
+            self.get_rate = patcher.start()
+            self.addCleanup(patcher.stop)
+
+        users = get_user_model().objects
+        create_user = (
+            users.create_superuser if self.superuser else users.create_user
+        )
+        self.user = create_user(email="test@email.com", password="Password1")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_products(self, count, **fields):
+        return [
+            Product.objects.create(**{
+                'price': 10, 'name': f"Product {index}", 'available': True,
+                **fields
+            }) for index in range(count)
+        ]
+
+
 class APITests(TestCase):
     def setUp(self):
         self.user_model = get_user_model()
@@ -192,7 +260,7 @@ class APITests(TestCase):
         self.client.credentials(**token)
         response = self.client.get(url, {'available': False})
         data = json.loads(response.content)
-        self.assertEqual(len(data), self.unavailable_products)
+        self.assertEqual(len(data['results']), self.unavailable_products)
 
     def test_product_list_available(self):
         url = reverse("api:product-list")
@@ -200,7 +268,22 @@ class APITests(TestCase):
         self.client.credentials(**token)
         response = self.client.get(url, {'available': True})
         data = json.loads(response.content)
-        self.assertEqual(len(data), self.available_products)
+        self.assertEqual(len(data['results']), self.available_products)
+
+    def test_product_list_available_lowercase(self):
+        url = reverse("api:product-list")
+        token = self.get_token_for_user(self.normal_user)
+        self.client.credentials(**token)
+        response = self.client.get(url, {'available': 'true'})
+        data = json.loads(response.content)
+        self.assertEqual(len(data['results']), self.available_products)
+
+        response = self.client.get(url, {'available': 'maybe'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            json.loads(response.content)['message'],
+            enums.Errors.INVALID_BOOLEAN_ERROR.value.format('available')
+        )
 
     def test_product_list(self):
         url = reverse("api:product-list")
@@ -209,7 +292,7 @@ class APITests(TestCase):
         response = self.client.get(url)
         data = json.loads(response.content)
         self.assertEqual(
-            len(data),
+            len(data['results']),
             self.unavailable_products + self.available_products
         )
 
@@ -627,8 +710,8 @@ class APITests(TestCase):
         data = json.loads(response.content)
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(data), 1)
-        self.assertEqual(data[0]['id'], self.order_detail1.id)
+        self.assertEqual(len(data['results']), 1)
+        self.assertEqual(data['results'][0]['id'], self.order_detail1.id)
 
     @patch('api.models.Order._get_usd_exchange_rate', return_value=1)
     def test_order_detail_create_admin_user(self, _):
@@ -1700,3 +1783,2182 @@ class APITests(TestCase):
         order_detail = Order.objects.filter(id=self.order1.id).first()
         self.assertIsNone(order)
         self.assertIsNone(order_detail)
+
+
+class CountingExchangeRateProvider(StubExchangeRateProvider):
+    def __init__(self, rate=1, delay=0):
+        super().__init__(rate)
+        self.delay = delay
+        self.calls = 0
+
+    def get_rate(self):
+        self.calls += 1
+        time.sleep(self.delay)
+        return super().get_rate()
+
+
+class ExchangeRateProviderTests(SimpleTestCase):
+    def test_rate_is_cached_during_ttl(self):
+        provider = CountingExchangeRateProvider(rate=300)
+        cached = CachedExchangeRateProvider(provider, ttl=60)
+
+        self.assertEqual(cached.get_rate(), 300)
+        self.assertEqual(cached.get_rate(), 300)
+        self.assertEqual(provider.calls, 1)
+
+    def test_concurrent_requests_fetch_once(self):
+        provider = CountingExchangeRateProvider(rate=300, delay=0.2)
+        cached = CachedExchangeRateProvider(provider, ttl=60)
+
+        threads = [
+            threading.Thread(target=cached.get_rate) for _ in range(10)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(provider.calls, 1)
+
+    def test_stale_rate_served_while_revalidating(self):
+        provider = CountingExchangeRateProvider(rate=300, delay=0.2)
+        cached = CachedExchangeRateProvider(provider, ttl=60, stale_ttl=60)
+        cached._entry = (200, time.time() - 90)
+
+        started = time.monotonic()
+        self.assertEqual(cached.get_rate(), 200)
+        self.assertLess(time.monotonic() - started, 0.1)
+
+        cached._refresh_thread.join()
+        self.assertEqual(provider.calls, 1)
+        self.assertEqual(cached.get_rate(), 300)
+
+    def test_expired_rate_is_fetched(self):
+        provider = CountingExchangeRateProvider(rate=300)
+        cached = CachedExchangeRateProvider(provider, ttl=60, stale_ttl=60)
+        cached._entry = (200, time.time() - 150)
+
+        self.assertEqual(cached.get_rate(), 300)
+        self.assertEqual(provider.calls, 1)
+
+    @override_settings(CACHES={
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'exchange-rate-tests',
+        }
+    })
+    def test_rate_shared_through_django_cache(self):
+        caches['default'].clear()
+        provider = CountingExchangeRateProvider(rate=300)
+        first = CachedExchangeRateProvider(
+            provider, ttl=60, cache_alias='default'
+        )
+        second = CachedExchangeRateProvider(
+            provider, ttl=60, cache_alias='default'
+        )
+
+        self.assertEqual(first.get_rate(), 300)
+        self.assertEqual(second.get_rate(), 300)
+        self.assertEqual(provider.calls, 1)
+
+    @override_settings(EXCHANGE_RATE={
+        'PROVIDER': 'api.exchange.StubExchangeRateProvider',
+        'OPTIONS': {'rate': 250},
+    })
+    def test_provider_built_from_settings(self):
+        provider = get_exchange_rate_provider()
+
+        self.assertIsInstance(provider, CachedExchangeRateProvider)
+        self.assertIsInstance(provider.provider, StubExchangeRateProvider)
+        self.assertEqual(provider.get_rate(), 250)
+
+
+class ExchangeRateSnapshotTests(AuthenticatedAPITestCase):
+    exchange_rate = None
+
+    def setUp(self):
+        super().setUp()
+        self.product = Product.objects.create(
+            price=100, name="Default product1", available=True, stock=10
+        )
+        self.order = Order.objects.create()
+        OrderDetail.objects.create(
+            order=self.order, product=self.product, quantity=2
+        )
+
+    @patch('api.models.Order._get_usd_exchange_rate', return_value=4)
+    def test_process_stamps_totals(self, get_rate):
+        url = reverse("api:order-process", args=[self.order.id])
+        response = self.client.post(url)
+        data = json.loads(response.content)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(data['exchange_rate'], 4)
+        self.assertEqual(data['processed_total'], 200)
+        self.assertEqual(data['processed_usd_total'], 50)
+        self.assertEqual(ExchangeRate.objects.count(), 1)
+
+        get_rate.reset_mock()
+        self.product.price = 1000
+        self.product.save()
+        response = self.client.get(
+            reverse("api:order-detail", args=[self.order.id])
+        )
+        data = json.loads(response.content)
+
+        get_rate.assert_not_called()
+        self.assertEqual(data['total'], 200)
+        self.assertEqual(data['usd_total'], 50)
+
+    @patch('api.models.Order._get_usd_exchange_rate', return_value=4)
+    def test_process_uses_recent_snapshot(self, get_rate):
+        ExchangeRate.record(5)
+        url = reverse("api:order-process", args=[self.order.id])
+        response = self.client.post(url)
+        data = json.loads(response.content)
+
+        get_rate.assert_not_called()
+        self.assertEqual(data['usd_total'], 40)
+        self.assertEqual(ExchangeRate.objects.count(), 1)
+
+    def test_backfill_order_totals(self):
+        ExchangeRate.objects.create(
+            rate=2, source='test',
+            created_at=timezone.now() - timedelta(days=2)
+        )
+        ExchangeRate.objects.create(rate=8, source='test')
+        Order.objects.filter(id=self.order.id).update(
+            status=Order.OrderStatus.PROCESSED.value,
+            updated_at=timezone.now() - timedelta(days=1)
+        )
+        draft = Order.objects.create()
+
+        call_command('backfill_order_totals', batch_size=1, stdout=StringIO())
+
+        self.order.refresh_from_db()
+        draft.refresh_from_db()
+        self.assertEqual(self.order.exchange_rate, 2)
+        self.assertEqual(self.order.processed_total, 200)
+        self.assertEqual(self.order.processed_usd_total, 100)
+        self.assertFalse(draft.is_stamped)
+
+    @override_settings(EXCHANGE_RATE={
+        'PROVIDER': 'api.exchange.StubExchangeRateProvider',
+        'OPTIONS': {'rate': 250},
+    })
+    def test_refresh_exchange_rates(self):
+        call_command('refresh_exchange_rates', stdout=StringIO())
+
+        self.assertEqual(ExchangeRate.objects.latest().rate, 250)
+
+
+class OrderQueryCountTests(AuthenticatedAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.products = [
+            Product.objects.create(
+                price=10 * (i + 1), name=f"Product {i}", available=True
+            ) for i in range(3)
+        ]
+        self.create_orders(2)
+
+    def create_orders(self, count):
+        for _ in range(count):
+            order = Order.objects.create()
+            for product in self.products:
+                OrderDetail.objects.create(
+                    order=order, product=product, quantity=2
+                )
+
+    def test_order_list_constant_queries(self):
+        url = reverse("api:order-list")
+        with CaptureQueriesContext(connection) as few_orders:
+            self.client.get(url)
+
+        self.create_orders(10)
+        with self.assertNumQueries(len(few_orders)):
+            response = self.client.get(url)
+
+        data = json.loads(response.content)
+        self.assertEqual(len(data['results']), 12)
+        self.assertEqual(data['results'][0]['total'], 120)
+
+    def test_order_list_queries(self):
+        # Savepoint, ETag versions of the orders and of the products, orders,
+        # details joined with products and release
+        with self.assertNumQueries(6):
+            self.client.get(reverse("api:order-list"))
+
+    def test_order_retrieve_queries(self):
+        order = Order.objects.first()
+        with self.assertNumQueries(5):
+            response = self.client.get(
+                reverse("api:order-detail", args=[order.id])
+            )
+
+        data = json.loads(response.content)
+        self.assertEqual(len(data['details']), 3)
+        self.assertEqual(data['total'], 120)
+
+    def test_order_detail_list_queries(self):
+        order = Order.objects.first()
+        with self.assertNumQueries(3):
+            self.client.get(
+                reverse("api:order-detail-list", args=[order.id])
+            )
+
+    def test_order_total_annotation(self):
+        order = Order.objects.with_total().first()
+
+        with self.assertNumQueries(0):
+            self.assertEqual(order.total, 120)
+
+
+class StockEngineTests(AuthenticatedAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.product1 = Product.objects.create(
+            price=100, name="Product 1", available=True, stock=5
+        )
+        self.product2 = Product.objects.create(
+            price=80, name="Product 2", available=True, stock=1
+        )
+        self.order = Order.objects.create()
+        OrderDetail.objects.create(
+            order=self.order, product=self.product1, quantity=2
+        )
+        OrderDetail.objects.create(
+            order=self.order, product=self.product2, quantity=3
+        )
+
+    def test_process_validates_all_lines_before_updating(self):
+        url = reverse("api:order-process", args=[self.order.id])
+        response = self.client.post(url)
+        data = json.loads(response.content)
+
+        self.product1.refresh_from_db()
+        self.product2.refresh_from_db()
+        self.order.refresh_from_db()
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            data['message'], enums.Errors.STOCK_AVAILABILITY_ERROR.value
+        )
+        self.assertEqual(self.product1.stock, 5)
+        self.assertEqual(self.product2.stock, 1)
+        self.assertEqual(self.order.status, Order.OrderStatus.DRAFT.value)
+
+    def test_process_updates_stock_in_single_statement(self):
+        Product.objects.filter(id=self.product2.id).update(stock=3)
+
+        url = reverse("api:order-process", args=[self.order.id])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url)
+        data = json.loads(response.content)
+
+        product_updates = [
+            query for query in queries
+            if query['sql'].startswith('UPDATE "api_product"')
+        ]
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(product_updates), 1)
+        self.assertEqual(
+            Product.objects.get(id=self.product1.id).stock, 3
+        )
+        self.assertEqual(
+            Product.objects.get(id=self.product2.id).stock, 0
+        )
+        self.assertEqual(
+            [detail['product']['stock'] for detail in data['details']],
+            [3, 0]
+        )
+
+    def test_cancel_processed_egress_restores_stock(self):
+        Product.objects.filter(id=self.product2.id).update(stock=3)
+        self.client.post(reverse("api:order-process", args=[self.order.id]))
+
+        response = self.client.post(
+            reverse("api:order-cancel", args=[self.order.id])
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            Product.objects.get(id=self.product1.id).stock, 5
+        )
+        self.assertEqual(
+            Product.objects.get(id=self.product2.id).stock, 3
+        )
+
+
+@skipUnlessDBFeature('has_select_for_update')
+@patch('api.models.Order._get_usd_exchange_rate', return_value=1)
+class StockEngineConcurrencyTests(TransactionTestCase):
+    THREADS = 12
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email="test@email.com", password="Password1"
+        )
+        self.hot_product = Product.objects.create(
+            price=100, name="Hot product", available=True, stock=5
+        )
+        self.other_product = Product.objects.create(
+            price=80, name="Other product", available=True, stock=100
+        )
+
+    def create_order(self, products):
+        order = Order.objects.create()
+        for product in products:
+            OrderDetail.objects.create(
+                order=order, product=product, quantity=1
+            )
+        return order
+
+    def run_concurrently(self, url_name, order_ids):
+        barrier = threading.Barrier(len(order_ids))
+        responses = []
+
+        def worker(order_id):
+            client = APIClient()
+            client.force_authenticate(self.user)
+            try:
+                barrier.wait()
+                responses.append(
+                    client.post(reverse(url_name, args=[order_id]))
+                )
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=worker, args=[order_id])
+            for order_id in order_ids
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return [response.status_code for response in responses]
+
+    def test_concurrent_egress_orders_do_not_oversell(self, _):
+        # Half of the orders list products in reverse order to make sure
+        # the lock ordering prevents deadlocks.
+        orders = [
+            self.create_order(
+                [self.hot_product, self.other_product] if i % 2
+                else [self.other_product, self.hot_product]
+            ) for i in range(self.THREADS)
+        ]
+
+        codes = self.run_concurrently(
+            "api:order-process", [order.id for order in orders]
+        )
+
+        self.hot_product.refresh_from_db()
+        self.other_product.refresh_from_db()
+        self.assertEqual(codes.count(status.HTTP_200_OK), 5)
+        self.assertEqual(
+            codes.count(status.HTTP_400_BAD_REQUEST), self.THREADS - 5
+        )
+        self.assertEqual(self.hot_product.stock, 0)
+        self.assertEqual(self.other_product.stock, 95)
+
+    def test_concurrent_process_of_same_order(self, _):
+        order = self.create_order([self.hot_product])
+
+        codes = self.run_concurrently(
+            "api:order-process", [order.id] * self.THREADS
+        )
+
+        self.hot_product.refresh_from_db()
+        self.assertEqual(codes.count(status.HTTP_200_OK), 1)
+        self.assertEqual(self.hot_product.stock, 4)
+
+
+class KeysetPaginationTests(AuthenticatedAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.products = self.create_products(5)
+        self.url = reverse("api:product-list")
+
+    def test_pages_follow_cursor(self):
+        response = self.client.get(self.url, {'page_size': 2})
+        first_page = json.loads(response.content)
+
+        Product.objects.create(price=10, name="New product", available=True)
+        response = self.client.get(first_page['next'])
+        second_page = json.loads(response.content)
+
+        self.assertNotIn('count', first_page)
+        self.assertEqual(
+            [product['id'] for product in first_page['results']],
+            [product.id for product in self.products[:2]]
+        )
+        self.assertEqual(
+            [product['id'] for product in second_page['results']],
+            [product.id for product in self.products[2:4]]
+        )
+        self.assertIsNotNone(second_page['previous'])
+
+    def test_count_only_when_requested(self):
+        # The ETag aggregate counts rows too, but the paginator doesn't.
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.url)
+        self.assertFalse(
+            any('"__count"' in query['sql'] for query in queries)
+        )
+
+        response = self.client.get(self.url, {'count': 'true'})
+        data = json.loads(response.content)
+        self.assertEqual(data['count'], 5)
+
+    @override_settings(API_MAX_PAGE_SIZE=3)
+    def test_page_size_is_capped(self):
+        response = self.client.get(self.url, {'page_size': 100})
+        data = json.loads(response.content)
+
+        self.assertEqual(len(data['results']), 3)
+
+    def test_ordering_by_created_at(self):
+        response = self.client.get(
+            self.url, {'ordering': '-created_at', 'page_size': 2}
+        )
+        data = json.loads(response.content)
+
+        self.assertEqual(
+            [product['id'] for product in data['results']],
+            [self.products[4].id, self.products[3].id]
+        )
+
+
+class ExportTests(AuthenticatedAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.product1 = Product.objects.create(
+            price=100, name="Product, 1", available=True, stock=5
+        )
+        self.product2 = Product.objects.create(
+            price=80, name="Product 2", available=False
+        )
+        self.order = Order.objects.create()
+        for product, quantity in [(self.product1, 2), (self.product2, 3)]:
+            OrderDetail.objects.create(
+                order=self.order, product=product, quantity=quantity
+            )
+        self.empty_order = Order.objects.create(
+            movement_type=Order.MovementStatus.INGRESS.value
+        )
+
+    def read_lines(self, response):
+        content = b''.join(response.streaming_content).decode()
+        return content.splitlines()
+
+    def test_order_export_ndjson(self):
+        # Request savepoint and release plus the single streamed query
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse("api:order-export"))
+            rows = [json.loads(line) for line in self.read_lines(response)]
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[0]['order_id'], self.order.id)
+        self.assertEqual(rows[0]['product_name'], "Product, 1")
+        self.assertEqual(rows[0]['quantity'], 2)
+        self.assertEqual(rows[1]['product_id'], self.product2.id)
+        self.assertEqual(rows[2]['order_id'], self.empty_order.id)
+        self.assertIsNone(rows[2]['product_id'])
+
+    def test_order_export_csv(self):
+        response = self.client.get(
+            reverse("api:order-export"), {'output': 'csv'}
+        )
+        rows = list(csv.reader(self.read_lines(response)))
+
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertEqual(rows[0][0], 'order_id')
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(rows[1][7], "Product, 1")
+
+    @override_settings(EXPORT_CHUNK_SIZE=1)
+    def test_product_export_filtered(self):
+        response = self.client.get(
+            reverse("api:product-export"), {'available': True}
+        )
+        rows = [json.loads(line) for line in self.read_lines(response)]
+        # Reservations of the setUp orders touched updated_at.
+        self.product1.refresh_from_db()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(rows, [{
+            'id': self.product1.id,
+            'name': "Product, 1",
+            'price': 100.0,
+            'stock': 5,
+            'available': True,
+            'created_at': self.product1.created_at.isoformat(),
+            'updated_at': self.product1.updated_at.isoformat(),
+        }])
+
+    def test_export_requires_authentication(self):
+        response = APIClient().get(reverse("api:product-export"))
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class OrderBulkCreateTests(AuthenticatedAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.url = reverse("api:order-bulk")
+        self.products = self.create_products(3)
+
+    def post(self, data):
+        return self.client.post(
+            self.url, json.dumps(data), content_type='application/json'
+        )
+
+    def test_bulk_create_orders(self):
+        items = [
+            {
+                "movement_type": Order.MovementStatus.INGRESS.value,
+                "details": [
+                    {"product": product.id, "quantity": 2}
+                    for product in self.products
+                ]
+            } for _ in range(20)
+        ]
+
+        # Savepoint, product lookup, orders and details inserts, release
+        with self.assertNumQueries(5):
+            response = self.post(items)
+        data = json.loads(response.content)
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(data), 20)
+        self.assertTrue(all(result['ok'] for result in data))
+        order = Order.objects.get(id=data[0]['id'])
+        self.assertEqual(
+            order.movement_type, Order.MovementStatus.INGRESS.value
+        )
+        self.assertEqual(order.orderdetail_set.count(), 3)
+        self.assertEqual(OrderDetail.objects.count(), 60)
+
+    def test_bulk_create_egress_orders(self):
+        Product.objects.update(stock=45)
+        items = [
+            {
+                "movement_type": Order.MovementStatus.EGRESS.value,
+                "details": [
+                    {"product": product.id, "quantity": 2}
+                    for product in self.products
+                ]
+            } for _ in range(25)
+        ]
+
+        # Plus a savepoint to lock, update and reserve every product at once.
+        with self.assertNumQueries(10):
+            response = self.post(items)
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        # The last 3 orders found no stock left to reserve.
+        self.assertEqual(StockReservation.objects.count(), 66)
+        self.assertEqual(
+            [product.reserved for product in Product.objects.order_by('id')],
+            [44, 44, 44]
+        )
+
+    def test_bulk_create_reports_item_errors(self):
+        response = self.post([
+            {"details": [{"product": self.products[0].id, "quantity": 1}]},
+            {"details": [{"product": 9999, "quantity": 1}]},
+            {"details": [{"product": self.products[0].id, "quantity": 0}]},
+            {"details": [
+                {"product": self.products[1].id, "quantity": 1},
+                {"product": self.products[1].id, "quantity": 2},
+            ]},
+        ])
+        data = json.loads(response.content)
+
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual(
+            [result['ok'] for result in data], [True, False, False, False]
+        )
+        self.assertIn('details', data[1]['errors'])
+        self.assertEqual(
+            data[2]['errors']['details'][0]['quantity'],
+            [enums.Errors.GREATER_ZERO_ERROR.value]
+        )
+        self.assertEqual(
+            data[3]['errors']['details'],
+            [enums.Errors.DUPLICATED_PRODUCT_ERROR.value]
+        )
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_bulk_create_all_invalid(self):
+        response = self.post([{"details": [{"product": 9999, "quantity": 1}]}])
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Order.objects.count(), 0)
+
+    @override_settings(BULK_ORDER_MAX_ITEMS=1)
+    def test_bulk_create_validates_payload(self):
+        response = self.post({"details": []})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.post([{"details": []}, {"details": []}])
+        data = json.loads(response.content)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            data['message'],
+            enums.Errors.BULK_ORDER_SIZE_ERROR.value.format(1)
+        )
+
+
+class ProductRelatedFieldTests(AuthenticatedAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.products = self.create_products(20)
+
+    def post_order(self, details):
+        return self.client.post(
+            reverse("api:order-list"),
+            json.dumps({"details": details}),
+            content_type='application/json'
+        )
+
+    def count_product_lookups(self, details):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post_order(details)
+        lookups = [
+            query for query in queries
+            if query['sql'].startswith('SELECT') and
+            'FROM "api_product"' in query['sql']
+        ]
+        return response, len(lookups)
+
+    def test_products_resolved_in_single_query(self):
+        response, lookups = self.count_product_lookups([
+            {"product": product.id, "quantity": 1}
+            for product in self.products
+        ])
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        # One lookup, plus the lock taken to reserve every line at once.
+        self.assertEqual(lookups, 2)
+
+    def test_missing_product_is_validation_error(self):
+        response = self.post_order([
+            {"product": self.products[0].id, "quantity": 1},
+            {"product": 9999, "quantity": 1},
+        ])
+        data = json.loads(response.content)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(data['details'][0], {})
+        self.assertEqual(
+            data['details'][1]['product'],
+            [enums.Errors.MISSING_PRODUCT_ERROR.value.format(pk_value=9999)]
+        )
+        self.assertEqual(Order.objects.count(), 0)
+
+    def test_invalid_product_type_is_validation_error(self):
+        response = self.post_order([{"product": "abc", "quantity": 1}])
+        data = json.loads(response.content)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            data['details'][0]['product'],
+            [enums.Errors.PRODUCT_PK_TYPE_ERROR.value.format(data_type='str')]
+        )
+
+    def test_missing_product_on_order_detail_create(self):
+        order = Order.objects.create()
+        response = self.client.post(
+            reverse("api:order-detail-list", args=[order.id]),
+            {"product": 9999, "quantity": 1}
+        )
+        data = json.loads(response.content)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('product', data)
+
+
+class OrderAggregatesTests(AuthenticatedAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.product1 = Product.objects.create(
+            price=100, name="Product 1", available=True
+        )
+        self.product2 = Product.objects.create(
+            price=10, name="Product 2", available=True
+        )
+        self.order = Order.objects.create()
+        self.detail = OrderDetail.objects.create(
+            order=self.order, product=self.product1, quantity=2
+        )
+
+    def assertAggregates(self, line_count, total_units, total_amount):
+        order = Order.objects.get(id=self.order.id)
+        self.assertEqual(order.line_count, line_count)
+        self.assertEqual(order.total_units, total_units)
+        self.assertEqual(order.total_amount, total_amount)
+
+    def test_aggregates_follow_detail_changes(self):
+        url = reverse("api:order-detail-list", args=[self.order.id])
+        response = self.client.post(
+            url, {"product": self.product2.id, "quantity": 3}
+        )
+        detail_id = json.loads(response.content)['id']
+        self.assertAggregates(2, 5, 230)
+
+        url = reverse(
+            "api:order-detail-detail", args=[self.order.id, detail_id]
+        )
+        self.client.patch(url, {"quantity": 1})
+        self.assertAggregates(2, 3, 210)
+
+        url = reverse(
+            "api:order-detail-detail", args=[self.order.id, self.detail.id]
+        )
+        self.client.put(url, {"product": self.product1.id, "quantity": 4})
+        self.assertAggregates(2, 5, 410)
+
+        self.client.delete(url)
+        self.assertAggregates(1, 1, 10)
+
+        url = reverse(
+            "api:order-detail-detail", args=[self.order.id, detail_id]
+        )
+        self.client.put(url, {"product": self.product1.id, "quantity": 1})
+        self.assertAggregates(1, 1, 100)
+
+    def test_order_create_sets_aggregates(self):
+        response = self.client.post(
+            reverse("api:order-list"),
+            json.dumps({"details": [
+                {"product": self.product1.id, "quantity": 1},
+                {"product": self.product2.id, "quantity": 5},
+            ]}),
+            content_type='application/json'
+        )
+        data = json.loads(response.content)
+
+        self.assertEqual(data['line_count'], 2)
+        self.assertEqual(data['total_units'], 6)
+        self.assertEqual(data['total_amount'], 150)
+        self.assertEqual(data['total'], 150)
+
+    def test_stale_order_save_keeps_aggregates(self):
+        stale_order = Order.objects.get(id=self.order.id)
+        OrderDetail.objects.create(
+            order=self.order, product=self.product2, quantity=1
+        )
+
+        stale_order.movement_type = Order.MovementStatus.INGRESS.value
+        stale_order.save()
+
+        self.assertAggregates(2, 3, 210)
+
+    def test_price_change_refreshes_unstamped_orders(self):
+        stamped = Order.objects.create()
+        OrderDetail.objects.create(
+            order=stamped, product=self.product1, quantity=1
+        )
+        stamped.stamp_totals(rate=1)
+        stamped.save()
+
+        self.product1.price = 50
+        self.product1.save()
+
+        stamped.refresh_from_db()
+        self.assertAggregates(1, 2, 100)
+        self.assertEqual(stamped.total_amount, 100)
+        self.assertEqual(stamped.total, 100)
+
+    def test_filter_orders_by_total(self):
+        other = Order.objects.create()
+        OrderDetail.objects.create(
+            order=other, product=self.product2, quantity=1
+        )
+
+        response = self.client.get(
+            reverse("api:order-list"), {'min_total': 50}
+        )
+        data = json.loads(response.content)
+        self.assertEqual(
+            [order['id'] for order in data['results']], [self.order.id]
+        )
+
+        response = self.client.get(
+            reverse("api:order-list"), {'max_total': 50}
+        )
+        data = json.loads(response.content)
+        self.assertEqual(
+            [order['id'] for order in data['results']], [other.id]
+        )
+
+        for value in ['abc', 'nan']:
+            response = self.client.get(
+                reverse("api:order-list"), {'max_total': value}
+            )
+            self.assertEqual(
+                response.status_code, status.HTTP_400_BAD_REQUEST
+            )
+            self.assertEqual(
+                json.loads(response.content)['message'],
+                enums.Errors.INVALID_NUMBER_ERROR.value.format('max_total')
+            )
+
+    def test_sync_order_totals(self):
+        Order.objects.filter(id=self.order.id).update(
+            line_count=0, total_amount=1
+        )
+        output = StringIO()
+
+        call_command('sync_order_totals', stdout=output)
+        self.assertIn("found 1 mismatched", output.getvalue())
+        self.assertAggregates(0, 2, 1)
+
+        call_command('sync_order_totals', repair=True, stdout=output)
+        self.assertAggregates(1, 2, 200)
+
+
+class StockLedgerTests(AuthenticatedAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.product1 = Product.objects.create(
+            price=100, name="Product 1", available=True, stock=5
+        )
+        self.product2 = Product.objects.create(
+            price=80, name="Product 2", available=True
+        )
+        self.order = Order.objects.create(
+            movement_type=Order.MovementStatus.INGRESS.value
+        )
+        OrderDetail.objects.create(
+            order=self.order, product=self.product1, quantity=2
+        )
+        OrderDetail.objects.create(
+            order=self.order, product=self.product2, quantity=3
+        )
+
+    def ledger_stock(self, product):
+        return Product.objects.with_ledger_stock().get(
+            id=product.id
+        ).ledger_stock
+
+    def test_process_and_cancel_record_movements(self):
+        self.client.post(reverse("api:order-process", args=[self.order.id]))
+        self.client.post(reverse("api:order-cancel", args=[self.order.id]))
+
+        movements = StockMovement.objects.filter(
+            order=self.order
+        ).order_by('id')
+        self.assertEqual(
+            [(movement.product_id, movement.quantity) for movement in movements],
+            [
+                (self.product1.id, 2), (self.product2.id, 3),
+                (self.product1.id, -2), (self.product2.id, -3),
+            ]
+        )
+        self.assertEqual(self.ledger_stock(self.product1), 5)
+        self.assertEqual(self.ledger_stock(self.product2), 0)
+
+    def test_ledger_stock_after_snapshot(self):
+        self.client.post(reverse("api:order-process", args=[self.order.id]))
+        call_command('snapshot_stock', stdout=StringIO())
+
+        self.product1.substract_stock_quantity(4)
+
+        snapshot = StockSnapshot.objects.get(product=self.product1)
+        self.assertEqual(snapshot.stock, 7)
+        self.assertEqual(self.ledger_stock(self.product1), 3)
+        self.assertEqual(self.ledger_stock(self.product2), 3)
+        self.assertEqual(Product.objects.get(id=self.product1.id).stock, 3)
+
+        output = StringIO()
+        call_command('snapshot_stock', stdout=output)
+        self.assertIn("Stored 1 stock snapshots", output.getvalue())
+
+    def test_reconcile_stock(self):
+        self.client.post(reverse("api:order-process", args=[self.order.id]))
+        Product.objects.filter(id=self.product2.id).update(stock=10)
+        output = StringIO()
+
+        call_command('reconcile_stock', batch_size=1, stdout=output)
+
+        self.assertIn(
+            f"Product {self.product2.id}: stock 10, ledger 3.",
+            output.getvalue()
+        )
+        self.assertIn(
+            "Checked 2 products, found 1 mismatched.", output.getvalue()
+        )
+
+    def test_stale_save_keeps_stock(self):
+        stale = Product.objects.get(id=self.product1.id)
+        self.client.post(reverse("api:order-process", args=[self.order.id]))
+
+        stale.name = "Renamed"
+        stale.save()
+
+        self.assertEqual(Product.objects.get(id=self.product1.id).stock, 7)
+        self.assertEqual(self.ledger_stock(self.product1), 7)
+
+    def test_stock_set_on_instance_is_recorded(self):
+        product = Product.objects.get(id=self.product1.id)
+        product.stock = 9
+        product.save()
+
+        self.assertEqual(Product.objects.get(id=self.product1.id).stock, 9)
+        self.assertEqual(self.ledger_stock(self.product1), 9)
+
+
+class StockReservationTests(AuthenticatedAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.product1 = Product.objects.create(
+            price=100, name="Product 1", available=True, stock=5
+        )
+        self.product2 = Product.objects.create(
+            price=80, name="Product 2", available=True, stock=1
+        )
+
+    def create_order(self, details):
+        response = self.client.post(
+            reverse("api:order-list"),
+            json.dumps({"details": [
+                {"product": product.id, "quantity": quantity}
+                for product, quantity in details
+            ]}),
+            content_type='application/json'
+        )
+        return Order.objects.get(id=json.loads(response.content)['id'])
+
+    def assertReserved(self, product, stock, reserved):
+        product.refresh_from_db()
+        self.assertEqual(product.stock, stock)
+        self.assertEqual(product.reserved, reserved)
+
+    def test_draft_egress_order_reserves_stock(self):
+        order = self.create_order([(self.product1, 4), (self.product2, 3)])
+
+        self.assertReserved(self.product1, 5, 4)
+        self.assertReserved(self.product2, 1, 0)
+        self.assertEqual(
+            list(StockReservation.objects.values_list('order', 'product')),
+            [(order.id, self.product1.id)]
+        )
+
+        # Only one unit of product1 is left for other orders.
+        response = self.client.post(
+            reverse("api:order-process", args=[
+                self.create_order([(self.product1, 2)]).id
+            ])
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_ingress_order_does_not_reserve(self):
+        response = self.client.post(
+            reverse("api:order-list"),
+            json.dumps({
+                "movement_type": Order.MovementStatus.INGRESS.value,
+                "details": [{"product": self.product1.id, "quantity": 2}]
+            }),
+            content_type='application/json'
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertReserved(self.product1, 5, 0)
+
+    def test_process_converts_reservations(self):
+        order = self.create_order([(self.product1, 4)])
+
+        url = reverse("api:order-process", args=[order.id])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url)
+
+        product_updates = [
+            query for query in queries
+            if query['sql'].startswith('UPDATE "api_product"')
+        ]
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(product_updates), 1)
+        self.assertReserved(self.product1, 1, 0)
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_detail_changes_follow_reservation(self):
+        order = self.create_order([(self.product1, 2)])
+        detail = order.orderdetail_set.get()
+        url = reverse("api:order-detail-detail", args=[order.id, detail.id])
+
+        self.client.patch(url, {"quantity": 3})
+        self.assertReserved(self.product1, 5, 3)
+
+        self.client.delete(url)
+        self.assertReserved(self.product1, 5, 0)
+
+    def test_cancel_draft_releases_reservations(self):
+        order = self.create_order([(self.product1, 2)])
+
+        self.client.post(reverse("api:order-cancel", args=[order.id]))
+
+        self.assertReserved(self.product1, 5, 0)
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_delete_releases_reservations(self):
+        order = self.create_order([(self.product1, 2)])
+        other = self.create_order([(self.product1, 1)])
+
+        order.delete()
+        self.assertReserved(self.product1, 5, 1)
+
+        Order.objects.filter(id=other.id).delete()
+        self.assertReserved(self.product1, 5, 0)
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_expire_reservations(self):
+        expired = self.create_order([(self.product1, 2)])
+        self.create_order([(self.product1, 1)])
+        StockReservation.objects.filter(order=expired).update(
+            expires_at=timezone.now() - timedelta(seconds=1)
+        )
+        output = StringIO()
+
+        call_command('expire_reservations', batch_size=1, stdout=output)
+
+        self.assertIn("Released 1 expired reservations", output.getvalue())
+        self.assertReserved(self.product1, 5, 1)
+
+        # The expired order can still be processed if stock allows it.
+        response = self.client.post(
+            reverse("api:order-process", args=[expired.id])
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertReserved(self.product1, 3, 1)
+
+
+class ProductCacheTests(AuthenticatedAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.staff_user = get_user_model().objects.create_superuser(
+            email="admin@email.com", password="Password1"
+        )
+        self.product = Product.objects.create(
+            price=100, name="Product 1", available=True, stock=5
+        )
+        self.list_url = reverse("api:product-list")
+        self.detail_url = reverse("api:product-detail", args=[self.product.id])
+
+    def get_product_queries(self, url, params=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        lookups = [
+            query for query in queries if 'FROM "api_product"' in query['sql']
+        ]
+        return json.loads(response.content), len(lookups)
+
+    def test_list_and_retrieve_are_cached(self):
+        # ETag lookup and the page, hits only look the ETag up
+        _, lookups = self.get_product_queries(self.list_url)
+        self.assertEqual(lookups, 2)
+        _, lookups = self.get_product_queries(self.list_url)
+        self.assertEqual(lookups, 1)
+        _, lookups = self.get_product_queries(
+            self.list_url, {'available': False}
+        )
+        self.assertEqual(lookups, 2)
+
+        # ETag lookup and the product itself
+        _, lookups = self.get_product_queries(self.detail_url)
+        self.assertEqual(lookups, 2)
+        data, lookups = self.get_product_queries(self.detail_url)
+        self.assertEqual(lookups, 1)
+        self.assertEqual(data['name'], "Product 1")
+
+    def test_cache_is_keyed_by_rows(self):
+        self.get_product_queries(self.list_url)
+        self.get_product_queries(self.detail_url)
+
+        # Changed by another process, nothing was invalidated here.
+        Product.objects.filter(id=self.product.id).update(
+            name="Renamed", updated_at=timezone.now()
+        )
+        data, _ = self.get_product_queries(self.detail_url)
+        self.assertEqual(data['name'], "Renamed")
+        data, _ = self.get_product_queries(self.list_url)
+        self.assertEqual(data['results'][0]['name'], "Renamed")
+
+    def test_retrieve_cache_is_per_query_string(self):
+        self.get_product_queries(self.detail_url)
+
+        response = self.client.get(self.detail_url, {'available': False})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        self.get_product_queries(self.detail_url, {'a': 1, 'b': 2})
+        _, lookups = self.get_product_queries(
+            self.detail_url + '?b=2&a=1'
+        )
+        self.assertEqual(lookups, 1)
+
+    def test_save_invalidates_cache(self):
+        self.get_product_queries(self.list_url)
+        self.get_product_queries(self.detail_url)
+
+        self.product.name = "Renamed"
+        self.product.save()
+
+        data, _ = self.get_product_queries(self.detail_url)
+        self.assertEqual(data['name'], "Renamed")
+        data, _ = self.get_product_queries(self.list_url)
+        self.assertEqual(data['results'][0]['name'], "Renamed")
+
+        self.product.delete()
+        response = self.client.get(self.detail_url)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_stock_changes_invalidate_cache(self):
+        self.get_product_queries(self.detail_url)
+        order = Order.objects.create()
+        OrderDetail.objects.create(
+            order=order, product=self.product, quantity=2
+        )
+
+        data, _ = self.get_product_queries(self.detail_url)
+        self.assertEqual(data['reserved'], 2)
+
+        self.client.post(reverse("api:order-process", args=[order.id]))
+        data, _ = self.get_product_queries(self.detail_url)
+        self.assertEqual(data['stock'], 3)
+        self.assertEqual(data['reserved'], 0)
+
+    def test_cache_stats(self):
+        self.client.get(self.list_url)
+        self.client.get(self.list_url)
+
+        response = self.client.get(reverse("api:product-cache-stats"))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        self.client.force_authenticate(self.staff_user)
+        response = self.client.get(reverse("api:product-cache-stats"))
+        self.assertEqual(
+            json.loads(response.content),
+            {'hits': 1, 'misses': 1, 'hit_ratio': 0.5}
+        )
+
+
+class ConditionalRequestTests(AuthenticatedAPITestCase):
+    superuser = True
+
+    def setUp(self):
+        super().setUp()
+        self.product = Product.objects.create(
+            price=100, name="Product 1", available=True
+        )
+        self.order = Order.objects.create()
+        self.detail = OrderDetail.objects.create(
+            order=self.order, product=self.product, quantity=2
+        )
+
+    def assertNotModified(self, url, etag):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+        self.assertFalse(
+            any('"api_orderdetail"."quantity"' in query['sql']
+                for query in queries)
+        )
+
+    def test_conditional_get(self):
+        urls = [
+            reverse("api:product-list"),
+            reverse("api:product-detail", args=[self.product.id]),
+            reverse("api:order-list"),
+            reverse("api:order-detail", args=[self.order.id]),
+            reverse(
+                "api:order-detail-detail", args=[self.order.id, self.detail.id]
+            ),
+        ]
+        for url in urls:
+            response = self.client.get(url)
+            etag = response['ETag']
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotModified(url, etag)
+
+    def test_changes_update_etag(self):
+        url = reverse("api:order-detail", args=[self.order.id])
+        etag = self.client.get(url)['ETag']
+
+        self.product.price = 50
+        self.product.save()
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+        url = reverse("api:product-list")
+        etag = self.client.get(url)['ETag']
+        Product.objects.create(price=10, name="Product 2", available=True)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_order_list_etag(self):
+        url = reverse("api:order-list")
+        etag = self.client.get(url)['ETag']
+
+        self.assertNotModified(url, etag)
+
+        self.client.post(
+            reverse("api:order-bulk"),
+            json.dumps([{"details": [
+                {"product": self.product.id, "quantity": 1}
+            ]}]),
+            content_type='application/json'
+        )
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        etag = response['ETag']
+        self.detail.quantity = 5
+        self.detail.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_order_list_etag_offline(self):
+        self.get_rate.side_effect = requests.ConnectionError
+        url = reverse("api:order-list")
+
+        # No order follows the live rate.
+        self.order.delete()
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('ETag', response)
+        self.get_rate.assert_not_called()
+
+        # Rendering without usd_total doesn't need it.
+        Order.objects.create()
+        response = self.client.get(url, {'fields': 'id,status'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('ETag', response)
+        self.get_rate.assert_not_called()
+
+    def test_if_match_on_product_update(self):
+        url = reverse("api:product-detail", args=[self.product.id])
+        etag = self.client.get(url)['ETag']
+
+        response = self.client.patch(
+            url, {"name": "Renamed"}, HTTP_IF_MATCH=etag
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(self.client.get(url)['ETag'], response['ETag'])
+
+        response = self.client.patch(
+            url, {"name": "Lost update"}, HTTP_IF_MATCH=etag
+        )
+        data = json.loads(response.content)
+        self.assertEqual(
+            response.status_code, status.HTTP_412_PRECONDITION_FAILED
+        )
+        self.assertEqual(
+            data['message'], enums.Errors.PRECONDITION_FAILED_ERROR.value
+        )
+        self.assertEqual(Product.objects.get(id=self.product.id).name, "Renamed")
+
+    def test_if_match_on_order_detail_update(self):
+        url = reverse(
+            "api:order-detail-detail", args=[self.order.id, self.detail.id]
+        )
+        etag = self.client.get(url)['ETag']
+
+        response = self.client.put(
+            url, {"product": self.product.id, "quantity": 3},
+            HTTP_IF_MATCH=etag
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        response = self.client.patch(
+            url, {"quantity": 4}, HTTP_IF_MATCH=etag
+        )
+        self.assertEqual(
+            response.status_code, status.HTTP_412_PRECONDITION_FAILED
+        )
+        self.assertEqual(OrderDetail.objects.get(id=self.detail.id).quantity, 3)
+
+
+class ProductSearchTests(AuthenticatedAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.drill = Product.objects.create(
+            price=120, name="Steel Drill Pro", available=True, stock=3
+        )
+        self.wrench = Product.objects.create(
+            price=15, name="Wrench mini", available=True
+        )
+        self.pump = Product.objects.create(
+            price=300, name="Water pump", available=False, stock=1
+        )
+
+    def get_ids(self, params):
+        response = self.client.get(reverse("api:product-list"), params)
+        return [product['id'] for product in json.loads(response.content)[
+            'results'
+        ]]
+
+    def test_search_by_word_prefix(self):
+        self.assertEqual(self.get_ids({'search': 'dri'}), [self.drill.id])
+        self.assertEqual(
+            self.get_ids({'search': 'pro STEEL'}), [self.drill.id]
+        )
+        self.assertEqual(self.get_ids({'search': 'steel mini'}), [])
+        self.assertEqual(self.get_ids({'search': 'w'}), [
+            self.wrench.id, self.pump.id
+        ])
+
+    def test_price_and_stock_filters(self):
+        self.assertEqual(
+            self.get_ids({'min_price': 100, 'max_price': 200}),
+            [self.drill.id]
+        )
+        self.assertEqual(
+            self.get_ids({'in_stock': 'true'}), [self.drill.id, self.pump.id]
+        )
+        self.assertEqual(
+            self.get_ids({'in_stock': 'true', 'available': True}),
+            [self.drill.id]
+        )
+
+    def test_in_stock_is_a_boolean(self):
+        self.assertEqual(
+            self.get_ids({'in_stock': 'yes'}), [self.drill.id, self.pump.id]
+        )
+        self.assertEqual(len(self.get_ids({'in_stock': 'no'})), 3)
+
+        response = self.client.get(
+            reverse("api:product-list"), {'in_stock': 'maybe'}
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            json.loads(response.content)['message'],
+            enums.Errors.INVALID_BOOLEAN_ERROR.value.format('in_stock')
+        )
+
+    def test_invalid_price_filter(self):
+        response = self.client.get(
+            reverse("api:product-list"), {'min_price': 'abc'}
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            json.loads(response.content)['message'],
+            enums.Errors.INVALID_NUMBER_ERROR.value.format('min_price')
+        )
+
+    def test_inverted_index(self):
+        index = search.InvertedIndex([
+            (1, "Steel Drill Pro"), (2, "Wrench mini"), (3, "Drill bits"),
+        ])
+
+        self.assertEqual(index.search("dr"), {1, 3})
+        self.assertEqual(index.search("drill b"), {3})
+        self.assertEqual(index.search("saw"), set())
+        self.assertEqual(index.search("!!"), set())
+
+    def test_inverted_index_follows_names(self):
+        index = search.get_inverted_index(Product)
+
+        self.drill.add_stock_quantity(2)
+        OrderDetail.objects.create(
+            order=Order.objects.create(), product=self.drill, quantity=1
+        )
+        self.assertEqual(Product.objects.get(id=self.drill.id).reserved, 1)
+        self.assertIs(search.get_inverted_index(Product), index)
+
+        self.drill.name = "Steel Saw"
+        self.drill.save()
+        index = search.get_inverted_index(Product)
+        self.assertEqual(index.search("saw"), {self.drill.id})
+
+        Product.objects.bulk_create([Product(name="Saw blade")])
+        self.assertEqual(
+            len(search.get_inverted_index(Product).search("saw")), 2
+        )
+
+        self.wrench.delete()
+        self.assertEqual(
+            search.get_inverted_index(Product).search("wrench"), set()
+        )
+
+    @override_settings(PRODUCT_SEARCH_MAX_IDS=1)
+    def test_search_with_many_matches(self):
+        self.assertEqual(self.get_ids({'search': 'w'}), [
+            self.wrench.id, self.pump.id
+        ])
+        self.assertEqual(self.get_ids({'search': 'mini wr'}), [
+            self.wrench.id
+        ])
+
+
+class AccessPathTests(AuthenticatedAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.draft = Order.objects.create()
+        self.cancelled = Order.objects.create(
+            status=Order.OrderStatus.CANCELLED.value
+        )
+
+    def test_filter_orders_by_status(self):
+        response = self.client.get(
+            reverse("api:order-list"),
+            {'status': Order.OrderStatus.CANCELLED.value}
+        )
+        data = json.loads(response.content)
+
+        self.assertEqual(
+            [order['id'] for order in data['results']], [self.cancelled.id]
+        )
+
+    def test_explain_querysets(self):
+        output = StringIO()
+
+        call_command('explain_querysets', stdout=output)
+
+        self.assertIn("== available products", output.getvalue())
+        self.assertIn("== order details", output.getvalue())
+        self.assertIn("querysets with sequential scans", output.getvalue())
+
+
+class OrderJobTests(AuthenticatedAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.product = Product.objects.create(
+            price=100, name="Product 1", available=True, stock=5
+        )
+
+    def create_order(self, quantity):
+        order = Order.objects.create()
+        OrderDetail.objects.create(
+            order=order, product=self.product, quantity=quantity
+        )
+        return order
+
+    def enqueue(self, order):
+        return self.client.post(
+            reverse("api:order-process", args=[order.id]) + '?async=true'
+        )
+
+    def test_process_enqueues_job(self):
+        order = self.create_order(2)
+
+        response = self.enqueue(order)
+        data = json.loads(response.content)
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(data['status'], OrderJob.JobStatus.PENDING.value)
+        self.assertEqual(response['Location'], data['url'])
+        self.assertEqual(Product.objects.get(id=self.product.id).stock, 5)
+        self.assertEqual(
+            Order.objects.get(id=order.id).status,
+            Order.OrderStatus.DRAFT.value
+        )
+
+        # Enqueuing again returns the same pending job.
+        response = self.enqueue(order)
+        self.assertEqual(json.loads(response.content)['id'], data['id'])
+
+    def test_worker_processes_jobs(self):
+        order = self.create_order(2)
+        oversold = self.create_order(4)
+        job_url = json.loads(self.enqueue(order).content)['url']
+        self.enqueue(oversold)
+        output = StringIO()
+
+        call_command('process_order_jobs', batch_size=1, stdout=output)
+
+        self.assertIn("Done, 2 jobs run.", output.getvalue())
+        self.assertEqual(Product.objects.get(id=self.product.id).stock, 3)
+        self.assertEqual(
+            Order.objects.get(id=order.id).status,
+            Order.OrderStatus.PROCESSED.value
+        )
+        self.assertEqual(
+            Order.objects.get(id=oversold.id).status,
+            Order.OrderStatus.DRAFT.value
+        )
+
+        data = json.loads(self.client.get(job_url).content)
+        self.assertEqual(data['status'], OrderJob.JobStatus.DONE.value)
+        job = OrderJob.objects.get(order=oversold)
+        self.assertEqual(job.status, OrderJob.JobStatus.FAILED.value)
+        self.assertEqual(
+            job.error, enums.Errors.STOCK_AVAILABILITY_ERROR.value
+        )
+
+    def test_jobs_are_claimed_one_at_a_time(self):
+        for _ in range(3):
+            self.enqueue(self.create_order(1))
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(processing.run_pending_jobs(2), 2)
+
+        # Every job is claimed in its own transaction.
+        claims = [
+            query for query in queries
+            if query['sql'].startswith('SELECT') and
+            'FROM "api_orderjob"' in query['sql']
+        ]
+        self.assertEqual(len(claims), 2)
+        self.assertEqual(
+            OrderJob.objects.filter(
+                status=OrderJob.JobStatus.PENDING.value
+            ).count(), 1
+        )
+
+    def test_not_editable_order_is_not_enqueued(self):
+        order = Order.objects.create(status=Order.OrderStatus.CANCELLED.value)
+
+        response = self.enqueue(order)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(OrderJob.objects.exists())
+
+
+class IdempotencyKeyTests(AuthenticatedAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.product = Product.objects.create(
+            price=100, name="Product 1", available=True, stock=5
+        )
+
+    def create_order(self, key, quantity=1):
+        return self.client.post(
+            reverse("api:order-list"),
+            json.dumps({"details": [
+                {"product": self.product.id, "quantity": quantity}
+            ]}),
+            content_type='application/json', HTTP_IDEMPOTENCY_KEY=key
+        )
+
+    def test_create_is_replayed(self):
+        first = self.create_order("create-1")
+        second = self.create_order("create-1")
+
+        self.assertEqual(second.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(
+            json.loads(first.content), json.loads(second.content)
+        )
+        self.assertEqual(Order.objects.count(), 1)
+
+        self.create_order("create-2")
+        self.assertEqual(Order.objects.count(), 2)
+
+    def test_key_reused_with_other_payload(self):
+        self.create_order("create-1")
+        response = self.create_order("create-1", quantity=2)
+        data = json.loads(response.content)
+
+        self.assertEqual(
+            response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY
+        )
+        self.assertEqual(
+            data['message'], enums.Errors.IDEMPOTENCY_KEY_REUSED_ERROR.value
+        )
+
+    def test_process_and_cancel_run_once(self):
+        order_id = json.loads(self.create_order("create-1").content)['id']
+        process_url = reverse("api:order-process", args=[order_id])
+        cancel_url = reverse("api:order-cancel", args=[order_id])
+
+        for _ in range(2):
+            response = self.client.post(
+                process_url, HTTP_IDEMPOTENCY_KEY="process-1"
+            )
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Product.objects.get(id=self.product.id).stock, 4)
+
+        for _ in range(2):
+            response = self.client.post(
+                cancel_url, HTTP_IDEMPOTENCY_KEY="cancel-1"
+            )
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Product.objects.get(id=self.product.id).stock, 5)
+        self.assertEqual(
+            StockMovement.objects.filter(order=order_id).count(), 2
+        )
+
+    def test_failed_request_is_not_stored(self):
+        order_id = json.loads(
+            self.create_order("create-1", quantity=10).content
+        )['id']
+        url = reverse("api:order-process", args=[order_id])
+
+        response = self.client.post(url, HTTP_IDEMPOTENCY_KEY="process-1")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        Product.objects.filter(id=self.product.id).update(stock=10)
+        response = self.client.post(url, HTTP_IDEMPOTENCY_KEY="process-1")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_clear_idempotency_keys(self):
+        self.create_order("create-1")
+        self.create_order("create-2")
+        IdempotencyKey.objects.filter(
+            id=IdempotencyKey.objects.first().id
+        ).update(expires_at=timezone.now() - timedelta(seconds=1))
+        output = StringIO()
+
+        call_command('clear_idempotency_keys', stdout=output)
+
+        self.assertIn("Deleted 1 expired", output.getvalue())
+        self.assertEqual(IdempotencyKey.objects.count(), 1)
+
+
+class MetricsTests(AuthenticatedAPITestCase):
+    def setUp(self):
+        super().setUp()
+        metrics.registry.clear()
+        Product.objects.create(price=100, name="Product 1", available=True)
+
+    def test_server_timing_header(self):
+        response = self.client.get(reverse("api:product-list"))
+
+        timing = response['Server-Timing']
+        self.assertIn('total;dur=', timing)
+        self.assertIn('serializer;dur=', timing)
+        self.assertRegex(timing, r'db;dur=[\d.]+;desc="\d+ queries"')
+
+    def test_metrics_endpoint(self):
+        self.client.get(reverse("api:product-list"))
+        self.client.get(reverse("api:product-list"))
+
+        response = APIClient().get(reverse("metrics"))
+        content = response.content.decode()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('# TYPE http_request_duration_seconds histogram', content)
+        self.assertIn(
+            'http_request_duration_seconds_count{method="GET",'
+            'route="api:product-list"} 2',
+            content
+        )
+        self.assertIn(
+            'db_queries_per_request_bucket{method="GET",'
+            'route="api:product-list",le="+Inf"} 2',
+            content
+        )
+
+    @override_settings(METRICS_ALLOWED_IPS=[], METRICS_TOKEN='secret')
+    def test_metrics_endpoint_access(self):
+        url = reverse("metrics")
+        self.assertEqual(
+            APIClient().get(url).status_code, status.HTTP_403_FORBIDDEN
+        )
+        response = APIClient().get(url, HTTP_AUTHORIZATION='Bearer wrong')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        response = APIClient().get(url, HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        with override_settings(METRICS_TOKEN=''):
+            response = APIClient().get(url, HTTP_AUTHORIZATION='Bearer ')
+            self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_outbound_http_time(self):
+        with patch('requests.adapters.HTTPAdapter.send') as send:
+            send.side_effect = lambda *args, **kwargs: time.sleep(0.01)
+            timings = metrics.RequestTimings()
+            token = metrics._timings.set(timings)
+            try:
+                TimedHTTPAdapter().send(None)
+            finally:
+                metrics._timings.reset(token)
+
+        self.assertGreaterEqual(timings.durations['http'], 0.01)
+
+
+class OrderBenchmarkTests(TestCase):
+    def benchmark(self, **options):
+        call_command(
+            'benchmark_orders', products=10, orders=5, lines=2, repeat=2,
+            batch_size=2, stdout=StringIO(), **options
+        )
+
+    def test_benchmark_report(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'baseline.json')
+            self.benchmark(output=path)
+            with open(path) as report_file:
+                report = json.load(report_file)
+
+        self.assertEqual(report['settings']['orders'], 5)
+        self.assertEqual(set(report['results']), {
+            'product list', 'product list uncached', 'order list',
+            'order retrieve', 'order create', 'order bulk create',
+            'detail add', 'order process', 'order cancel'
+        })
+        self.assertGreater(report['results']['order process']['queries'], 0)
+        # Seeded rows are rolled back.
+        self.assertFalse(Product.objects.exists())
+        self.assertFalse(Order.objects.exists())
+
+    def test_benchmark_baseline_regression(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'baseline.json')
+            self.benchmark(output=path)
+            with open(path) as report_file:
+                report = json.load(report_file)
+            report['results']['order retrieve']['queries'] = 0
+            with open(path, 'w') as report_file:
+                json.dump(report, report_file)
+
+            with self.assertRaisesMessage(CommandError, 'order retrieve'):
+                self.benchmark(baseline=path, tolerance=1000)
+
+
+class SeedDataTests(TestCase):
+    def seed(self, **options):
+        call_command('seed_data', stdout=StringIO(), **{
+            'users': 3, 'products': 20, 'orders': 30, 'min_lines': 1,
+            'max_lines': 4, 'chunk_size': 7, **options
+        })
+
+    def test_seed_data(self):
+        self.seed()
+
+        self.assertEqual(get_user_model().objects.count(), 3)
+        self.assertEqual(Product.objects.count(), 20)
+        self.assertEqual(Order.objects.count(), 30)
+        self.assertEqual(
+            OrderDetail.objects.count(),
+            sum(Order.objects.values_list('line_count', flat=True))
+        )
+        for order in Order.objects.filter(
+            status=Order.OrderStatus.PROCESSED
+        ):
+            self.assertEqual(order.processed_total, order.total_amount)
+        # Stock always agrees with the ledger and never goes negative.
+        for product in Product.objects.with_ledger_stock():
+            self.assertEqual(product.stock, product.ledger_stock)
+            self.assertGreaterEqual(product.stock, 0)
+        # Sequences continue after the explicit ids.
+        Product.objects.create(name="Product", price=1)
+
+    def test_seed_data_is_deterministic(self):
+        self.seed(seed=3)
+        first = list(Order.objects.order_by('id').values_list(
+            'status', 'movement_type', 'total_amount'
+        ))
+        Order.objects.all().delete()
+        StockMovement.objects.all().delete()
+        Product.objects.all().delete()
+
+        self.seed(seed=3, users=0)
+        second = list(Order.objects.order_by('id').values_list(
+            'status', 'movement_type', 'total_amount'
+        ))
+        self.assertEqual(first, second)
+
+
+@override_settings(PRODUCT_CACHE={'TTL': 0})
+class CompiledSerializerTests(AuthenticatedAPITestCase):
+    exchange_rate = 3
+
+    def setUp(self):
+        super().setUp()
+        self.products = [
+            Product.objects.create(
+                price=10.5 * index, name=f"Product {index} \u2028 ñ",
+                available=bool(index % 2), stock=index
+            ) for index in range(1, 4)
+        ]
+        self.draft = Order.objects.create()
+        self.processed = Order.objects.create(
+            movement_type=Order.MovementStatus.INGRESS
+        )
+        for order in [self.draft, self.processed]:
+            for index, product in enumerate(self.products[:2], 1):
+                OrderDetail.objects.create(
+                    order=order, product=product, quantity=index
+                )
+        self.processed.refresh_from_db()
+        self.processed.status = Order.OrderStatus.PROCESSED
+        self.processed.stamp_totals(rate=2)
+        self.processed.save()
+
+    def assertSameResponse(self, url):
+        with override_settings(API_COMPILED_SERIALIZERS=False):
+            expected = self.client.get(url)
+        response = self.client.get(url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.content, expected.content)
+
+    def test_product_parity(self):
+        self.assertSameResponse(reverse("api:product-list"))
+        self.assertSameResponse(
+            reverse("api:product-list") + "?ordering=-created_at&in_stock=1"
+        )
+        self.assertSameResponse(
+            reverse("api:product-detail", args=[self.products[0].id])
+        )
+
+    def test_order_parity(self):
+        self.assertSameResponse(reverse("api:order-list"))
+        self.assertSameResponse(reverse("api:order-list") + "?page_size=1")
+        for order in [self.draft, self.processed]:
+            self.assertSameResponse(
+                reverse("api:order-detail", args=[order.id])
+            )
+
+    def test_product_list_reads_values(self):
+        plan = representations.get_plan(ProductReadOnlySerializer)
+        self.assertEqual(plan.columns, [
+            'id', 'available', 'created_at', 'name', 'price', 'reserved',
+            'stock', 'updated_at'
+        ])
+        # Orders nest details and read properties, so they need instances.
+        self.assertIsNone(representations.get_plan(OrderSerializer).columns)
+
+    @skipUnless(representations.orjson, "orjson is not installed")
+    def test_orjson_renderer(self):
+        data = OrderSerializer(
+            Order.objects.with_details().order_by('id'), many=True
+        ).data
+
+        self.assertEqual(
+            representations.ORJSONRenderer().render(data),
+            JSONRenderer().render(data)
+        )
+
+
+class SparseFieldsetTests(AuthenticatedAPITestCase):
+    exchange_rate = 2
+
+    def setUp(self):
+        super().setUp()
+        self.product = Product.objects.create(
+            price=10, name="Product 1", available=True, stock=5
+        )
+        self.order = Order.objects.create()
+        self.detail = OrderDetail.objects.create(
+            order=self.order, product=self.product, quantity=2
+        )
+        self.list_url = reverse("api:order-list")
+        self.detail_url = reverse("api:order-detail", args=[self.order.id])
+
+    def get(self, url, params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        details_queries = [
+            query for query in queries
+            if 'FROM "api_orderdetail"' in query['sql']
+        ]
+        return json.loads(response.content), details_queries
+
+    def test_fields(self):
+        data, details_queries = self.get(
+            self.list_url, {'fields': 'id,status,total'}
+        )
+
+        self.assertEqual(data['results'], [
+            {'id': self.order.id, 'status': 'DRAFT', 'total': 20.0}
+        ])
+        self.assertEqual(details_queries, [])
+        self.get_rate.assert_not_called()
+
+    def test_usd_total_field(self):
+        data, _ = self.get(self.detail_url, {'fields': 'id,usd_total'})
+
+        self.assertEqual(data, {'id': self.order.id, 'usd_total': 10.0})
+        self.get_rate.assert_called()
+
+    def test_expand(self):
+        data, details_queries = self.get(
+            self.detail_url, {'expand': 'details', 'fields': 'details'}
+        )
+        self.assertEqual(data, {'details': [{
+            'id': self.detail.id, 'product': self.product.id, 'quantity': 2,
+            'created_at': data['details'][0]['created_at'],
+            'updated_at': data['details'][0]['updated_at'],
+        }]})
+        self.assertNotIn('api_product', details_queries[0]['sql'])
+
+        data, _ = self.get(self.detail_url, {'expand': '', 'fields': 'details'})
+        self.assertEqual(data, {'details': [self.detail.id]})
+
+        data, _ = self.get(self.detail_url, {'expand': 'details.product'})
+        self.assertEqual(data['details'][0]['product']['id'], self.product.id)
+
+    def test_matches_serializers(self):
+        for params in [
+            {'fields': 'id,details,usd_total'}, {'expand': 'details'},
+            {'expand': '', 'fields': 'id,details'}
+        ]:
+            with override_settings(API_COMPILED_SERIALIZERS=False):
+                expected = self.client.get(self.detail_url, params)
+            response = self.client.get(self.detail_url, params)
+            self.assertEqual(response.content, expected.content)
+
+    def test_etag_follows_representation(self):
+        full = self.client.get(self.detail_url)
+        sparse = self.client.get(self.detail_url, {'fields': 'id'})
+
+        self.assertNotEqual(full['ETag'], sparse['ETag'])
+        response = self.client.get(
+            self.detail_url, {'fields': 'id'},
+            HTTP_IF_NONE_MATCH=sparse['ETag']
+        )
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_unknown_names(self):
+        response = self.client.get(self.list_url, {'fields': 'id,secret'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            json.loads(response.content)['message'],
+            enums.Errors.INVALID_FIELDS_ERROR.value.format('secret')
+        )
+
+        response = self.client.get(self.list_url, {'expand': 'product'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class ConnectionPoolTests(SimpleTestCase):
+    def test_connections_are_reused(self):
+        pool = ConnectionPool(max_size=2)
+        connection = pool.get(FakeConnection)
+        pool.put(connection)
+
+        self.assertIs(pool.get(FakeConnection), connection)
+        self.assertEqual(pool.size, 1)
+
+    def test_waits_for_a_connection(self):
+        pool = ConnectionPool(max_size=1, timeout=5)
+        connection = pool.get(FakeConnection)
+        timer = threading.Timer(0.05, pool.put, [connection])
+        timer.start()
+
+        self.assertIs(pool.get(FakeConnection), connection)
+        timer.join()
+
+    def test_timeout(self):
+        pool = ConnectionPool(max_size=1, timeout=0.05)
+        pool.get(FakeConnection)
+
+        with self.assertRaises(PoolTimeout):
+            pool.get(FakeConnection)
+
+    def test_unusable_connections_are_closed(self):
+        pool = ConnectionPool(
+            max_size=1, check=lambda connection: not connection.broken
+        )
+        connection = pool.get(FakeConnection)
+        connection.broken = True
+        pool.put(connection)
+
+        replacement = pool.get(FakeConnection)
+        replacement.broken = False
+        self.assertIsNot(replacement, connection)
+        self.assertTrue(connection.closed)
+
+        pool.put(replacement, reset=lambda connection: False)
+        self.assertTrue(replacement.closed)
+        self.assertEqual(pool.size, 0)
+
+    def test_idle_connections_expire(self):
+        pool = ConnectionPool(max_size=1, max_idle=0)
+        connection = pool.get(FakeConnection)
+        pool.put(connection)
+        time.sleep(0.01)
+
+        self.assertIsNot(pool.get(FakeConnection), connection)
+        self.assertTrue(connection.closed)
+
+    def test_close_all(self):
+        pool = ConnectionPool(max_size=2)
+        idle = pool.get(FakeConnection)
+        in_use = pool.get(FakeConnection)
+        pool.put(idle)
+
+        pool.close_all()
+        self.assertTrue(idle.closed)
+        self.assertFalse(in_use.closed)
+
+        pool.put(in_use)
+        self.assertTrue(in_use.closed)
+        self.assertEqual(pool.size, 0)
+        self.assertEqual(pool.idle, 0)
+
+    def test_failed_connect_frees_the_slot(self):
+        pool = ConnectionPool(max_size=1, timeout=0.05)
+
+        def connect():
+            raise ConnectionError()
+
+        with self.assertRaises(ConnectionError):
+            pool.get(connect)
+        self.assertIsInstance(pool.get(FakeConnection), FakeConnection)
+
+
+class HTTPClientTests(SimpleTestCase):
+    URL = 'https://upstream.test/rate'
+
+    def setUp(self):
+        self.adapter = TimedHTTPAdapter(failure_threshold=2, reset_timeout=30)
+        self.request = requests.Request('GET', self.URL).prepare()
+
+    def test_session_is_shared(self):
+        self.assertIs(get_http_session(), get_http_session())
+
+    @override_settings(HTTP_CLIENT={'POOL_MAXSIZE': 20})
+    def test_session_settings(self):
+        adapter = get_http_session().get_adapter(self.URL)
+        self.assertEqual(adapter._pool_maxsize, 20)
+        self.assertEqual(adapter.failure_threshold, 5)
+
+    def test_circuit_opens_after_failures(self):
+        with patch('requests.adapters.HTTPAdapter.send') as send:
+            send.side_effect = requests.ConnectionError
+            for _ in range(2):
+                with self.assertRaises(requests.ConnectionError):
+                    self.adapter.send(self.request)
+
+            with self.assertRaises(CircuitOpenError):
+                self.adapter.send(self.request)
+        self.assertEqual(send.call_count, 2)
+
+    def test_server_errors_count_as_failures(self):
+        with patch('requests.adapters.HTTPAdapter.send') as send:
+            send.return_value = Mock(status_code=503)
+            self.adapter.send(self.request)
+            self.adapter.send(self.request)
+
+            self.assertTrue(self.adapter.get_breaker(self.URL).is_open)
+            self.assertFalse(
+                self.adapter.get_breaker('https://other.test/').is_open
+            )
+
+    def test_half_open_trial(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.01)
+        breaker.record_failure()
+        self.assertFalse(breaker.allow())
+
+        time.sleep(0.02)
+        self.assertTrue(breaker.allow())
+        # A single trial call at a time.
+        self.assertFalse(breaker.allow())
+
+        breaker.record_success()
+        self.assertFalse(breaker.is_open)
+        self.assertTrue(breaker.allow())
+
+    def test_trial_raising_other_errors(self):
+        adapter = TimedHTTPAdapter(failure_threshold=1, reset_timeout=0.01)
+        with patch('requests.adapters.HTTPAdapter.send') as send:
+            send.side_effect = requests.ConnectionError
+            with self.assertRaises(requests.ConnectionError):
+                adapter.send(self.request)
+
+            time.sleep(0.02)
+            send.side_effect = ValueError
+            with self.assertRaises(ValueError):
+                adapter.send(self.request)
+
+            # The failed trial opened the circuit again, it isn't stuck.
+            time.sleep(0.02)
+            send.side_effect = None
+            send.return_value = Mock(status_code=200)
+            adapter.send(self.request)
+        self.assertFalse(adapter.get_breaker(self.URL).is_open)
+        self.assertEqual(send.call_count, 3)
+
+
+class ReplicaSetTests(SimpleTestCase):
+    def test_round_robin(self):
+        replica_set = replicas.ReplicaSet(['a', 'b'], 'round_robin')
+        self.assertEqual(
+            [replica_set.acquire() for _ in range(3)], ['a', 'b', 'a']
+        )
+
+    def test_least_loaded(self):
+        replica_set = replicas.ReplicaSet(['a', 'b'], 'least_loaded')
+        self.assertEqual(replica_set.acquire(), 'a')
+        self.assertEqual(replica_set.acquire(), 'b')
+        replica_set.release('b')
+        self.assertEqual(replica_set.acquire(), 'b')
+        replica_set.release('a')
+        replica_set.release('b')
+        # Ties are taken in turns.
+        self.assertEqual(replica_set.acquire(), 'a')
+
+    @override_settings(DATABASE_REPLICAS={'ALIASES': ['replica_1']})
+    def test_router(self):
+        router = replicas.ReplicaRouter()
+        self.assertIsNone(router.db_for_read(Product))
+        token = replicas._read_alias.set('replica_1')
+        try:
+            self.assertEqual(router.db_for_read(Product), 'replica_1')
+            self.assertEqual(router.db_for_write(Product), 'default')
+        finally:
+            replicas._read_alias.reset(token)
+        self.assertFalse(router.allow_migrate('replica_1', 'api'))
+        self.assertIsNone(router.allow_migrate('default', 'api'))
+
+
+# The default database stands in for a replica.
+@override_settings(DATABASE_REPLICAS={'ALIASES': ['default']})
+class ReplicaRoutingTests(AuthenticatedAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.order = Order.objects.create()
+
+    def get(self, url):
+        with patch.object(
+            replicas.ReplicaSet, 'acquire', autospec=True,
+            side_effect=replicas.ReplicaSet.acquire
+        ) as acquire:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(any(replicas.get_replica_set().in_use.values()))
+        return acquire.call_count
+
+    def test_reads_use_replicas(self):
+        self.assertEqual(self.get(reverse("api:order-list")), 1)
+        self.assertEqual(
+            self.get(reverse("api:order-detail", args=[self.order.id])), 1
+        )
+        self.assertEqual(self.get(reverse("api:product-export")), 1)
+
+    def test_reads_after_writes_use_primary(self):
+        order = Order.objects.create()
+        response = self.client.delete(
+            reverse("api:order-detail", args=[order.id])
+        )
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+        self.assertEqual(self.get(reverse("api:order-list")), 0)
+        caches['default'].delete(
+            replicas.STICKY_KEY.format(self.user.pk)
+        )
+        self.assertEqual(self.get(reverse("api:order-list")), 1)
+
+    @override_settings(DATABASE_REPLICAS={'ALIASES': []})
+    def test_without_replicas(self):
+        self.assertEqual(self.get(reverse("api:order-list")), 0)
+        self.assertFalse(replicas.is_sticky(self.user))
+
+    def test_failed_reads_release_replicas(self):
+        with patch(
+            'api.views.OrderViewSet.list', side_effect=RuntimeError
+        ), self.assertRaises(RuntimeError):
+            self.client.get(reverse("api:order-list"))
+
+        self.assertIsNone(replicas._read_alias.get())
+        self.assertFalse(any(replicas.get_replica_set().in_use.values()))
@@ -2,7 +2,7 @@ from django.urls import path, include
 from rest_framework import routers
 from rest_framework_nested import routers as nested_routers
 from api.views import (
-    OrderDetailViewSet, OrderViewSet, ProductViewSet
+    OrderDetailViewSet, OrderJobViewSet, OrderViewSet, ProductViewSet
 )
 
 app_name = 'api'
@@ -10,6 +10,7 @@ app_name = 'api'
 router = routers.DefaultRouter()
 router.register(r'products', ProductViewSet, basename='product')
 router.register(r'orders', OrderViewSet, basename='order')
+router.register(r'order-jobs', OrderJobViewSet, basename='order-job')
 
 order_details_router = nested_routers.NestedSimpleRouter(
     router, r'orders', lookup='order'
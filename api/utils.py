@@ -1,4 +1,11 @@
+import threading
+import time
+from urllib.parse import urlsplit
+
 import requests
+from api import metrics
+from django.conf import settings
+from django.core.signals import setting_changed
 from requests.adapters import HTTPAdapter
 from rest_framework.exceptions import APIException
 from rest_framework.response import Response
@@ -18,8 +25,121 @@ class CustomValidationError(APIException):
         return f"{self.error}"
 
 
+DEFAULT_HTTP_CLIENT_SETTINGS = {
+    'RETRIES': 3,
+    'BACKOFF_FACTOR': 0.3,
+    'POOL_CONNECTIONS': 10,
+    'POOL_MAXSIZE': 10,
+    'POOL_BLOCK': False,
+    'FAILURE_THRESHOLD': 5,
+    'RESET_TIMEOUT': 30,
+}
+
+
+class CircuitOpenError(requests.ConnectionError):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Fails calls fast for `reset_timeout` seconds once `failure_threshold`
+    consecutive calls failed. Then a single trial call is let through: its
+    success closes the circuit, and its failure opens it again.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if (
+                self._trial or
+                time.monotonic() - self.opened_at < self.reset_timeout
+            ):
+                return False
+            self._trial = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial = False
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """
+    Counts outbound calls as `http` time of the current request. With a
+    `failure_threshold`, every host gets a CircuitBreaker: server errors
+    and connection failures, once retries are exhausted, count as failures
+    and calls to an open circuit raise CircuitOpenError without retrying.
+    """
+
+    def __init__(self, failure_threshold=None, reset_timeout=30, **kwargs):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.breakers = {}
+        self._breakers_lock = threading.Lock()
+        super().__init__(**kwargs)
+
+    def get_breaker(self, url):
+        if not self.failure_threshold:
+            return None
+        host = urlsplit(url).netloc
+        with self._breakers_lock:
+            if host not in self.breakers:
+                self.breakers[host] = CircuitBreaker(
+                    self.failure_threshold, self.reset_timeout
+                )
+            return self.breakers[host]
+
+    def send(self, request, *args, **kwargs):
+        breaker = self.get_breaker(request.url) if request else None
+        if breaker and not breaker.allow():
+            raise CircuitOpenError(
+                f"Circuit open for {urlsplit(request.url).netloc}.",
+                request=request
+            )
+
+        with metrics.timer('http'):
+            try:
+                response = super().send(request, *args, **kwargs)
+            except Exception:
+                # Any error counts, so a failed trial call never leaves the
+                # circuit half open.
+                if breaker:
+                    breaker.record_failure()
+                raise
+
+        if breaker:
+            if response.status_code >= 500:
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+        return response
+
+
 def requests_retry_session(
-    retries=3, backoff_factor=0.3, status_forcelist=(500, 502, 504), session=None
+    retries=3, backoff_factor=0.3, status_forcelist=(500, 502, 504),
+    session=None, **adapter_kwargs
 ):
     session = session or requests.Session()
 
@@ -30,12 +150,57 @@ def requests_retry_session(
         backoff_factor=backoff_factor,
         status_forcelist=status_forcelist,
     )
-    adapter = HTTPAdapter(max_retries=retry)
+    adapter = TimedHTTPAdapter(max_retries=retry, **adapter_kwargs)
     session.mount("http://", adapter)
     session.mount("https://", adapter)
     return session
 
 
+def get_http_client_settings():
+    return {
+        **DEFAULT_HTTP_CLIENT_SETTINGS,
+        **getattr(settings, 'HTTP_CLIENT', {})
+    }
+
+
+_http_session = None
+_http_session_lock = threading.Lock()
+
+
+def get_http_session():
+    """
+    Session shared by the outbound calls of the process, so connections
+    (and their DNS lookups and TLS handshakes) are kept alive and reused.
+    """
+    global _http_session
+    if _http_session is None:
+        with _http_session_lock:
+            if _http_session is None:
+                config = get_http_client_settings()
+                _http_session = requests_retry_session(
+                    retries=config['RETRIES'],
+                    backoff_factor=config['BACKOFF_FACTOR'],
+                    pool_connections=config['POOL_CONNECTIONS'],
+                    pool_maxsize=config['POOL_MAXSIZE'],
+                    pool_block=config['POOL_BLOCK'],
+                    failure_threshold=config['FAILURE_THRESHOLD'],
+                    reset_timeout=config['RESET_TIMEOUT'],
+                )
+    return _http_session
+
+
+def reset_http_session(**kwargs):
+    global _http_session
+    if kwargs.get('setting', 'HTTP_CLIENT') == 'HTTP_CLIENT':
+        with _http_session_lock:
+            if _http_session is not None:
+                _http_session.close()
+            _http_session = None
+
+
+setting_changed.connect(reset_http_session)
+
+
 def custom_exception_handler(exc, context):
     handlers = {
         'CustomValidationError': _handle_custom_validation_error,
@@ -1,26 +1,103 @@
-from api import enums
+import math
+
+from api import (
+    catalog, conditional, enums, metrics, processing, replicas,
+    representations, search, stock
+)
+from api.exchange import ExchangeRateError
+from api.idempotency import idempotent
 from api.models import (
-    Order, OrderDetail, Product
+    Order, OrderDetail, OrderJob, Product, StockReservation,
+    order_details_prefetch
 )
 from api.permissions import (
     IsAuthenticatedAdminUser, IsAuthenticatedStaffUser,
     IsAuthenticatedSuperUser
 )
 from api.serializers import (
-    OrderDetailSerializer, OrderSerializer, OrderStatusSerializer,
-    ProductReadOnlySerializer, ProductSerializer
+    OrderBulkSerializer, OrderDetailSerializer, OrderJobSerializer,
+    OrderSerializer, OrderStatusSerializer, ProductReadOnlySerializer,
+    ProductSerializer
+)
+from api.exports import (
+    ORDER_EXPORT_COLUMNS, PRODUCT_EXPORT_COLUMNS, export_response
+)
+from api.utils import (
+    CustomValidationError, http_error_response, http_success_response
 )
-from api.utils import http_error_response, http_success_response
-from django.db.models import ProtectedError
+from django.conf import settings
+from django.db.models import Max, Prefetch, ProtectedError
+from requests import RequestException
 from rest_framework import mixins, status, viewsets
 from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
 
-class ProductViewSet(viewsets.ModelViewSet):
+def get_number_param(request, name):
+    value = request.query_params[name]
+    try:
+        number = float(value)
+    except ValueError:
+        number = math.nan
+    if not math.isfinite(number):
+        raise CustomValidationError(
+            enums.Errors.INVALID_NUMBER_ERROR.value.format(name),
+            status.HTTP_400_BAD_REQUEST
+        )
+    return number
+
+
+class ProductViewSet(
+    metrics.TimedSerializerMixin, replicas.ReplicaReadMixin,
+    conditional.ConditionalUpdateMixin, representations.CompiledReadMixin,
+    viewsets.ModelViewSet
+):
+    READ_ONLY_ACTIONS = ['list', 'retrieve', 'export']
+
+    compiled_values = True
     serializer_class = ProductReadOnlySerializer
 
+    def list(self, request, *args, **kwargs):
+        etag = self._get_products_etag()
+        return catalog.cached_response(
+            request, catalog.list_key(request, etag),
+            lambda: conditional.conditional_response(
+                request, lambda: etag,
+                lambda: super(ProductViewSet, self).list(
+                    request, *args, **kwargs
+                )
+            )
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        etag = self._get_product_etag(kwargs['pk'])
+        return catalog.cached_response(
+            request, catalog.product_key(request, kwargs['pk'], etag),
+            lambda: conditional.conditional_response(
+                request, lambda: etag,
+                lambda: super(ProductViewSet, self).retrieve(
+                    request, *args, **kwargs
+                )
+            )
+        )
+
+    def get_etag(self, instance):
+        return conditional.make_etag('product', instance.pk, instance.updated_at)
+
+    def _get_products_etag(self):
+        version = self.get_queryset().version()
+        return conditional.make_etag(
+            'products', self.request.build_absolute_uri(),
+            version['count'], version['updated_at']
+        )
+
+    def _get_product_etag(self, pk):
+        product = self.get_queryset().filter(pk=pk).only(
+            'id', 'updated_at'
+        ).first()
+        return self.get_etag(product) if product else None
+
     def destroy(self, request, *args, **kwargs):
         instance = self.get_object()
         try:
@@ -37,12 +114,49 @@ class ProductViewSet(viewsets.ModelViewSet):
         params = {}
 
         if 'available' in self.request.query_params:
-            params['available'] = self.request.query_params['available']
+            params['available'] = self._get_bool_param('available')
+        if 'min_price' in self.request.query_params:
+            params['price__gte'] = get_number_param(self.request, 'min_price')
+        if 'max_price' in self.request.query_params:
+            params['price__lte'] = get_number_param(self.request, 'max_price')
 
-        return Product.objects.filter(**params).order_by('id')
+        queryset = Product.objects.filter(**params)
+        if (
+            'in_stock' in self.request.query_params and
+            self._get_bool_param('in_stock')
+        ):
+            queryset = queryset.in_stock()
+        if self.request.query_params.get('search'):
+            queryset = search.search_products(
+                queryset, self.request.query_params['search']
+            )
+        return queryset.order_by('id')
+
+    def _get_bool_param(self, name):
+        value = self.request.query_params[name].lower()
+        if value in ['1', 'true', 't', 'yes']:
+            return True
+        if value in ['0', 'false', 'f', 'no']:
+            return False
+        raise CustomValidationError(
+            enums.Errors.INVALID_BOOLEAN_ERROR.value.format(name),
+            status.HTTP_400_BAD_REQUEST
+        )
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        return export_response(
+            self.get_queryset().using(self.read_alias),
+            PRODUCT_EXPORT_COLUMNS, 'products',
+            request.query_params.get('output', 'ndjson')
+        )
+
+    @action(detail=False, methods=['get'], url_path='cache-stats')
+    def cache_stats(self, request):
+        return http_success_response(catalog.get_stats(), status.HTTP_200_OK)
 
     def get_permissions(self):
-        if self.action not in ['list', 'retrieve']:
+        if self.action not in self.READ_ONLY_ACTIONS:
             self.permission_classes = [
                 IsAuthenticatedStaffUser | IsAuthenticatedAdminUser | IsAuthenticatedSuperUser,
             ]
@@ -51,20 +165,218 @@ class ProductViewSet(viewsets.ModelViewSet):
         return super(ProductViewSet, self).get_permissions()
 
     def get_serializer_class(self):
-        if self.action not in ['list', 'retrieve']:
+        if self.action not in self.READ_ONLY_ACTIONS:
             return ProductSerializer
         return ProductReadOnlySerializer
 
 
 class OrderViewSet(
-    viewsets.GenericViewSet, mixins.CreateModelMixin,
-    mixins.DestroyModelMixin, mixins.ListModelMixin,
-    mixins.RetrieveModelMixin
+    metrics.TimedSerializerMixin, replicas.ReplicaReadMixin,
+    representations.CompiledReadMixin, viewsets.GenericViewSet,
+    mixins.CreateModelMixin, mixins.DestroyModelMixin,
+    mixins.ListModelMixin, mixins.RetrieveModelMixin
 ):
-    queryset = Order.objects.all()
+    SPARSE_ACTIONS = ['list', 'retrieve']
+
     serializer_class = OrderSerializer
     permission_classes = [IsAuthenticated]
 
+    def get_queryset(self):
+        params = {}
+
+        if 'min_total' in self.request.query_params:
+            params['total_amount__gte'] = get_number_param(
+                self.request, 'min_total'
+            )
+        if 'max_total' in self.request.query_params:
+            params['total_amount__lte'] = get_number_param(
+                self.request, 'max_total'
+            )
+        if 'status' in self.request.query_params:
+            params['status'] = self.request.query_params['status']
+
+        queryset = Order.objects.filter(**params).order_by('id')
+        prefetch = self._get_details_prefetch()
+        if prefetch:
+            queryset = queryset.prefetch_related(prefetch)
+        return queryset
+
+    def _get_details_prefetch(self):
+        # Only the details rendered by ?fields= and ?expand= are loaded.
+        representation = self.get_representation()
+        fields = representation['fields']
+        expand = representation['expand']
+        if fields is not None and 'details' not in fields:
+            return None
+        if expand is None or 'details.product' in expand:
+            return order_details_prefetch()
+        if 'details' in expand:
+            return Prefetch(
+                'orderdetail_set', queryset=OrderDetail.objects.order_by('id')
+            )
+        return Prefetch(
+            'orderdetail_set',
+            queryset=OrderDetail.objects.only('id', 'order').order_by('id')
+        )
+
+    def get_representation(self):
+        """
+        Parses ?fields= and ?expand= on list and retrieve into the keyword
+        arguments of OrderSerializer, None standing for everything.
+        """
+        if getattr(self, '_representation', None) is not None:
+            return self._representation
+
+        representation = {'fields': None, 'expand': None}
+        if self.action not in self.SPARSE_ACTIONS:
+            return representation
+
+        params = self.request.query_params
+        if 'fields' in params:
+            fields = self._parse_names(params['fields'])
+            self._check_names(
+                fields, representations.get_plan(OrderSerializer).names,
+                enums.Errors.INVALID_FIELDS_ERROR
+            )
+            representation['fields'] = fields
+        if 'expand' in params:
+            expand = self._parse_names(params['expand'])
+            self._check_names(
+                expand, OrderSerializer.EXPANDABLE_FIELDS,
+                enums.Errors.INVALID_EXPAND_ERROR
+            )
+            if 'details.product' in expand:
+                expand |= {'details'}
+            representation['expand'] = expand
+        self._representation = representation
+        return representation
+
+    def _parse_names(self, value):
+        return frozenset(
+            name.strip() for name in value.split(',') if name.strip()
+        )
+
+    def _check_names(self, names, allowed, error):
+        unknown = names - set(allowed)
+        if unknown:
+            raise CustomValidationError(
+                error.value.format(', '.join(sorted(unknown))),
+                status.HTTP_400_BAD_REQUEST
+            )
+
+    def get_serializer(self, *args, **kwargs):
+        if self.action in self.SPARSE_ACTIONS:
+            kwargs.update(self.get_representation())
+        return super(OrderViewSet, self).get_serializer(*args, **kwargs)
+
+    def get_compiled_plan(self):
+        return representations.get_plan(
+            self.get_serializer_class(), **self.get_representation()
+        )
+
+    def list(self, request, *args, **kwargs):
+        return conditional.conditional_response(
+            request,
+            self._get_orders_list_etag,
+            lambda: super(OrderViewSet, self).list(request, *args, **kwargs)
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return conditional.conditional_response(
+            request,
+            lambda: self._get_order_etag(kwargs['pk']),
+            lambda: super(OrderViewSet, self).retrieve(
+                request, *args, **kwargs
+            )
+        )
+
+    def _get_orders_list_etag(self):
+        # The filtered table without joins, their details touch updated_at
+        # of the orders. Nested products are tagged by the latest product
+        # change, read from the updated_at index.
+        version = self.get_queryset().version(nested=False)
+        if self._renders_products():
+            version['products_updated_at'] = Product.objects.aggregate(
+                value=Max('updated_at')
+            )['value']
+        return self._make_orders_etag(
+            self.request.build_absolute_uri(), version
+        )
+
+    def _get_order_etag(self, pk):
+        version = self.get_queryset().filter(pk=pk).version()
+        if not version['count']:
+            return None
+        return self._make_orders_etag(pk, version)
+
+    def _renders_products(self):
+        representation = self.get_representation()
+        fields = representation['fields']
+        expand = representation['expand']
+        return (fields is None or 'details' in fields) and (
+            expand is None or 'details.product' in expand
+        )
+
+    def _renders_usd_total(self):
+        fields = self.get_representation()['fields']
+        return fields is None or 'usd_total' in fields
+
+    def _make_orders_etag(self, key, version):
+        # USD totals of orders not stamped yet follow the exchange rate.
+        # Without a rate the response is simply not tagged.
+        rate = None
+        if version['unstamped'] and self._renders_usd_total():
+            try:
+                rate = Order._get_usd_exchange_rate()
+            except (ExchangeRateError, RequestException, ValueError):
+                return None
+        return conditional.make_etag(
+            'orders', key, rate, self.request.query_params.get('fields'),
+            self.request.query_params.get('expand'),
+            *[version[field] for field in sorted(version)]
+        )
+
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        return super(OrderViewSet, self).create(request, *args, **kwargs)
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        # One flat row per order line, straight from a server side cursor.
+        return export_response(
+            Order.objects.using(self.read_alias).order_by(
+                'id', 'orderdetail__id'
+            ),
+            ORDER_EXPORT_COLUMNS, 'orders',
+            request.query_params.get('output', 'ndjson')
+        )
+
+    @action(
+        detail=False, methods=['post'], serializer_class=OrderBulkSerializer
+    )
+    def bulk(self, request):
+        max_items = getattr(settings, 'BULK_ORDER_MAX_ITEMS', 1000)
+        if not isinstance(request.data, list):
+            return http_error_response(
+                enums.Errors.BULK_ORDER_FORMAT_ERROR.value,
+                status.HTTP_400_BAD_REQUEST
+            )
+        if len(request.data) > max_items:
+            return http_error_response(
+                enums.Errors.BULK_ORDER_SIZE_ERROR.value.format(max_items),
+                status.HTTP_400_BAD_REQUEST
+            )
+
+        results = OrderBulkSerializer.bulk_create(request.data)
+        created = len([result for result in results if result['ok']])
+        if created == len(results):
+            status_code = status.HTTP_201_CREATED
+        elif created:
+            status_code = status.HTTP_207_MULTI_STATUS
+        else:
+            status_code = status.HTTP_400_BAD_REQUEST
+        return http_success_response(results, status_code)
+
     def _manage_order_status(self, order, order_status):
         if not order:
             return http_error_response(
@@ -72,46 +384,46 @@ class OrderViewSet(
                 status.HTTP_404_NOT_FOUND
             )
 
-        order.status = order_status
-        order.save()
-        return http_success_response(
-            OrderSerializer(order).data,
-            status.HTTP_200_OK
-        )
+        processing.set_order_status(order, order_status)
+        return self._order_response(order)
+
+    def _order_response(self, order):
+        with metrics.timer('serializer'):
+            data = OrderSerializer(order).data
+        return http_success_response(data, status.HTTP_200_OK)
 
     @action(
         detail=True, methods=['post'], serializer_class=OrderStatusSerializer
     )
+    @idempotent
     def process(self, request, pk=None):
-        order = Order.objects.get(id=pk)
-        if order.status not in Order.EDITABLE_STATUS:
-            return http_error_response(
-                enums.Errors.NOT_EDITABLE_ORDER_ERROR.value,
-                status.HTTP_400_BAD_REQUEST
-            )
+        order = self.get_queryset().select_for_update().get(id=pk)
+        if self._is_async_requested(request):
+            # Stock work is left to the process_order_jobs workers.
+            job = processing.enqueue_order(order)
+            with metrics.timer('serializer'):
+                data = OrderJobSerializer(
+                    job, context={'request': request}
+                ).data
+            response = http_success_response(data, status.HTTP_202_ACCEPTED)
+            response['Location'] = data['url']
+            return response
 
-        details = order.orderdetail_set.all()
-        for detail in details:
-            if order.movement_type == Order.MovementStatus.EGRESS.value:
-                if not detail.product.can_be_supplied(detail.quantity):
-                    return http_error_response(
-                        enums.Errors.STOCK_AVAILABILITY_ERROR.value,
-                        status.HTTP_400_BAD_REQUEST
-                    )
+        processing.process_order(order)
+        return self._order_response(order)
 
-                detail.product.substract_stock_quantity(detail.quantity)
-            else:
-                detail.product.add_stock_quantity(detail.quantity)
-
-        return self._manage_order_status(
-            order, Order.OrderStatus.PROCESSED.value
-        )
+    def _is_async_requested(self, request):
+        value = request.query_params.get('async')
+        if value is None:
+            return getattr(settings, 'ORDER_PROCESSING_ASYNC', False)
+        return value.lower() in ['1', 'true']
 
     @action(
         detail=True, methods=['post'], serializer_class=OrderStatusSerializer
     )
+    @idempotent
     def cancel(self, request, pk=None):
-        order = Order.objects.get(id=pk)
+        order = self.get_queryset().select_for_update().get(id=pk)
         if order.status == Order.OrderStatus.CANCELLED.value:
             return http_error_response(
                 enums.Errors.ORDER_ALREADY_CANCELLED.value,
@@ -120,27 +432,71 @@ class OrderViewSet(
 
         if order.status == Order.OrderStatus.PROCESSED.value:
             details = order.orderdetail_set.all()
-            for detail in details:
-                if order.movement_type == Order.MovementStatus.INGRESS.value:
-                    if not (detail.product.can_be_supplied(detail.quantity)):
-                        return Response({
-                            "ok": False,
-                            "message": "This order cant be cancelled due stock availability."
-                        }, status=status.HTTP_400_BAD_REQUEST)
-
-                    detail.product.substract_stock_quantity(detail.quantity)
-                else:
-                    detail.product.add_stock_quantity(detail.quantity)
+            if order.movement_type == Order.MovementStatus.INGRESS.value:
+                stock.substract_stock(
+                    details,
+                    enums.Errors.ORDER_CANCEL_STOCK_AVAILABILITY_ERROR.value
+                )
+            else:
+                stock.add_stock(details)
+        else:
+            StockReservation.objects.filter(order=order).release()
 
         return self._manage_order_status(
             order, Order.OrderStatus.CANCELLED.value
         )
 
 
-class OrderDetailViewSet(viewsets.ModelViewSet):
+class OrderJobViewSet(
+    metrics.TimedSerializerMixin, replicas.ReplicaReadMixin,
+    viewsets.ReadOnlyModelViewSet
+):
+    serializer_class = OrderJobSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        params = {}
+
+        if 'order' in self.request.query_params:
+            params['order'] = self.request.query_params['order']
+        if 'status' in self.request.query_params:
+            params['status'] = self.request.query_params['status']
+
+        return OrderJob.objects.filter(**params).order_by('id')
+
+
+class OrderDetailViewSet(
+    metrics.TimedSerializerMixin, replicas.ReplicaReadMixin,
+    conditional.ConditionalUpdateMixin, viewsets.ModelViewSet
+):
     serializer_class = OrderDetailSerializer
     permission_classes = [IsAuthenticated]
 
+    def retrieve(self, request, *args, **kwargs):
+        return conditional.conditional_response(
+            request,
+            lambda: self._get_order_detail_etag(kwargs['pk']),
+            lambda: super(OrderDetailViewSet, self).retrieve(
+                request, *args, **kwargs
+            )
+        )
+
+    def get_etag(self, instance):
+        return conditional.make_etag(
+            'order-detail', instance.pk, instance.updated_at,
+            instance.product.updated_at
+        )
+
+    def get_updated_etag(self, instance):
+        # Reservations may have touched the product meanwhile.
+        return self._get_order_detail_etag(instance.pk)
+
+    def _get_order_detail_etag(self, pk):
+        detail = self.get_queryset().filter(pk=pk).only(
+            'id', 'updated_at', 'product', 'product__updated_at'
+        ).first()
+        return self.get_etag(detail) if detail else None
+
     def get_serializer_context(self):
         context = super(OrderDetailViewSet, self).get_serializer_context()
         context.update({"order_pk": self.kwargs['order_pk']})
@@ -148,4 +504,6 @@ class OrderDetailViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         order_id = self.kwargs['order_pk']
-        return OrderDetail.objects.filter(order=order_id).order_by('id')
+        return OrderDetail.objects.filter(
+            order=order_id
+        ).select_related('product').order_by('id')
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -49,6 +50,7 @@ INSTALLED_APPS = [
 AUTH_USER_MODEL = 'custom_user.User'
 
 MIDDLEWARE = [
+    'api.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -82,21 +84,71 @@ WSGI_APPLICATION = 'clicoh_ecommerce.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.0/ref/settings/#databases
 
+def env_int(name, default):
+    value = os.environ.get(name, '')
+    return int(value) if value else default
+
+
+def env_bool(name, default):
+    value = os.environ.get(name, '')
+    return value.lower() in ['1', 'true', 'yes'] if value else default
+
+
+# api.db.postgresql adds CONN_HEALTH_CHECKS (checking persistent connections
+# before their first use in each request) and an in-process pool shared by
+# the threads of each process, enabled with DB_POOL_MAX_SIZE > 0. Pooled
+# connections are returned to the pool at the end of each request, so keep
+# DB_CONN_MAX_AGE at 0 with the pool.
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql_psycopg2',
-        'NAME': 'local_db',
-        'USER': 'postgres',
-        'PASSWORD': 'postgres',
-        'HOST': 'localhost',
-        'PORT': '5432',
+        'ENGINE': os.environ.get('DB_ENGINE', 'api.db.postgresql'),
+        'NAME': os.environ.get('DB_NAME', 'local_db'),
+        'USER': os.environ.get('DB_USER', 'postgres'),
+        'PASSWORD': os.environ.get('DB_PASSWORD', 'postgres'),
+        'HOST': os.environ.get('DB_HOST', 'localhost'),
+        'PORT': os.environ.get('DB_PORT', '5432'),
         'ATOMIC_REQUESTS': True,
+        'CONN_MAX_AGE': env_int('DB_CONN_MAX_AGE', 60),
+        'CONN_HEALTH_CHECKS': env_bool('DB_CONN_HEALTH_CHECKS', True),
+        'POOL': {
+            'MAX_SIZE': env_int('DB_POOL_MAX_SIZE', 0),
+            'TIMEOUT': env_int('DB_POOL_TIMEOUT', 5),
+            'MAX_IDLE': env_int('DB_POOL_MAX_IDLE', 300),
+        },
         'TEST': {
-            'NAME': 'test_db',
+            'NAME': os.environ.get('DB_TEST_NAME', 'test_db'),
         },
     }
 }
 
+# Read replicas of the default database, as comma separated HOST[:PORT] in
+# DB_REPLICA_HOSTS, become the aliases replica_1, replica_2... List,
+# retrieve and export requests are served by one of them (SELECTION is
+# 'least_loaded' or 'round_robin'), except for users who wrote in the last
+# STICKY_SECONDS. Tests run them against the test database of default.
+DATABASE_REPLICAS = {
+    'ALIASES': [],
+    'SELECTION': os.environ.get('DB_REPLICA_SELECTION', 'least_loaded'),
+    'STICKY_SECONDS': env_int('DB_REPLICA_STICKY_SECONDS', 5),
+    'CACHE_ALIAS': 'default',
+}
+
+for index, address in enumerate(
+    filter(None, os.environ.get('DB_REPLICA_HOSTS', '').split(',')), 1
+):
+    host, _, port = address.strip().partition(':')
+    DATABASES[f'replica_{index}'] = {
+        **DATABASES['default'],
+        'HOST': host,
+        'PORT': port or DATABASES['default']['PORT'],
+        # Nothing is written there, no transaction is needed.
+        'ATOMIC_REQUESTS': False,
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS['ALIASES'].append(f'replica_{index}')
+
+DATABASE_ROUTERS = ['api.replicas.ReplicaRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
@@ -122,8 +174,42 @@ REST_FRAMEWORK = {
     ],
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
     'EXCEPTION_HANDLER': 'api.utils.custom_exception_handler',
+    'DEFAULT_PAGINATION_CLASS': 'api.pagination.KeysetPagination',
+    'PAGE_SIZE': 100,
 }
 
+# Product and order list/retrieve responses are built by precompiled field
+# plans of their serializers (api.representations) instead of DRF field by
+# field serialization. The output is the same, set to False to compare.
+API_COMPILED_SERIALIZERS = True
+
+# Upper bound for the `page_size` query parameter on list endpoints.
+API_MAX_PAGE_SIZE = 1000
+
+# Rows fetched per round trip by the streaming export endpoints.
+EXPORT_CHUNK_SIZE = 2000
+
+# Maximum number of orders accepted by POST /api/v1/orders/bulk/.
+BULK_ORDER_MAX_ITEMS = 1000
+
+# When True POST /api/v1/orders/{id}/process/ only enqueues an OrderJob and
+# answers 202, the process_order_jobs command does the stock work. Clients
+# can also opt in per request with ?async=true.
+ORDER_PROCESSING_ASYNC = False
+
+# Without PostgreSQL full-text search, product searches are resolved by an
+# in-memory index and filtered by id. Searches matching more products than
+# this filter names with a regular expression in the database instead.
+PRODUCT_SEARCH_MAX_IDS = 1000
+
+# Seconds the response stored for an Idempotency-Key is replayed, expired
+# keys are deleted by the clear_idempotency_keys command.
+IDEMPOTENCY_KEY_TTL = 86400
+
+# Seconds a DRAFT EGRESS order holds its stock reservations before the
+# expire_reservations command gives them back.
+STOCK_RESERVATION_TTL = 900
+
 SPECTACULAR_SETTINGS = {
     'TITLE': 'Clicoh Ecommerce API',
     'DESCRIPTION': 'Project for backend developer position',
@@ -134,6 +220,57 @@ SPECTACULAR_SETTINGS = {
 
 APPEND_SLASH = True
 
+# Outbound HTTP calls share one keep-alive session per process, with
+# POOL_MAXSIZE connections per host (waiting for a free one when
+# POOL_BLOCK). After FAILURE_THRESHOLD failed calls to a host, calls to it
+# fail right away for RESET_TIMEOUT seconds instead of retrying.
+HTTP_CLIENT = {
+    'RETRIES': 3,
+    'BACKOFF_FACTOR': 0.3,
+    'POOL_CONNECTIONS': 10,
+    'POOL_MAXSIZE': 10,
+    'POOL_BLOCK': False,
+    'FAILURE_THRESHOLD': 5,
+    'RESET_TIMEOUT': 30,
+}
+
+# Exchange rate used by Order.usd_total. PROVIDER can be swapped by
+# 'api.exchange.StubExchangeRateProvider' (OPTIONS: {'rate': ...}) to work
+# offline. Set CACHE_ALIAS to share the cached rate between processes.
+# Processed orders are stamped with the latest ExchangeRate snapshot when it
+# is younger than SNAPSHOT_MAX_AGE seconds (see refresh_exchange_rates).
+EXCHANGE_RATE = {
+    'PROVIDER': 'api.exchange.DolarSiExchangeRateProvider',
+    'OPTIONS': {'timeout': 10},
+    'TTL': 300,
+    'STALE_TTL': 3600,
+    'CACHE_ALIAS': None,
+    'SNAPSHOT_MAX_AGE': 300,
+}
+
+# Per request timings are answered in a Server-Timing header and
+# aggregated per route name, in each process, at /metrics.
+METRICS_SERVER_TIMING = True
+
+# /metrics only answers requests from METRICS_ALLOWED_IPS or carrying
+# `Authorization: Bearer <METRICS_TOKEN>`.
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+# Product list and retrieve responses are cached per product and per query
+# string, keyed by the ETag of the rows they render. Set TTL to 0 to
+# disable. Hit and miss counters are served by /api/v1/products/cache-stats/.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+PRODUCT_CACHE = {
+    'CACHE_ALIAS': 'default',
+    'TTL': 300,
+}
+
 # Internationalization
 # https://docs.djangoproject.com/en/4.0/topics/i18n/
 
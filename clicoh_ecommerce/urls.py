@@ -13,6 +13,7 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from api.metrics import metrics_view
 from django.contrib import admin
 from django.urls import path, include
 from drf_spectacular.views import SpectacularAPIView, SpectacularRedocView
@@ -22,6 +23,7 @@ urlpatterns = [
     path('', include('user_management.urls', namespace='user-management')),
     path('api/v1/', include('api.urls', namespace='api')),
     path('auth/', include('jwt_auth.urls', namespace='jwt-auth')),
+    path('metrics', metrics_view, name='metrics'),
     # API documentation
     path('api/schema/', SpectacularAPIView.as_view(), name='schema'),
     path(